@@ -2,8 +2,10 @@ from flask import Flask, request, session, jsonify, redirect, render_template
 from views.api import api_bp
 from views.site import site_bp
 from views.misc import misc_bp
-from utils.settings import first_run, first_run_detect_language, get_settings
+from utils.settings import first_run, first_run_detect_language, update_schema, update_schema_detect_language, \
+    get_settings
 from utils.scheduler import init_scheduler
+from utils import h_ids
 from flask.logging import default_handler
 import logging
 import os
@@ -27,9 +29,12 @@ if not os.path.isfile("data/mml.sqlite3"):
     os.makedirs("data/thumbnails", exist_ok=True)
     os.makedirs("data/backups", exist_ok=True)
     first_run()
+update_schema()
+h_ids.refresh(force=True)
 
 if not os.path.isfile("data/detect_language.sqlite3"):
     first_run_detect_language()
+update_schema_detect_language()
 
 get_settings(app)
 
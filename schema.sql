@@ -1,4 +1,4 @@
-create table authors
+create table if not exists authors
 (
     id     INTEGER
         primary key autoincrement,
@@ -11,7 +11,7 @@ create table authors
     name   TEXT
 );
 
-create table genres
+create table if not exists genres
 (
     id    INTEGER
         primary key autoincrement,
@@ -19,20 +19,20 @@ create table genres
         unique
 );
 
-create table nhentai_ids
+create table if not exists nhentai_ids
 (
     nhentai_id INTEGER not null
         primary key
 );
 
-create table schale_ids
+create table if not exists schale_ids
 (
     schale_id  INTEGER not null
         primary key,
     schale_key TEXT    not null
 );
 
-create table series
+create table if not exists series
 (
     id                 INTEGER
         primary key autoincrement,
@@ -65,16 +65,25 @@ create table series
                     'Novel', 'Artbook', 'Other'))
 );
 
-create index idx_series_status
+create index if not exists idx_series_status
     on series (status);
 
-create index idx_series_type
+create index if not exists idx_series_type
     on series (type);
 
-create index idx_status_time
+create index if not exists idx_status_time
     on series (timestamp_status);
 
-create table series_authors
+create index if not exists idx_series_title
+    on series (title);
+
+create index if not exists idx_series_status_title
+    on series (status, title);
+
+create index if not exists idx_series_status_time
+    on series (status, timestamp_status);
+
+create table if not exists series_authors
 (
     series_id   INTEGER not null
         references series
@@ -87,10 +96,16 @@ create table series_authors
     check (author_type IN ('Author', 'Artist', 'Both'))
 );
 
-create index idx_series_authors
+create index if not exists idx_series_authors
     on series_authors (series_id);
 
-create table series_genres
+create index if not exists idx_series_authors_author
+    on series_authors (author_id, author_type);
+
+create index if not exists idx_authors_name
+    on authors (name collate nocase);
+
+create table if not exists series_genres
 (
     series_id INTEGER not null
         references series
@@ -101,10 +116,10 @@ create table series_genres
     primary key (series_id, genre_id)
 );
 
-create index idx_series_genres
+create index if not exists idx_series_genres
     on series_genres (series_id);
 
-create table series_nhentai_ids
+create table if not exists series_nhentai_ids
 (
     series_id  INTEGER not null
         references series
@@ -115,7 +130,7 @@ create table series_nhentai_ids
     primary key (series_id, nhentai_id)
 );
 
-create table series_ratings_dex
+create table if not exists series_ratings_dex
 (
     id_dex TEXT    not null
         primary key
@@ -125,10 +140,10 @@ create table series_ratings_dex
     votes  INTEGER not null
 );
 
-create index idx_series_ratings_dex
+create index if not exists idx_series_ratings_dex
     on series_ratings_dex (rating);
 
-create table series_ratings_mal
+create table if not exists series_ratings_mal
 (
     id_mal INTEGER not null
         primary key
@@ -138,10 +153,10 @@ create table series_ratings_mal
     votes  INTEGER not null
 );
 
-create index idx_series_ratings_mal
+create index if not exists idx_series_ratings_mal
     on series_ratings_mal (rating);
 
-create table series_ratings_mu
+create table if not exists series_ratings_mu
 (
     id_mu  TEXT    not null
         primary key
@@ -151,10 +166,10 @@ create table series_ratings_mu
     votes  INTEGER not null
 );
 
-create index idx_series_ratings_mu
+create index if not exists idx_series_ratings_mu
     on series_ratings_mu (rating);
 
-create table series_schale_ids
+create table if not exists series_schale_ids
 (
     series_id INTEGER not null
         references series
@@ -165,7 +180,7 @@ create table series_schale_ids
     primary key (series_id, schale_id)
 );
 
-create table series_thumbnails
+create table if not exists series_thumbnails
 (
     extension   TEXT              not null,
     series_id   integer           not null
@@ -173,10 +188,14 @@ create table series_thumbnails
         references series
             on delete cascade,
     url         TEXT              not null,
-    integration BOOLEAN default 1 not null
+    integration BOOLEAN default 1 not null,
+    hash        TEXT
 );
 
-create table series_titles
+create index if not exists idx_series_thumbnails_hash
+    on series_thumbnails (hash);
+
+create table if not exists series_titles
 (
     id        INTEGER
         primary key autoincrement,
@@ -187,12 +206,469 @@ create table series_titles
     unique (series_id, alt_title)
 );
 
-create index idx_alt_titles
+create index if not exists idx_alt_titles
     on series_titles (series_id);
 
-create table settings
+create table if not exists settings
 (
     key   TEXT not null
         primary key,
     value TEXT
-)
\ No newline at end of file
+);
+
+create virtual table if not exists series_fts using fts5
+(
+    title,
+    alt_titles,
+    description,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+create trigger if not exists series_fts_insert
+    after insert
+    on series
+begin
+    insert into series_fts (rowid, title, alt_titles, description)
+    values (new.id, new.title,
+            (select group_concat(alt_title, ' / ') from series_titles where series_id = new.id),
+            new.description);
+end;
+
+create trigger if not exists series_fts_update
+    after update of title, description
+    on series
+begin
+    update series_fts set title = new.title, description = new.description where rowid = new.id;
+end;
+
+create trigger if not exists series_fts_delete
+    after delete
+    on series
+begin
+    delete from series_fts where rowid = old.id;
+end;
+
+create trigger if not exists series_titles_fts_insert
+    after insert
+    on series_titles
+begin
+    update series_fts
+    set alt_titles = (select group_concat(alt_title, ' / ') from series_titles where series_id = new.series_id)
+    where rowid = new.series_id;
+end;
+
+create trigger if not exists series_titles_fts_delete
+    after delete
+    on series_titles
+begin
+    update series_fts
+    set alt_titles = (select group_concat(alt_title, ' / ') from series_titles where series_id = old.series_id)
+    where rowid = old.series_id;
+end;
+
+-- Row counts for /api/v1/status, kept up to date by the triggers below.
+-- name: 'series', 'authors', 'nhentai_ids', 'schale_ids', 'status:<status>' or 'type:<type>'; 'version' and 'h_version' (see below)
+create table if not exists counters
+(
+    name  TEXT    not null
+        primary key,
+    value INTEGER not null default 0
+);
+
+create trigger if not exists series_counters_insert
+    after insert
+    on series
+begin
+    insert into counters (name, value)
+    values ('series', 1), ('status:' || coalesce(new.status, ''), 1), ('type:' || coalesce(new.type, ''), 1)
+    on conflict (name) do update set value = value + 1;
+end;
+
+create trigger if not exists series_counters_update
+    after update of status, type
+    on series
+    when old.status is not new.status or old.type is not new.type
+begin
+    update counters
+    set value = value - 1
+    where name in ('status:' || coalesce(old.status, ''), 'type:' || coalesce(old.type, ''));
+    insert into counters (name, value)
+    values ('status:' || coalesce(new.status, ''), 1), ('type:' || coalesce(new.type, ''), 1)
+    on conflict (name) do update set value = value + 1;
+end;
+
+create trigger if not exists series_counters_delete
+    after delete
+    on series
+begin
+    update counters
+    set value = value - 1
+    where name in ('series', 'status:' || coalesce(old.status, ''), 'type:' || coalesce(old.type, ''));
+end;
+
+create trigger if not exists authors_counters_insert
+    after insert
+    on authors
+begin
+    insert into counters (name, value) values ('authors', 1) on conflict (name) do update set value = value + 1;
+end;
+
+create trigger if not exists authors_counters_delete
+    after delete
+    on authors
+begin
+    update counters set value = value - 1 where name = 'authors';
+end;
+
+create trigger if not exists nhentai_ids_counters_insert
+    after insert
+    on nhentai_ids
+begin
+    insert into counters (name, value) values ('nhentai_ids', 1) on conflict (name) do update set value = value + 1;
+end;
+
+create trigger if not exists nhentai_ids_counters_delete
+    after delete
+    on nhentai_ids
+begin
+    update counters set value = value - 1 where name = 'nhentai_ids';
+end;
+
+create trigger if not exists schale_ids_counters_insert
+    after insert
+    on schale_ids
+begin
+    insert into counters (name, value) values ('schale_ids', 1) on conflict (name) do update set value = value + 1;
+end;
+
+create trigger if not exists schale_ids_counters_delete
+    after delete
+    on schale_ids
+begin
+    update counters set value = value - 1 where name = 'schale_ids';
+end;
+
+
+-- Change version behind the API ETags: any write to data served by the API bumps it
+insert or ignore into counters (name, value)
+values ('version', 0);
+
+create trigger if not exists series_version_insert
+    after insert
+    on series
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_version_update
+    after update
+    on series
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_version_delete
+    after delete
+    on series
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_authors_version_insert
+    after insert
+    on series_authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_authors_version_update
+    after update
+    on series_authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_authors_version_delete
+    after delete
+    on series_authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_genres_version_insert
+    after insert
+    on series_genres
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_genres_version_update
+    after update
+    on series_genres
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_genres_version_delete
+    after delete
+    on series_genres
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_titles_version_insert
+    after insert
+    on series_titles
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_titles_version_update
+    after update
+    on series_titles
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_titles_version_delete
+    after delete
+    on series_titles
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_thumbnails_version_insert
+    after insert
+    on series_thumbnails
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_thumbnails_version_update
+    after update
+    on series_thumbnails
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_thumbnails_version_delete
+    after delete
+    on series_thumbnails
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mu_version_insert
+    after insert
+    on series_ratings_mu
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mu_version_update
+    after update
+    on series_ratings_mu
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mu_version_delete
+    after delete
+    on series_ratings_mu
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_dex_version_insert
+    after insert
+    on series_ratings_dex
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_dex_version_update
+    after update
+    on series_ratings_dex
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_dex_version_delete
+    after delete
+    on series_ratings_dex
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mal_version_insert
+    after insert
+    on series_ratings_mal
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mal_version_update
+    after update
+    on series_ratings_mal
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists series_ratings_mal_version_delete
+    after delete
+    on series_ratings_mal
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists authors_version_insert
+    after insert
+    on authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists authors_version_update
+    after update
+    on authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists authors_version_delete
+    after delete
+    on authors
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists nhentai_ids_version_insert
+    after insert
+    on nhentai_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists nhentai_ids_version_update
+    after update
+    on nhentai_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists nhentai_ids_version_delete
+    after delete
+    on nhentai_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists schale_ids_version_insert
+    after insert
+    on schale_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists schale_ids_version_update
+    after update
+    on schale_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists schale_ids_version_delete
+    after delete
+    on schale_ids
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists settings_version_insert
+    after insert
+    on settings
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists settings_version_update
+    after update
+    on settings
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+create trigger if not exists settings_version_delete
+    after delete
+    on settings
+begin
+    update counters set value = value + 1 where name = 'version';
+end;
+
+-- Change version of nhentai_ids and schale_ids, checked by the in-memory copies of utils/h_ids.py
+insert or ignore into counters (name, value)
+values ('h_version', 0);
+
+create trigger if not exists nhentai_ids_h_version_insert
+    after insert
+    on nhentai_ids
+begin
+    update counters set value = value + 1 where name = 'h_version';
+end;
+
+create trigger if not exists nhentai_ids_h_version_delete
+    after delete
+    on nhentai_ids
+begin
+    update counters set value = value + 1 where name = 'h_version';
+end;
+
+create trigger if not exists schale_ids_h_version_insert
+    after insert
+    on schale_ids
+begin
+    update counters set value = value + 1 where name = 'h_version';
+end;
+
+create trigger if not exists schale_ids_h_version_delete
+    after delete
+    on schale_ids
+begin
+    update counters set value = value + 1 where name = 'h_version';
+end;
+
+-- MangaUpdates list sync checkpoints, one row per list (see utils/mangaupdates_integration.py).
+-- watermark: newest time_added/last_updated already synced; synced: start of the last completed sync, local status
+-- changes after it are synced too; pages: pages of the download started at run_started that are saved in mu_sync_pages
+create table if not exists mu_sync
+(
+    list        TEXT    not null
+        primary key,
+    watermark   INTEGER not null default 0,
+    full_sync   INTEGER not null default 0,
+    synced      INTEGER not null default 0,
+    run_started INTEGER,
+    pages       INTEGER not null default 0
+);
+
+create table if not exists mu_sync_pages
+(
+    list TEXT    not null,
+    page INTEGER not null,
+    data TEXT    not null,
+    primary key (list, page)
+);
+
+-- Series dex_fetch_ids searched MangaDex for without finding them, retried once next_try has passed (or the title
+-- has changed); the delay doubles with every attempt
+create table if not exists dex_fetch_misses
+(
+    series_id INTEGER not null
+        primary key
+        references series
+            on delete cascade,
+    attempts  INTEGER not null default 1,
+    next_try  INTEGER not null,
+    title     TEXT
+);
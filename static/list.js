@@ -308,7 +308,7 @@ function renderSeriesTable(seriesData) {
 }
 
 function createSeriesRow(series) {
-    const thumbnailUrl = `/static/thumbnails/${series.id}.${series.thumbnail_ext}`;
+    const thumbnailUrl = `/thumbnails/${series.id}?w=256`;
 
     // Create title section
     const titleSection = createTitleSection(series);
@@ -325,7 +325,7 @@ function createSeriesRow(series) {
     return `
         <tr>
             <td>
-                <img src="${thumbnailUrl}" alt="${series.title}" class="thumbnail">
+                <img src="${thumbnailUrl}" srcset="${thumbnailUrl} 1x, /thumbnails/${series.id}?w=512 2x" alt="${series.title}" class="thumbnail" loading="lazy">
             </td>
             <td>${titleSection}</td>
             <td>${genresList}</td>
@@ -2,11 +2,12 @@ from flask import current_app as app
 from utils.mangaupdates import get_id_url as get_id_mu
 from utils.line import get_id as get_id_line
 from utils.bato_worker import worker
-from utils.detect_language import detect_language
+from utils.detect_language import detect_languages
 from utils.common_code import author_type_merger
 from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from typing import Dict, Any
+from utils import http_client
 import requests
 import random
 import re
@@ -38,7 +39,7 @@ def series(id_bato: int) -> Tuple[Dict[str, str], int]:
             url = f"https://{r}/series/{id_bato}"
             mirrors_.remove(r)
 
-            response = requests.get(url, timeout=10)
+            response = http_client.get(url, timeout=10)
             if response.text == "404 Page Not Found (1)":
                 return {"result": "KO", "error": "Series not found"}, 404
             response.raise_for_status()
@@ -98,8 +99,9 @@ def series(id_bato: int) -> Tuple[Dict[str, str], int]:
     alt_titles_ = soup.select_one("div.pb-2.alias-set.line-b-f")
     if alt_titles_ and alt_titles_.get_text(strip=True):
         alt_titles_all = [t.strip() for t in alt_titles_.get_text().split('/')]
+    languages = detect_languages(alt_titles_all)
     for t in alt_titles_all:
-        lang, confidence = detect_language(t)
+        lang, confidence = languages[t]
         if confidence and lang in accepted_languages:
             alt_titles.append(t)
 
@@ -1,5 +1,7 @@
 from flask import current_app as app
 from typing import List, Dict, Any
+import base64
+import json
 import re
 
 
@@ -68,6 +70,10 @@ def valid_ids(ids: Dict[str, Any], reduced: bool = False) -> Dict[str, Any]:
     ids = {k: v for k, v in ids.items() if k in valid_keys and v is not None}
     if not ids:
         return {}
+    # JSON bodies may carry numeric ids as numbers
+    ids = {k: str(v) if isinstance(v, int) and not isinstance(v, bool) else v for k, v in ids.items()}
+    if any(not isinstance(v, str) for v in ids.values()):
+        return {}
     if any(not value.isdigit() for value in [ids[k] for k in ["mal", "bato"] if k in ids]):
         return {}
     if "line" in ids and not (
@@ -81,3 +87,17 @@ def valid_ids(ids: Dict[str, Any], reduced: bool = False) -> Dict[str, Any]:
     if "dex" in ids and not re.fullmatch(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", ids["dex"]):
         return {}
     return ids
+
+
+# Opaque keyset pagination token: the sort key values of the last row on a page
+def encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return []
+    return values if isinstance(values, list) else []
@@ -1,52 +1,33 @@
-import requests
+from utils import thumbnails
 from flask import current_app as app
+from utils.db_series import hydrate_series
+from utils.db import get_cursor
 import sqlite3
 from typing import Tuple, Union, Dict, List, Any
 
 
 def download_thumbnail(series_id: int, thumbnail: str, cursor: sqlite3.Cursor) -> Tuple[dict, int]:
     try:
-        if thumbnail.startswith("line://"):
-            from utils.line import get_thumbnail
-            img = get_thumbnail(thumbnail[7:])
-            if not img:
-                app.logger.error(f"Failed to download image from {thumbnail}")
-                return {"result": "KO", "error": "Failed to download thumbnail"}, 502
-            ext = thumbnail[-3:]
-        else:
-            import requests
-            response = requests.get(thumbnail)
-            if response.status_code != 200:
-                app.logger.error(f"Failed to download image from {thumbnail}, status code: {response.status_code}")
-                return {"result": "KO", "error": "Failed to download thumbnail"}, 502
-            ext = response.headers.get("Content-Type").split("/")[-1]
-            img = response.content
-        with open(f"data/thumbnails/{series_id}.{ext}", "wb") as f:
-            f.write(img)
-        cursor.execute("INSERT INTO series_thumbnails (series_id, extension, url) VALUES (?, ?, ?)",
-                       (series_id, ext, thumbnail))
+        hash_, ext = thumbnails.download(thumbnail)
+        if not hash_:
+            return {"result": "KO", "error": "Failed to download thumbnail"}, 502
+        cursor.execute("INSERT INTO series_thumbnails (series_id, extension, url, hash) VALUES (?, ?, ?, ?)",
+                       (series_id, ext, thumbnail, hash_))
         return {"result": "OK"}, 201
     except Exception as e:
         app.logger.error(f"Failed to download the image from {thumbnail}: {e}")
         return {"result": "KO", "error": "Failed to download thumbnail"}, 500
 
 
+# The replaced image stays in the store until thumbnails.gc() finds it unreferenced.
+# Callers call thumbnails.relink() after committing, the link is not touched before that
 def update_thumbnail(series_id: int, thumbnail: str, cursor: sqlite3.Cursor) -> Tuple[Dict[str, str], int]:
     try:
-        response = requests.get(thumbnail)
-        if response.status_code != 200:
-            app.logger.error(f"Failed to download image from {thumbnail}, status code: {response.status_code}")
+        hash_, ext = thumbnails.download(thumbnail)
+        if not hash_:
             return {"result": "KO", "error": "Failed to download thumbnail"}, 502
-        ext = response.headers.get("Content-Type").split("/")[-1]
-        cursor.execute("SELECT extension FROM series_thumbnails WHERE series_id = ?", (series_id,))
-        old_ext = cursor.fetchone()[0]
-        if old_ext != ext:
-            cursor.execute(f"UPDATE series_thumbnails SET extension = ?, url = ? WHERE series_id = ?",
-                           (ext, thumbnail, series_id))
-        with open(f"data/thumbnails/{series_id}.{old_ext}", "wb") as f:
-            f.write(b"")
-        with open(f"data/thumbnails/{series_id}.{ext}", "wb") as f:
-            f.write(response.content)
+        cursor.execute("UPDATE series_thumbnails SET extension = ?, url = ?, hash = ? WHERE series_id = ?",
+                       (ext, thumbnail, hash_, series_id))
         return {"result": "OK"}, 201
     except Exception as e:
         app.logger.error(f"Failed to update the image for series {series_id}: {e}")
@@ -96,6 +77,88 @@ def get_author_id(author: Dict[str, Union[str, int]], cursor: sqlite3.Cursor) ->
         return [], 500
 
 
+# get_author_id for many authors at once: one lookup per id type and one executemany per write. Returns an
+# (ids, status) pair per author, in order; 201 marks authors created here, 409 carries the conflicting ids.
+def get_author_ids(authors: List[Dict[str, Any]], cursor: sqlite3.Cursor) -> List[Tuple[List[int], int]]:
+    keys = ("mu", "dex", "mal")
+    specs = [{k: str(v) for k, v in (a.get("ids") or {}).items() if k in keys and v} for a in authors]
+    found: Dict[str, Dict[str, int]] = {k: {} for k in keys}  # type: {external id: author id}
+    rows: Dict[int, List[Any]] = {}  # author id: [id_mu, id_dex, id_mal]
+
+    def lookup(wanted: Dict[str, set]) -> None:
+        for k in keys:
+            values = list(wanted[k])
+            for i in range(0, len(values), 500):
+                chunk = values[i:i + 500]
+                cursor.execute(f"SELECT id, id_mu, id_dex, id_mal FROM authors WHERE id_{k} IN ({", ".join("?" for _ in chunk)})",
+                               chunk)
+                for r in cursor.fetchall():
+                    rows[r[0]] = list(r[1:])
+                    for k2, v in zip(keys, r[1:]):
+                        if v is not None:
+                            found[k2][str(v)] = r[0]
+
+    lookup({k: {s[k] for s in specs if k in s} for k in keys})
+
+    # Authors to create get negative placeholder ids, so later rows with the same external ids resolve to them
+    new: Dict[int, str] = {}  # placeholder: name
+    fills: Dict[str, Dict[int, str]] = {k: {} for k in keys}  # type: {author id: external id to add}
+    results = []
+    for author, ids in zip(authors, specs):
+        if not ids:
+            results.append(([], 400))
+            continue
+        matches = sorted({found[k][v] for k, v in ids.items() if v in found[k]})
+        if not matches:
+            placeholder = -len(new) - 1
+            new[placeholder] = author.get("name")
+            rows[placeholder] = [ids.get(k) for k in keys]
+            for k, v in ids.items():
+                found[k][v] = placeholder
+            results.append(([placeholder], 201))
+        elif len(matches) == 1:
+            author_id = matches[0]
+            if len(ids) > 1:
+                for i, k in enumerate(keys):
+                    if k in ids and not rows[author_id][i]:
+                        rows[author_id][i] = ids[k]
+                        found[k][ids[k]] = author_id
+                        if author_id > 0:
+                            fills[k][author_id] = ids[k]
+            results.append(([author_id], 200))
+        else:
+            results.append((matches, 409))
+
+    if new:
+        cursor.executemany("INSERT INTO authors (id_mu, id_dex, id_mal, name) VALUES (?, ?, ?, ?)",
+                           [(*rows[p], name) for p, name in new.items()])
+        # External ids are unique, so each new row is found again through the first one it has
+        wanted = {k: set() for k in keys}
+        for p in new:
+            k, v = next((k, v) for k, v in zip(keys, rows[p]) if v)
+            wanted[k].add(v)
+        lookup(wanted)
+        real = {p: found[k][v] for p in new for k, v in zip(keys, rows[p]) if v}
+        results = [([real.get(i, i) for i in ids], s) for ids, s in results]
+    for k in keys:
+        if fills[k]:
+            cursor.executemany(f"UPDATE authors SET id_{k} = ? WHERE id = ?", [(v, i) for i, v in fills[k].items()])
+    return results
+
+
+# Series matching each set of external ids, with one IN lookup per id type; returns the sorted series ids per input
+def find_series_ids(ids_list: List[Dict[str, Any]], cursor: sqlite3.Cursor) -> List[List[int]]:
+    existing = {k: {} for k in ("mu", "dex", "bato", "line", "mal")}  # type: {external id: series id}
+    for k in existing:
+        values = list({str(ids[k]) for ids in ids_list if k in ids})
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            cursor.execute(f"SELECT id, id_{k} FROM series WHERE id_{k} IN ({", ".join("?" for _ in chunk)})", chunk)
+            existing[k].update({str(r[1]): r[0] for r in cursor.fetchall()})
+    return [sorted({existing[k][str(v)] for k, v in ids.items() if k in existing and str(v) in existing[k]})
+            for ids in ids_list]
+
+
 def get_series_info(id_: int, cursor: sqlite3.Cursor) -> Tuple[Dict[str, Any], int]:
     try:
         cursor.execute("""
@@ -107,145 +170,113 @@ def get_series_info(id_: int, cursor: sqlite3.Cursor) -> Tuple[Dict[str, Any], i
         row = cursor.fetchone()
         if not row:
             return {"result": "KO", "error": "Series not found"}, 404
-        cursor.execute("SELECT alt_title FROM series_titles WHERE series_id = ?", (id_,))
-        alt_titles = [t[0] for t in cursor.fetchall()]
-        cursor.execute(
-            "SELECT g.genre FROM genres g LEFT JOIN series_genres sg ON g.id = sg.genre_id WHERE sg.series_id = ?",
-            (id_,))
-        genres = [g[0] for g in cursor.fetchall()]
-        cursor.execute(
-            "SELECT DISTINCT a.id, a.name, sa.author_type FROM authors a LEFT JOIN series_authors sa ON a.id = sa.author_id WHERE sa.series_id = ?",
-            (id_,))
-        authors = [{"id": a[0], "name": a[1], "type": a[2]} for a in cursor.fetchall()]
-        ratings = {}
-
-        ext_ids = {"mu": row["id_mu"], "dex": row["id_dex"], "mal": row["id_mal"]}
-        for i, ext_id in ext_ids.items():
-            if ext_id:
-                cursor.execute(f"SELECT rating FROM series_ratings_{i} WHERE id_{i} = ?", (ext_id,))
-                r = cursor.fetchone()
-                if r:
-                    ratings[i] = r[0]
-
-        series_data = {
-            "id": id_,
-            "thumbnail_ext": row["extension"],
-            "ids": {
-                "mu": row["id_mu"],
-                "dex": row["id_dex"],
-                "mal": row["id_mal"],
-                "bato": row["id_bato"],
-                "line": row["id_line"],
-            },
-            "title": row["title"],
-            "alt_titles": alt_titles,
-            "type": row["type"],
-            "description": row["description"],
-            "vol_ch": row["vol_ch"],
-            "is_md": bool(row["is_md"]),
-            "genres": genres,
-            "status": row["status"],
-            "year": row["year"],
-            "authors": authors,
-            "ratings": ratings,
-            "user_rating": row["user_rating"],
-        }
-        return series_data, 200
+        return hydrate_series([row], cursor)[0], 200
 
     except Exception as e:
         app.logger.error(e)
         return {"result": "KO", "error": "Internal error"}, 500
 
 
-def update_ratings(type_: str, data: List[Dict[str, Union[int, str, float]]]) -> Tuple[list, int]:
+def _load_ratings(data: List[Dict[str, Union[int, str, float]]], cursor: sqlite3.Cursor) -> None:
+    rows = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        id_: Union[int, str] = item.get("id")
+        rating = item.get("rating")
+        if id_ is None or rating is None:
+            continue
+
+        try:
+            rating = float(rating)
+        except Exception:
+            continue
+        if not (1 <= rating <= 10):
+            continue
+        votes = item.get("votes")
+        if not isinstance(votes, int) or isinstance(votes, bool) or votes < 1:
+            votes = None
+        rows[id_] = (id_, rating, votes)
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS ratings_import (id PRIMARY KEY, rating REAL NOT NULL, votes INTEGER)")
+    cursor.execute("DELETE FROM temp.ratings_import")
+    cursor.executemany("INSERT INTO temp.ratings_import (id, rating, votes) VALUES (?, ?, ?)", rows.values())
+
+
+# Returns {"created": n, "updated": n, "unchanged": n, "not_exist": [ids not in series]}
+def update_ratings(type_: str, data: List[Dict[str, Union[int, str, float]]]) -> Tuple[Dict[str, Any], int]:
     try:
-        not_exist = []
-        to_create = []
-        to_update = []
-
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        for item in data:
-            if not isinstance(item, dict):
-                continue
-            id_: Union[int, str] = item.get("id")
-            rating = item.get("rating")
-            if id_ is None or rating is None:
-                continue
-
-            try:
-                rating = float(rating)
-            except Exception:
-                continue
-            if not (1 <= rating <= 10):
-                continue
-            cursor.execute(f"SELECT 1 FROM series WHERE id_{type_} = ?", (id_,))
-            if cursor.fetchone() is None:
-                not_exist.append(str(id_))
-                continue
-
-            cursor.execute(f"SELECT rating FROM series_ratings_{type_} WHERE id_{type_} = ?", (id_,))
-            row = cursor.fetchone()
-            if row is None:
-                to_create.append((id_, rating))
-            else:
-                if rating != row[0]:
-                    to_update.append((rating, id_))
-
-        if to_create:
-            cursor.executemany(f"INSERT INTO series_ratings_{type_} (id_{type_}, rating) VALUES (?, ?)", to_create)
-            conn.commit()
-        if to_update:
-            cursor.executemany(f"UPDATE series_ratings_{type_} SET rating = ? WHERE id_{type_} = ?", to_update)
-            conn.commit()
-
-        cursor.close()
-        app.logger.info(f"{type_} ratings updated")
-        return not_exist, 200
+        with get_cursor() as cursor:
+            _load_ratings(data, cursor)
+            cursor.execute(f"""
+                           SELECT i.id
+                           FROM temp.ratings_import i
+                           WHERE NOT EXISTS (SELECT 1 FROM series s WHERE s.id_{type_} = i.id)
+                           """)
+            not_exist = [str(r[0]) for r in cursor.fetchall()]
+            cursor.execute(f"""
+                           SELECT count(*) FILTER (WHERE r.rating IS NULL),
+                                  count(*) FILTER (WHERE r.rating != i.rating OR r.votes != i.votes),
+                                  count(*) FILTER (WHERE r.rating = i.rating AND r.votes = coalesce(i.votes, r.votes))
+                           FROM temp.ratings_import i
+                                    LEFT JOIN series_ratings_{type_} r ON r.id_{type_} = i.id
+                           WHERE EXISTS (SELECT 1 FROM series s WHERE s.id_{type_} = i.id)
+                           """)
+            created, updated, unchanged = cursor.fetchone()
+
+            cursor.execute(f"""
+                           INSERT INTO series_ratings_{type_} (id_{type_}, rating, votes)
+                           SELECT i.id, i.rating, coalesce(i.votes, r.votes, 0)
+                           FROM temp.ratings_import i
+                                    LEFT JOIN series_ratings_{type_} r ON r.id_{type_} = i.id
+                           WHERE EXISTS (SELECT 1 FROM series s WHERE s.id_{type_} = i.id)
+                           ON CONFLICT (id_{type_}) DO UPDATE SET rating = excluded.rating, votes = excluded.votes
+                           WHERE rating != excluded.rating OR votes != excluded.votes
+                           """)
+            cursor.execute("DELETE FROM temp.ratings_import")
+            cursor.connection.commit()
+
+            app.logger.info(f"{type_} ratings updated: {created} created, {updated} updated, {unchanged} unchanged")
+            return {"created": created, "updated": updated, "unchanged": unchanged, "not_exist": not_exist}, 200
     except Exception as e:
         app.logger.error(e)
-        return [], 500
+        return {}, 500
 
 
-def update_user_ratings(type_: str, data: List[Dict[str, Union[int, str, float]]]) -> bool:
+def update_user_ratings(type_: str, data: List[Dict[str, Union[int, str, float]]]) -> Tuple[Dict[str, Any], int]:
     try:
-        to_update = []
-
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        for item in data:
-            if not isinstance(item, dict):
-                continue
-            id_: Union[int, str] = item.get("id")
-            rating = item.get("rating")
-            if id_ is None or rating is None:
-                continue
-
-            try:
-                rating = float(rating)
-            except Exception:
-                continue
-            if not (1 <= rating <= 10):
-                continue
-            cursor.execute(f"SELECT user_rating FROM series WHERE id_{type_} = ?", (id_,))
-            row = cursor.fetchone()
-            if row is None:
-                continue
-            if row[0] != rating:
-                to_update.append((id_, rating))
-
-        if to_update:
-            cursor.executemany(f"UPDATE series SET user_rating = ? WHERE id_{type_} = ?", to_update)
-            conn.commit()
-
-        cursor.close()
-        app.logger.info("User ratings updated")
-        return True
+        with get_cursor() as cursor:
+            _load_ratings(data, cursor)
+            cursor.execute(f"""
+                           SELECT i.id
+                           FROM temp.ratings_import i
+                           WHERE NOT EXISTS (SELECT 1 FROM series s WHERE s.id_{type_} = i.id)
+                           """)
+            not_exist = [str(r[0]) for r in cursor.fetchall()]
+            cursor.execute(f"""
+                           SELECT count(*) FILTER (WHERE s.user_rating IS NULL),
+                                  count(*) FILTER (WHERE s.user_rating != i.rating),
+                                  count(*) FILTER (WHERE s.user_rating = i.rating)
+                           FROM temp.ratings_import i
+                                    JOIN series s ON s.id_{type_} = i.id
+                           """)
+            created, updated, unchanged = cursor.fetchone()
+
+            cursor.execute(f"""
+                           UPDATE series
+                           SET user_rating = i.rating
+                           FROM temp.ratings_import i
+                           WHERE series.id_{type_} = i.id
+                             AND series.user_rating IS NOT i.rating
+                           """)
+            cursor.execute("DELETE FROM temp.ratings_import")
+            cursor.connection.commit()
+
+            app.logger.info(f"{type_} user ratings updated: {created} created, {updated} updated, {unchanged} unchanged")
+            return {"created": created, "updated": updated, "unchanged": unchanged, "not_exist": not_exist}, 200
     except Exception as e:
         app.logger.error(e)
-        return False
+        return {}, 500
 
 
 def add_series_data(id_: int, data: Dict[str, Any], cursor: sqlite3.Cursor) -> bool:
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from typing import Iterator
+import threading
+import sqlite3
+import os
+
+DB_PATH = "data/mml.sqlite3"
+
+_pragmas = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA cache_size = -16000",  # 16 MiB
+    "PRAGMA mmap_size = 268435456",  # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+)
+
+# One connection per (process, thread, database). Gunicorn and Celery fork their workers,
+# so the pid is part of the key and a child never reuses a connection opened by its parent.
+_local = threading.local()
+
+
+def _open(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10)
+    for pragma in _pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.pool = {}
+        _local.depth = {}
+    conn = _local.pool.get(path)
+    if conn is None:
+        conn = _local.pool[path] = _open(path)
+        _local.depth[path] = 0
+    return conn
+
+
+# Changes must be committed with cursor.connection.commit(). Whatever is still uncommitted when the outermost
+# block exits is rolled back, so a failed request never leaks an open transaction into the next one.
+@contextmanager
+def get_cursor(row: bool = False, path: str = DB_PATH) -> Iterator[sqlite3.Cursor]:
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    if row:
+        cursor.row_factory = sqlite3.Row
+    _local.depth[path] += 1
+    try:
+        yield cursor
+    finally:
+        _local.depth[path] -= 1
+        cursor.close()
+        if not _local.depth[path] and conn.in_transaction:
+            conn.rollback()
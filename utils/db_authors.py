@@ -1,11 +1,28 @@
 from flask import current_app as app
 import sqlite3
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional
+
+
+_types = ("Author", "Artist", "Both")
+
+# Per-type series counts of the authors in "a", one row per author: id, name, series, as_author, as_artist, as_both
+_counts = """
+          count(sa.series_id) AS series,
+          count(*) FILTER (WHERE sa.author_type = 'Author') AS as_author,
+          count(*) FILTER (WHERE sa.author_type = 'Artist') AS as_artist,
+          count(*) FILTER (WHERE sa.author_type = 'Both') AS as_both
+"""
 
 
 def get_author(id_: int, cursor: sqlite3.Cursor) -> Tuple[Dict[str, Any], int]:
     try:
-        cursor.execute(f"SELECT * FROM authors WHERE id = ?", (id_,))
+        cursor.execute(f"""
+                       SELECT a.id, a.id_mu, a.id_dex, a.id_mal, a.name, {_counts}
+                       FROM authors a
+                                LEFT JOIN series_authors sa ON sa.author_id = a.id
+                       WHERE a.id = ?
+                       GROUP BY a.id
+                       """, (id_,))
         a = cursor.fetchone()
         if not a:
             return {"result": "KO", "error": "No author found"}, 404
@@ -17,33 +34,77 @@ def get_author(id_: int, cursor: sqlite3.Cursor) -> Tuple[Dict[str, Any], int]:
                 "mal": a[3],
             },
             "name": a[4],
-            "series": {}
+            "series": {"as_" + t.lower(): a[6 + x] for x, t in enumerate(_types)}
         }
-        cursor.executemany("SELECT COUNT(*) FROM series_authors WHERE author_id = ? and author_type = ?",
-                           [(id_, i) for i in ["Author", "Artist", "Both"]])
-        series = cursor.fetchall()
-        for i in ["Author", "Artist", "Both"]:
-            author["series"]["as_" + i.lower()] = series[["Author", "Artist", "Both"].index(i)][0]
         return author, 200
     except Exception as e:
         app.logger.error(e)
         return {"result": "KO", "error": "Internal error"}, 500
 
 
-def get_authors(page: int, cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+# sort_by: "id", "name" (case-insensitive) or "series" (most series first)
+# after: sort key of the last author on the previous page (see author_sort_key), seeks instead of OFFSET
+# name: case-insensitive name prefix
+def get_authors(page: int, cursor: sqlite3.Cursor, after: Optional[List[Any]] = None, sort_by: str = "id",
+                name: str = "") -> List[Dict[str, Any]]:
     try:
         per_page = 100
-        offset = (page - 1) * per_page
-        cursor.execute("SELECT id, name FROM authors LIMIT ? OFFSET ?", (per_page, offset))
-        _authors = cursor.fetchall()
+        where = []
+        params = []
+        if name:
+            where.append("a.name >= ? COLLATE NOCASE AND a.name < ? COLLATE NOCASE")
+            params.extend([name, name + "\U0010ffff"])
+        if after and sort_by == "id":
+            where.append("a.id > ?")
+            params.append(after[0])
+        elif after and sort_by == "name" and after[0] is None:
+            where.append("(a.name IS NOT NULL OR a.id > ?)")
+            params.append(after[1])
+        elif after and sort_by == "name":
+            where.append("a.name IS NOT NULL AND (a.name COLLATE NOCASE, a.id) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(where)}" if where else ""
+        offset = 0 if after else (page - 1) * per_page
+
+        if sort_by == "series":
+            # The count is only known after aggregating, so the page is cut from the aggregated rows
+            having = "HAVING (-count(sa.series_id), a.id) > (?, ?)" if after else ""
+            cursor.execute(f"""
+                           SELECT a.id, a.name, {_counts}
+                           FROM authors a
+                                    LEFT JOIN series_authors sa ON sa.author_id = a.id
+                           {where}
+                           GROUP BY a.id
+                           {having}
+                           ORDER BY series DESC, a.id
+                           LIMIT ? OFFSET ?
+                           """, params + (after or []) + [per_page, offset])
+        else:
+            order = "a.id" if sort_by == "id" else "a.name COLLATE NOCASE, a.id"
+            # Page the authors on the index first, then count the series of those 100 only
+            cursor.execute(f"""
+                           SELECT a.id, a.name, {_counts}
+                           FROM (SELECT a.id, a.name FROM authors a {where} ORDER BY {order} LIMIT ? OFFSET ?) a
+                                    LEFT JOIN series_authors sa ON sa.author_id = a.id
+                           GROUP BY a.id
+                           ORDER BY {order}
+                           """, params + [per_page, offset])
 
         authors = []
-        for a in _authors:
-            cursor.execute("SELECT COUNT(*) FROM series_authors WHERE author_id = ?", (a[0],))
+        for a in cursor.fetchall():
             authors.append({"id": a[0],
                             "name": a[1],
-                            "series": cursor.fetchone()[0]})
+                            "series": a[2],
+                            "series_by_type": {"as_" + t.lower(): a[3 + x] for x, t in enumerate(_types)}})
         return authors
     except Exception as e:
         app.logger.error(e)
         return []
+
+
+def author_sort_key(author: Dict[str, Any], sort_by: str) -> List[Any]:
+    if sort_by == "name":
+        return [author["name"], author["id"]]
+    if sort_by == "series":
+        return [-author["series"], author["id"]]
+    return [author["id"]]
@@ -0,0 +1,112 @@
+import sqlite3
+import re
+from typing import Dict, Any, List, Iterator
+
+
+def _in(ids: List[int]) -> str:
+    return ", ".join("?" for _ in ids)
+
+
+def _group(rows: List[tuple], key: int = 0) -> Dict[Any, list]:
+    grouped = {}
+    for r in rows:
+        grouped.setdefault(r[key], []).append(r)
+    return grouped
+
+
+# rows: "SELECT s.*, si.extension FROM series s LEFT JOIN series_thumbnails si ..." with sqlite3.Row as row_factory
+def hydrate_series(rows: List[sqlite3.Row], cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    if not rows:
+        return []
+    ids = [row["id"] for row in rows]
+
+    cursor.execute(f"""
+                   SELECT sa.series_id, a.id, a.name, sa.author_type
+                   FROM series_authors sa
+                            JOIN authors a ON sa.author_id = a.id
+                   WHERE sa.series_id IN ({_in(ids)})
+                   """, ids)
+    authors = _group(cursor.fetchall())
+
+    cursor.execute(f"""
+                   SELECT sg.series_id, g.genre
+                   FROM series_genres sg
+                            JOIN genres g ON sg.genre_id = g.id
+                   WHERE sg.series_id IN ({_in(ids)})
+                   ORDER BY sg.series_id, sg.genre_id
+                   """, ids)
+    genres = _group(cursor.fetchall())
+
+    cursor.execute(f"SELECT series_id, alt_title FROM series_titles WHERE series_id IN ({_in(ids)}) ORDER BY id", ids)
+    alt_titles = _group(cursor.fetchall())
+
+    ratings = {}
+    for i in ("mu", "dex", "mal"):
+        ext_ids = [row[f"id_{i}"] for row in rows if row[f"id_{i}"]]
+        if not ext_ids:
+            ratings[i] = {}
+            continue
+        cursor.execute(f"SELECT id_{i}, rating FROM series_ratings_{i} WHERE id_{i} IN ({_in(ext_ids)})", ext_ids)
+        ratings[i] = {r[0]: r[1] for r in cursor.fetchall()}
+
+    series = []
+    for row in rows:
+        id_ = row["id"]
+        series.append({
+            "id": id_,
+            "thumbnail_ext": row["extension"],
+            "ids": {
+                "mu": row["id_mu"],
+                "dex": row["id_dex"],
+                "mal": row["id_mal"],
+                "bato": row["id_bato"],
+                "line": row["id_line"],
+            },
+            "title": row["title"],
+            "alt_titles": [t[1] for t in alt_titles.get(id_, [])],
+            "type": row["type"],
+            "description": row["description"],
+            "vol_ch": row["vol_ch"],
+            "is_md": bool(row["is_md"]),
+            "genres": [g[1] for g in genres.get(id_, [])],
+            "status": row["status"],
+            "year": row["year"],
+            "authors": [{"id": a[1], "name": a[2], "type": a[3]} for a in authors.get(id_, [])],
+            "ratings": {i: ratings[i][row[f"id_{i}"]] for i in ("mu", "dex", "mal") if row[f"id_{i}"] in ratings[i]},
+            "user_rating": row["user_rating"],
+        })
+    return series
+
+
+# Every word is matched as a prefix ("one pie" -> "one"* "pie"*), case and diacritics are folded by the tokenizer
+def fts_query(text: str) -> str:
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_series(text: str, limit: int, cursor: sqlite3.Cursor) -> List[sqlite3.Row]:
+    query = fts_query(text)
+    if not query:
+        return []
+    cursor.execute("""
+                   SELECT s.*, si.extension
+                   FROM series_fts f
+                            JOIN series s ON s.id = f.rowid
+                            LEFT JOIN series_thumbnails si ON s.id = si.series_id
+                   WHERE series_fts MATCH ?
+                   ORDER BY bm25(series_fts, 10.0, 5.0, 1.0)
+                   LIMIT ?
+                   """, (query, limit))
+    return cursor.fetchall()
+
+
+# Every series in id order, hydrated batch by batch so memory does not grow with the library
+def iter_series(cursor: sqlite3.Cursor, hydrate_cursor: sqlite3.Cursor, batch: int = 500) -> Iterator[Dict[str, Any]]:
+    cursor.execute("""
+                   SELECT s.*, si.extension
+                   FROM series s
+                            LEFT JOIN series_thumbnails si ON s.id = si.series_id
+                   ORDER BY s.id
+                   """)
+    while rows := cursor.fetchmany(batch):
+        yield from hydrate_series(rows, hydrate_cursor)
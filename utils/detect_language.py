@@ -1,37 +1,138 @@
 from flask import current_app as app
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional
+from utils.db import get_cursor
+import threading
+import re
 import time
-import sqlite3
 import asyncio
 from googletrans import Translator
 
+DB_PATH = "data/detect_language.sqlite3"
+cache_size = 4096
+concurrency = 8
+min_confidence = 0.8
 
-def detect_language(title) -> tuple[str, bool]:
+_hangul = re.compile(r"[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]")
+_kana = re.compile(r"[\u3040-\u30ff\u31f0-\u31ff\uff66-\uff9f]")
+_han = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_ascii_letter = re.compile(r"[A-Za-z]")
+_word = re.compile(r"[A-Za-z]+")
+# A word made only of Hepburn syllables ("shingeki", "no", "kyojin") is probably romanized Japanese, not English
+_romaji = re.compile(r"(?:(?:[kgszjtdnhbpmr]?y?|sh|ch|ts|f|w)[aiueo]|n)+", re.IGNORECASE)
+# Plain ASCII is also Spanish, Indonesian, French...; only titles with one of these words are taken as English
+_english = {"the", "of", "and", "with", "my", "your", "his", "her", "is", "are", "was", "for", "from", "you", "i", "it",
+            "this", "that", "what", "who", "how", "when", "not", "be", "into", "at", "an", "by", "on", "to", "after",
+            "about"}
+
+
+# Resolves titles whose script leaves no doubt; returns None when the remote detector has to decide
+def classify_script(title: str) -> Optional[Tuple[str, float]]:
+    letters = sum(1 for c in title if c.isalpha())
+    if letters < 2:
+        return None
+    hangul = len(_hangul.findall(title))
+    kana = len(_kana.findall(title))
+    han = len(_han.findall(title))
+    latin = len(_ascii_letter.findall(title))
+
+    if hangul and not kana and hangul / letters >= 0.5:
+        return "ko", 1.0
+    if kana and (kana + han) / letters >= 0.5:
+        return "ja", 1.0
+    if han and not hangul and han / letters >= 0.5 and han + latin == letters:
+        return "zh-CN", 0.9
+    if latin == letters and title.isascii():
+        words = _word.findall(title)
+        romaji = sum(1 for w in words if _romaji.fullmatch(w))
+        if romaji * 2 < len(words) and any(w.lower() in _english for w in words):
+            return "en", 0.9
+    return None
+
+
+# title: (lang, confidence), most recently used last
+_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_get(titles: List[str]) -> Dict[str, Tuple[str, float]]:
+    found = {}
+    with _lock:
+        for t in titles:
+            if t in _cache:
+                _cache.move_to_end(t)
+                found[t] = _cache[t]
+    return found
+
+
+def _cache_put(results: Dict[str, Tuple[str, float]]) -> None:
+    with _lock:
+        for t, v in results.items():
+            _cache[t] = v
+            _cache.move_to_end(t)
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+
+
+async def _detect_all(titles: List[str]) -> Dict[str, Tuple[str, float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with Translator() as translator:
+        async def _detect(text):
+            async with semaphore:
+                result = await translator.detect(text)
+                return result.lang, result.confidence
+
+        results = await asyncio.gather(*(_detect(t) for t in titles), return_exceptions=True)
+
+    detected = {}
+    for t, r in zip(titles, results):
+        if isinstance(r, BaseException):
+            app.logger.error(f"for {t}: {r}")
+            continue
+        detected[t] = r
+    return detected
+
+
+# Returns {title: (lang, confident)} for every title; titles that could not be detected get ("_", False)
+def detect_languages(titles: List[str]) -> Dict[str, Tuple[str, bool]]:
+    titles = list(dict.fromkeys(titles))
+    if not titles:
+        return {}
+    found = _cache_get(titles)
     try:
-        conn_lang = sqlite3.connect('data/detect_language.sqlite3')
-        cursor_lang = conn_lang.cursor()
-        cursor_lang.execute("SELECT lang, confidence FROM titles WHERE title = ?", (title,))
-        row = cursor_lang.fetchone()
-        if row:
-            lang, confidence = row
-            conn_lang.close()
-            return lang, confidence > 0.8
-
-        translator = Translator()
-
-        def _detect_language(text):
-            result = asyncio.run(translator.detect(text))
-            return result.lang, result.confidence
-
-        lang, confidence = _detect_language(title)
-        timestamp = int(time.time())
-        cursor_lang.execute(
-            "INSERT OR REPLACE INTO titles (title, lang, confidence, timestamp) VALUES (?, ?, ?, ?)",
-            (title, lang, confidence, timestamp)
-        )
-        conn_lang.commit()
-        conn_lang.close()
-
-        return lang, confidence > 0.8
+        misses = [t for t in titles if t not in found]
+        if misses:
+            with get_cursor(path=DB_PATH) as cursor:
+                for i in range(0, len(misses), 500):
+                    chunk = misses[i:i + 500]
+                    cursor.execute(f"SELECT title, lang, confidence FROM titles WHERE title IN ({", ".join("?" for _ in chunk)})",
+                                   chunk)
+                    stored = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+                    found.update(stored)
+                    _cache_put(stored)
+
+                misses = [t for t in misses if t not in found]
+                detected = {}
+                for t in misses:
+                    if r := classify_script(t):
+                        detected[t] = (*r, "script")
+                misses = [t for t in misses if t not in detected]
+                if misses:
+                    detected.update({t: (*r, "googletrans") for t, r in asyncio.run(_detect_all(misses)).items()})
+                if detected:
+                    timestamp = int(time.time())
+                    cursor.executemany(
+                        "INSERT OR REPLACE INTO titles (title, lang, confidence, timestamp, source) VALUES (?, ?, ?, ?, ?)",
+                        [(t, lang, confidence, timestamp, source) for t, (lang, confidence, source) in detected.items()])
+                    cursor.connection.commit()
+                    detected = {t: (lang, confidence) for t, (lang, confidence, _) in detected.items()}
+                    found.update(detected)
+                    _cache_put(detected)
     except Exception as e:
-        app.logger.error(f"for {title}: {e}")
-        return "_", False
\ No newline at end of file
+        app.logger.error(f"for {titles}: {e}")
+
+    return {t: (found[t][0], found[t][1] > min_confidence) if t in found else ("_", False) for t in titles}
+
+
+def detect_language(title) -> tuple[str, bool]:
+    return detect_languages([title])[title]
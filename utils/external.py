@@ -5,38 +5,91 @@ import utils.myanimelist as mal
 import utils.bato as bato
 import utils.line as line
 from utils.common_code import author_id_merger
-from typing import Dict, Any, Tuple, List, Union
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time
+from typing import Dict, Any, Optional, Tuple
 
 
-def _merge_ids(base_ids: Dict[str, Any], new_ids: Dict[str, Any]) -> Dict[str, Any]:
+# Sources whose results can reveal the ids of other sources, in the order their ids are trusted
+id_sources = ("dex", "bato", "mu")
+deadline = 30
+
+
+def _merge_ids(base_ids: Dict[str, Any], new_ids: Dict[str, Any], log: bool = True) -> Dict[str, Any]:
     for key, value in new_ids.items():
         if key in base_ids and base_ids[key] != value:
-            app.logger.info(f"Conflict in IDs for {key}. Existing: {base_ids}, New: {new_ids}")
+            if log:
+                app.logger.info(f"Conflict in IDs for {key}. Existing: {base_ids}, New: {new_ids}")
         else:
             base_ids[key] = value
     return base_ids
 
 
-def series_data_external(ids: dict) -> Tuple[Dict[str, Any], int]:
-    sources = (
-        ("dex", dex),
-        ("bato", bato),
-        ("mu", mu),
-        ("mal", mal),
-        ("line", line),
-    )
+# Replays the merges in id_sources order, so the outcome does not depend on which fetch finished first
+def _resolve_ids(ids: Dict[str, Any], results: Dict[Tuple[str, Any], Dict[str, Any]], log: bool = False) \
+        -> Dict[str, Any]:
+    ids = ids.copy()
+    for source_id in id_sources:
+        if (r := results.get((source_id, ids.get(source_id)))) is not None:
+            ids = _merge_ids(ids, r["ids"], log)
+    return ids
+
+
+# prefetched: {source: data} already fetched by the caller for ids[source], those sources are not fetched again
+def series_data_external(ids: dict, prefetched: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[Dict[str, Any], int]:
+    sources = {
+        "dex": dex,
+        "bato": bato,
+        "mu": mu,
+        "mal": mal,
+        "line": line,
+    }
+    flask_app = app._get_current_object()
+
+    def fetch(module, id_):
+        with flask_app.app_context():
+            return module.series(id_)
+
     http_codes = []
+    results = {(source_id, ids[source_id]): r for source_id, r in (prefetched or {}).items() if source_id in ids}
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="external")
+    try:
+        end = time() + deadline
+        while True:
+            # Start every source whose id is known (or has changed) and has not been fetched with it yet
+            known = _resolve_ids(ids, results)
+            for source_id, module in sources.items():
+                key = (source_id, known.get(source_id))
+                if key[1] is not None and key not in results and key not in pending.values():
+                    pending[executor.submit(fetch, module, key[1])] = key
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=max(end - time(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                app.logger.warning(f"Deadline reached for {ids}, skipping: {sorted(k[0] for k in pending.values())}")
+                http_codes.append(502)
+                break
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    r, s = future.result()
+                except Exception as e:
+                    app.logger.error(f"Fetching {key}: {e}")
+                    r, s = {}, 500
+                if s == 200:
+                    results[key] = r
+                else:
+                    results[key] = None
+                    http_codes.append(s)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    ids = _resolve_ids(ids, results, log=True)
     data_results = {}
-    for source_id, module in sources:
-        if source_id in ids:
-            r, s = module.series(ids[source_id])
-            if s == 200:
-                data_results[source_id] = r
-                if source_id in ["dex", "bato", "mu"]:
-                    ids = _merge_ids(ids, r["ids"])
-            else:
-                http_codes.append(s)
+    for source_id in sources:
+        if (r := results.get((source_id, ids.get(source_id)))) is not None:
+            data_results[source_id] = r
 
     # Priority order: mu > dex > mal > bato > line
     priority_sources = ("mu", "dex", "mal", "bato", "line")
@@ -0,0 +1,89 @@
+from utils.db import get_cursor
+from array import array
+from bisect import bisect_left
+from time import monotonic
+from typing import Dict, Iterable, List, Optional
+import threading
+
+check_interval = 2.0  # seconds between checks of counters.h_version, so other workers' writes show up
+
+
+# Sorted array of the ids of one table, 8 bytes per id
+class _Ids:
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self.ids = array("q")
+
+    def __contains__(self, id_: int) -> bool:
+        ids = self.ids
+        i = bisect_left(ids, id_)
+        return i < len(ids) and ids[i] == id_
+
+    def load(self, cursor) -> None:
+        cursor.execute(f"SELECT {self.column} FROM {self.table} ORDER BY {self.column}")
+        self.ids = array("q", (r[0] for r in cursor))
+
+    def add(self, id_: int) -> None:
+        i = bisect_left(self.ids, id_)
+        if i == len(self.ids) or self.ids[i] != id_:
+            self.ids.insert(i, id_)
+
+    def remove(self, id_: int) -> None:
+        i = bisect_left(self.ids, id_)
+        if i < len(self.ids) and self.ids[i] == id_:
+            del self.ids[i]
+
+
+sets: Dict[str, _Ids] = {"nhentai": _Ids("nhentai_ids", "nhentai_id"), "schale": _Ids("schale_ids", "schale_id")}
+_version: Optional[int] = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def _db_version(cursor) -> int:
+    cursor.execute("SELECT value FROM counters WHERE name = 'h_version'")
+    return cursor.fetchone()[0]
+
+
+def refresh(force: bool = False) -> None:
+    global _version, _checked
+    if not force and _version is not None and monotonic() - _checked < check_interval:
+        return
+    with _lock:
+        if not force and _version is not None and monotonic() - _checked < check_interval:
+            return
+        with get_cursor() as cursor:
+            version = _db_version(cursor)
+            if force or version != _version:
+                for ids in sets.values():
+                    ids.load(cursor)
+                _version = version
+        _checked = monotonic()
+
+
+def contains(kind: str, id_: int) -> bool:
+    refresh()
+    return id_ in sets[kind]
+
+
+def existing(kind: str, ids: Iterable[int]) -> List[int]:
+    refresh()
+    return [i for i in ids if i in sets[kind]]
+
+
+# Applies a committed POST/DELETE to this worker's copy; if anyone else wrote in between, everything is reloaded
+def changed(kind: str, id_: int, present: bool, cursor) -> None:
+    global _version, _checked
+    with _lock:
+        version = _db_version(cursor)
+        reload = _version is None or version > _version + 1
+        if not reload:
+            if present:
+                sets[kind].add(id_)
+            else:
+                sets[kind].remove(id_)
+            _version = version
+            _checked = monotonic()
+    if reload:
+        refresh(force=True)
@@ -0,0 +1,32 @@
+from flask import request, make_response, Response
+from utils.db import get_cursor
+from functools import wraps
+import hashlib
+
+
+def data_version() -> int:
+    with get_cursor() as cursor:
+        cursor.execute("SELECT value FROM counters WHERE name = 'version'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+# Weak ETag of a GET endpoint: the database change version (bumped by triggers on every write) plus the request path
+# and query, so a repeated request is answered with 304 before the view runs any query while nothing changed.
+def conditional(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        digest = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+        etag = f"{data_version()}-{digest}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        return response
+
+    return wrapper
@@ -0,0 +1,65 @@
+from utils import rate_limit
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from typing import Dict, Tuple
+import threading
+import requests
+import os
+
+timeout: Tuple[float, float] = (10, 60)  # connect, read
+pool_size = 10
+
+
+class Session(requests.Session):
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", timeout)
+        return super().request(method, url, **kwargs)
+
+
+# One keep-alive session per upstream host and process (sessions must not cross a gunicorn/celery fork)
+_sessions: Dict[Tuple[int, str], Session] = {}
+_lock = threading.Lock()
+
+
+def session(url: str) -> Session:
+    key = (os.getpid(), urlparse(url).hostname or "")
+    if (s := _sessions.get(key)) is not None:
+        return s
+    with _lock:
+        if (s := _sessions.get(key)) is None:
+            s = Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _sessions[key] = s
+    return s
+
+
+# Waits for the host's rate limiter and resends requests rejected with 429 once the advertised delay has passed
+def request(method: str, url: str, retries: int = 3, **kwargs) -> requests.Response:
+    host = urlparse(url).hostname or ""
+    attempt = 0
+    while True:
+        rate_limit.acquire(host)
+        response = session(url).request(method, url, **kwargs)
+        if not rate_limit.observe(host, response, attempt) or attempt >= retries:
+            return response
+        # Gives the connection back to the pool, a stream=True response would hold it otherwise
+        response.close()
+        attempt += 1
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request("DELETE", url, **kwargs)
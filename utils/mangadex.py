@@ -2,11 +2,13 @@ from flask import current_app as app
 from utils.common_code import author_type_merger
 from utils.mangadex_worker import worker
 from typing import Dict, Any, Tuple, List
-import requests
+from utils import http_client
 import re
 from utils.line import get_id as get_id_line
 from utils.mangaupdates import get_id_old as get_id_mu
 
+bulk_size = 100
+
 
 def get_id(url: str) -> str:
     parts = url.split("/title/")[1].split("/")
@@ -16,7 +18,7 @@ def get_id(url: str) -> str:
 
 def series(id_dex: str) -> Tuple[Dict[str, Any], int]:
     try:
-        response = requests.get(
+        response = http_client.get(
             f"https://api.mangadex.org/manga/{id_dex}?includes[]=author&includes[]=artist&includes[]=cover_art")
     except Exception as e:
         app.logger.error(f"Fetching data for ID {id_dex}: {e}")
@@ -28,9 +30,44 @@ def series(id_dex: str) -> Tuple[Dict[str, Any], int]:
         app.logger.error(f"Error fetching data for ID {id_dex}, status code: {response.status_code}")
         return {"status": "KO", "error": "Unexpected error"}, response.status_code
 
-    data = response.json()
-    data = data["data"]
+    return _series_data(response.json()["data"]), 200
+
+
+# Up to bulk_size manga per request; returns {id_dex: series data} for the ids MangaDex knows. MU links are left
+# unresolved (old numeric ones need a request to MU each), resolve_mu does it where the caller wants
+def series_bulk(ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    found = {}
+    for i in range(0, len(ids), bulk_size):
+        chunk = ids[i:i + bulk_size]
+        params = {
+            "ids[]": chunk,
+            "limit": len(chunk),
+            "includes[]": ["author", "artist", "cover_art"],
+            "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"]
+        }
+        try:
+            response = http_client.get("https://api.mangadex.org/manga", params=params)
+            if response.status_code != 200:
+                app.logger.error(f"Error fetching data for {len(chunk)} IDs, status code: {response.status_code}")
+                continue
+            for data in response.json().get("data", []):
+                try:
+                    found[data["id"]] = _series_data(data, resolve=False)
+                except Exception as e:
+                    app.logger.error(f"Reading data for ID {data.get("id")}: {e}")
+        except Exception as e:
+            app.logger.error(f"Fetching data for {len(chunk)} IDs: {e}")
+    return found
+
+
+def resolve_mu(r: Dict[str, Any]) -> Dict[str, Any]:
+    if (link := r.pop("mu_link", None)) and (id_mu := get_id_mu(link)):
+        r["ids"]["mu"] = id_mu
+    return r
+
 
+def _series_data(data: Dict[str, Any], resolve: bool = True) -> Dict[str, Any]:
+    id_dex = data["id"]
     authors = []
     cover_filename = None
     for i in data["relationships"]:
@@ -79,17 +116,20 @@ def series(id_dex: str) -> Tuple[Dict[str, Any], int]:
         "timestamp": {"dex": timestamp},
         "dex_status": data["attributes"].get("status"),
     }
-    if id_mu := data["attributes"]["links"].get("mu"):
-        data_final["ids"]["mu"] = get_id_mu(id_mu)
+    if link := data["attributes"]["links"].get("mu"):
+        data_final["mu_link"] = link
+        if resolve:
+            resolve_mu(data_final)
     if data["attributes"]["links"].get("mal"):
         data_final["ids"]["mal"] = data["attributes"]["links"]["mal"]
     if engtl := data["attributes"]["links"].get("engtl"):
         if "webtoons.com" in engtl:
             data_final["ids"]["line"] = get_id_line(engtl)
-    return data_final, 200
+    return data_final
 
 
-def search(title: str) -> List[Dict[str, Any]]:
+# Returns (results, 200), ([], status code) if MangaDex failed, 502 if it couldn't be reached
+def search(title: str) -> Tuple[List[Dict[str, Any]], int]:
     try:
         if m := re.search(r"\(([^)]*)\)", title):
             inside = m.group(1)
@@ -100,9 +140,11 @@ def search(title: str) -> List[Dict[str, Any]]:
             "order[relevance]": "desc",
             "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"]
         }
-        response = requests.get("https://api.mangadex.org/manga", params=params)
+        response = http_client.get("https://api.mangadex.org/manga", params=params)
         if response.status_code == 200:
-            return response.json().get("data", [])
+            return response.json().get("data", []), 200
+        app.logger.error(f"Searching for title {title}, status code: {response.status_code}")
+        return [], response.status_code
     except Exception as e:
         app.logger.error(f"Searching for title {title}: {e}")
-    return []
\ No newline at end of file
+    return [], 502
\ No newline at end of file
@@ -1,15 +1,22 @@
 from flask import current_app as app
 from utils.common_db import update_ratings, update_user_ratings, add_series_data
 from utils.external import series_data_external
-from utils.mangadex import search
+from utils.mangadex import search, series_bulk, resolve_mu
 from utils.mangaupdates import get_id_old as get_id_mu
-from time import sleep, time
-import requests
-import sqlite3
-from typing import List, Dict, Tuple, Union
+from utils.db import get_cursor
+from time import time
+from utils import http_client, rate_limit, thumbnails
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Tuple, Union, Optional
 
 base_url = "https://api.mangadex.org/"
+host = "api.mangadex.org"
 auth_url = "https://auth.mangadex.org/realms/mangadex/protocol/openid-connect/token"
+search_workers = 5
+external_workers = 4
+write_batch = 50
+miss_ttl = 24 * 3600  # a title not found is searched again after 1, 2, 4... days
+max_miss_ttl = 64 * 24 * 3600
 
 
 def dex_authenticate() -> Dict[str, Union[str, int]]:
@@ -26,7 +33,7 @@ def dex_authenticate() -> Dict[str, Union[str, int]]:
             "client_id": u[2],
             "client_secret": u[3]
         }
-        response = requests.post(auth_url, data=payload)
+        response = http_client.post(auth_url, data=payload)
         timestamp = time()
         if response.status_code != 200:
             app.logger.error(f"Failed to authenticate with Mangadex: {response.status_code}")
@@ -52,7 +59,7 @@ def dex_refresh_token(tokens: Dict[str, Union[str, int]]) -> Tuple[Dict[str, Uni
             "client_secret": u[1]
         }
         timestamp = time()
-        response = requests.post(auth_url, data=payload)
+        response = http_client.post(auth_url, data=payload)
         if response.status_code != 200:
             app.logger.error(f"Failed to refresh Mangadex token: {response.status_code}")
             return {}, {}
@@ -75,7 +82,7 @@ def dex_get_headers(tokens: Dict[str, Union[str, int]]) -> Tuple[Dict[str, str],
         if not token:
             return {}, 500
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         if response.status_code == 401:
             app.logger.warning("Mangadex token is invalid or expired.")
             return {}, 401
@@ -89,7 +96,7 @@ def dex_get_lists(headers) -> Tuple[Dict[str, List[str]], int]:
     try:
         url = base_url + "manga/status"
         for attempt in range(3):
-            response = requests.get(url, headers=headers)
+            response = http_client.get(url, headers=headers)
             if response.status_code == 200:
                 data = response.json()["statuses"]
                 break
@@ -97,7 +104,7 @@ def dex_get_lists(headers) -> Tuple[Dict[str, List[str]], int]:
                 return {}, 401
             if attempt == 2:
                 return {}, 502
-            sleep(2)
+            rate_limit.backoff(host, attempt)
         status_map = {"on_hold": "on-hold", "plan_to_read": "plan-to", "re_reading": "reading"}
         lists = {"plan-to": [], "reading": [], "completed": [], "dropped": [], "on-hold": []}
         for k, v in data.items():
@@ -133,7 +140,7 @@ def dex_update_ratings(lists, headers) -> bool:
         ratings = []
         ids = [i for sublist in lists.values() for i in sublist]
         for attempt in range(3):
-            r = requests.get(url, headers=headers, json=ids)
+            r = http_client.get(url, headers=headers, json=ids)
             if r.status_code == 200:
                 r = r.json()["statistics"]
                 ratings.extend([{"id": k, "rating": v["rating"]["bayesian"]} for k, v in r.items()])
@@ -145,10 +152,10 @@ def dex_update_ratings(lists, headers) -> bool:
 
         user_ratings = []
         for attempt in range(3):
-            r = requests.get(url_user, headers=headers)
+            r = http_client.get(url_user, headers=headers)
             if r.status_code == 200:
                 r = r.json()["ratings"]
-                user_ratings.extend([{"id": i, "rating": i["rating"]} for i in r])
+                user_ratings.extend([{"id": k, "rating": v["rating"]} for k, v in r.items()])
                 break
             elif r.status_code == 401 or attempt == 2:
                 return False
@@ -171,75 +178,116 @@ def dex_update_ratings(lists, headers) -> bool:
         return False
 
 
-def dex_sync_lists(lists) -> Dict[str, str]:
-    try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        ids = [i for sublist in lists.values() for i in sublist]
-        query = f"SELECT id_dex, status FROM series WHERE id_dex IS NOT NULL and integration = 1 AND id_dex IN ({','.join(['?'] * len(ids))})"
-        cursor.execute(query, ids)
-        db = {m[0]: m[1] for m in cursor.fetchall()}
+# Status changes to push to MangaDex and the titles of the lists that are not in the db yet, sorted so they can be
+# added in chunks
+def dex_list_changes(lists) -> Tuple[Dict[str, str], List[str]]:
+    with get_cursor() as cursor:
+        statuses = {k: v for v, ids in lists.items() for k in ids}
+        ids = list(statuses)
+        db = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute(f"SELECT id_dex, status, integration FROM series WHERE id_dex IN ({", ".join("?" for _ in chunk)})",
+                           chunk)
+            db.update({m[0]: (m[1], m[2]) for m in cursor.fetchall()})
 
-        add_to_db = {}
-        to_update = {}
-        status_map = {"on_hold": "on-hold", "plan_to_read": "plan-to", "re_reading": "reading"}
-        status_map_reverse = {"plan-to": "plan_to_read", "one-shots": "completed", "on-hold": "on_hold",
-                              "ongoing": "plan_to_read"}
-        for k, v in db.items():
-            if v in status_map_reverse:
-                v = status_map_reverse[v]
-            if k in lists and lists[v] == k:
-                continue
-            to_update[k] = v
-        for k, v in lists.items():
-            if k not in db:
-                v = status_map[v] if v in status_map else v
-                add_to_db[k] = v
-
-        for k, v in add_to_db.items():
-            r, s = series_data_external({"dex": k})
-            if s != 200:
-                app.logger.info(f"Skipping {k}, ↑")
-                continue
+    to_update = {}
+    status_map_list = {"one-shots": "completed", "ongoing": "plan-to"}
+    status_map_reverse = {"plan-to": "plan_to_read", "one-shots": "completed", "on-hold": "on_hold",
+                          "ongoing": "plan_to_read"}
+    for k, (v, integration) in db.items():
+        if not integration or status_map_list.get(v, v) == statuses[k]:
+            continue
+        to_update[k] = status_map_reverse.get(v, v)
+    return to_update, sorted(k for k in statuses if k not in db)
+
+
+# Adds titles of the lists to the db, committing each one, so running it again only does what is left.
+# Returns the number of titles that could not be added
+def dex_add_series(lists, ids: List[str]) -> int:
+    if not ids:
+        return 0
+    statuses = {k: v for v, ids_ in lists.items() for k in ids_}
+    errors = 0
+    with get_cursor() as cursor:
+        # One request per 100 titles; only titles linking other sources are completed by series_data_external,
+        # reusing the Dex data instead of fetching it again
+        fetched = series_bulk(ids)
+        flask_app = app._get_current_object()
+
+        def fetch(k):
+            with flask_app.app_context():
+                if (r := fetched.get(k)) is not None:
+                    resolve_mu(r)
+                    if r["title"] and set(r["ids"]) == {"dex"}:
+                        return r, 200
+                return series_data_external({"dex": k}, {"dex": r} if r is not None else None)
 
-            query = "SELECT id FROM series WHERE id_dex = ?"
-            params = [k]
-            for m, n in r["ids"].items():
-                if m == "dex":
+        executor = ThreadPoolExecutor(max_workers=external_workers, thread_name_prefix="dex_sync_lists")
+        try:
+            futures = {executor.submit(fetch, k): k for k in ids}
+            for future in as_completed(futures):
+                k = futures[future]
+                try:
+                    r, s = future.result()
+                except Exception as e:
+                    app.logger.error(f"Fetching {k}: {e}")
+                    errors += 1
                     continue
-                query += f" OR id_{m} = ?"
-                params.append(n)
-
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            if len(rows) >= 2:
-                app.logger.warning(f"Multiple entries found for Title:{r['title']}, IDs: ({r['ids']}). Skipping.")
-                continue
-            if rows:
-                id_ = rows[0][0]
-                query = "UPDATE series SET "
-                params = []
+                if s != 200:
+                    app.logger.info(f"Skipping {k}, ↑")
+                    errors += 1
+                    continue
+
+                query = "SELECT id FROM series WHERE id_dex = ?"
+                params = [k]
                 for m, n in r["ids"].items():
-                    query += f"id_{m} = ?, "
+                    if m == "dex":
+                        continue
+                    query += f" OR id_{m} = ?"
                     params.append(n)
-                if r["timestamp"].get("mu"):
-                    query += "timestamp_mu = ?, "
-                    params.append(1)
+
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                if len(rows) >= 2:
+                    app.logger.warning(f"Multiple entries found for Title:{r['title']}, IDs: ({r['ids']}). Skipping.")
+                    errors += 1
+                    continue
+                if rows:
+                    id_ = rows[0][0]
+                    query = "UPDATE series SET "
+                    params = []
+                    for m, n in r["ids"].items():
+                        query += f"id_{m} = ?, "
+                        params.append(n)
+                    if r["timestamp"].get("mu"):
+                        query += "timestamp_mu = ?, "
+                        params.append(1)
+                    else:
+                        query += "timestamp_dex = ?, "
+                        params.append(1)
+                    query = query.rstrip(", ") + " WHERE id = ?"
+                    cursor.execute(query, params + [id_])
                 else:
-                    query += "timestamp_dex = ?, "
-                    params.append(1)
-                query = query.rstrip(", ") + " WHERE id = ?"
-                cursor.execute(query, params + [id_])
-            else:
-                cursor.execute(f"""INSERT INTO series
-                (id_mu, id_dex, id_mal, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?) returning id""",
-                               (r["ids"].get("mu"), k, r["ids"].get("mal"), r["ids"].get("line"), r["title"],
-                                r["type"], r["description"], r["vol_ch"], 1, add_to_db[k], r["year"], 1))
-                id_ = cursor.fetchone()[0]
-                add_series_data(id_, r, cursor)
-            conn.commit()
-        conn.close()
+                    cursor.execute(f"""INSERT INTO series
+                    (id_mu, id_dex, id_mal, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?) returning id""",
+                                   (r["ids"].get("mu"), k, r["ids"].get("mal"), r["ids"].get("line"), r["title"],
+                                    r["type"], r["description"], r.get("vol_ch"), 1, statuses[k], r["year"], 1))
+                    id_ = cursor.fetchone()[0]
+                    add_series_data(id_, r, cursor)
+                cursor.connection.commit()
+                if not rows:
+                    thumbnails.relink([id_], cursor)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return errors
+
+
+def dex_sync_lists(lists) -> Dict[str, str]:
+    try:
+        to_update, add_to_db = dex_list_changes(lists)
+        dex_add_series(lists, add_to_db)
         return to_update
     except Exception as e:
         app.logger.error(e)
@@ -249,66 +297,149 @@ def dex_sync_lists(lists) -> Dict[str, str]:
 def dex_sync_lists_forced(tokens: Dict[str, Union[str, int]], headers: Dict[str, str], to_update: Dict[str, str], ) -> Tuple[Dict[str, str], Dict[str, str]]:
     try:
         url = base_url + "manga/"
-        w = 1
         for k, v in to_update.items():
             if int(time()) >= tokens["expiration"]:
                 tokens, headers = dex_refresh_token(tokens)
                 if not headers:
                     return {}, {}
-                w = 1
-            if w >= 3:
-                sleep(1)
-                w = 0
-            response = requests.get(url + k + "status", headers=headers, json={"status": v})
+            response = http_client.get(url + k + "status", headers=headers, json={"status": v})
             if response.status_code != 200:
                 app.logger.error(f"Failed to update status for {k}: {response.status_code}")
-            w += 1
     except Exception as e:
         app.logger.error(e)
     return tokens, headers
 
 
+def _miss_ttl(attempts: int) -> int:
+    return min(miss_ttl * 2 ** (attempts - 1), max_miss_ttl)
+
+
+# Search stage, runs in the worker threads: the Dex id (and MAL id from its links) of the result linking to id_mu,
+# ("", "") if there is none, None if the search failed
+def _find_dex_id(title: str, id_mu: str, legacy: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    results, s = search(title)
+    if s != 200:
+        return None
+    links = [(i["id"], i["attributes"].get("links") or {}) for i in results]
+    for dex_id, link in links:
+        if link.get("mu") == id_mu:
+            return dex_id, link.get("mal") or ""
+    # Old numeric MU ids need one request each to MU to resolve, so they are only tried when no link matched as is
+    for dex_id, link in links:
+        if (mu := link.get("mu")) and mu.isdigit():
+            if mu not in legacy:
+                legacy[mu] = get_id_mu(mu)
+            if legacy[mu] == id_mu:
+                return dex_id, link.get("mal") or ""
+    return "", ""
+
+
+# Writes a batch of search outcomes [(series_id, title, dex_id, mal_id)]: matches are stored, misses are remembered
+# in dex_fetch_misses and retried after a TTL that doubles with every failed attempt
+def _save_dex_ids(found: List[Tuple[int, str, str, str]], cursor) -> None:
+    now = int(time())
+    matches = [f for f in found if f[2]]
+    misses = [f for f in found if not f[2]]
+
+    taken = set()
+    for column, values in (("id_dex", [f[2] for f in matches]), ("id_mal", [f[3] for f in matches if f[3]])):
+        if values:
+            cursor.execute(f"SELECT {column} FROM series WHERE {column} IN ({", ".join("?" for _ in values)})", values)
+            taken.update((column, str(r[0])) for r in cursor.fetchall())
+    to_update, to_update_mal = [], []
+    for id_, title, dex_id, mal_id in matches:
+        if ("id_dex", dex_id) in taken:
+            # Backed off like a miss, it stays unresolved until merged by hand
+            app.logger.info(f"Skipping existing entry with DEX ID (merge could be required): {dex_id}")
+            misses.append((id_, title, "", ""))
+            continue
+        taken.add(("id_dex", dex_id))
+        to_update.append((dex_id, id_))
+        if mal_id:
+            if ("id_mal", str(mal_id)) in taken:
+                app.logger.info(f"Skipping existing entry with MAL ID (merge could be required): {mal_id}")
+            else:
+                taken.add(("id_mal", str(mal_id)))
+                to_update_mal.append((mal_id, id_))
+
+    cursor.executemany("UPDATE series SET id_dex = ? WHERE id = ?", to_update)
+    cursor.executemany("UPDATE series SET id_mal = ? WHERE id = ? AND id_mal IS NULL", to_update_mal)
+    cursor.executemany("DELETE FROM dex_fetch_misses WHERE series_id = ?", [(id_,) for _, id_ in to_update])
+    previous = {}
+    if misses:
+        cursor.execute(f"SELECT series_id, attempts, title FROM dex_fetch_misses WHERE series_id IN ({", ".join("?" for _ in misses)})",
+                       [f[0] for f in misses])
+        previous = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+    rows = []
+    for id_, title, _, _ in misses:
+        attempts, old_title = previous.get(id_, (0, title))
+        attempts = attempts + 1 if old_title == title else 1
+        rows.append((id_, attempts, now + _miss_ttl(attempts), title))
+    cursor.executemany("""INSERT INTO dex_fetch_misses (series_id, attempts, next_try, title) VALUES (?, ?, ?, ?)
+    ON CONFLICT (series_id) DO UPDATE SET attempts = excluded.attempts, next_try = excluded.next_try, title = excluded.title""",
+                       rows)
+    cursor.connection.commit()
+
+
 def dex_fetch_ids() -> bool:
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT title, id_mu, id, id_mal FROM series WHERE id_mu IS NOT NULL AND id_dex is NULL")
-        series = cursor.fetchall()
-        to_update = []
-        to_update_mal = []
-        w = 0
-        for title, id_mu, id_, id_mal in series:
-            if w >= 3:
-                sleep(1)
-                w = 0
-            results = search(title)
-            w += 1
-            if not results:
-                continue
-            for i in results:
-                result_id_mu = get_id_mu(i["attributes"].get("links", {}).get("mu"))
-                if result_id_mu == id_mu:
-                    app.logger.info(f"For {title} (MU_ID:{id_mu}): Found DEX_ID {i["id"]}")
-                    to_update.append((i["id"], id_))
-                    if not id_mal and (id_mal := i["attributes"].get("links", {}).get("mal")):
-                        app.logger.info(f"For {title} (MU_ID:{id_mu}): Found MAL_ID {id_mal}")
-                        to_update_mal.append((id_mal, id_))
-                    break
-        if to_update:
-            cursor.executemany("UPDATE series SET id_dex = ? WHERE id = ?", to_update)
-            conn.commit()
-        if to_update_mal:
-            for i in to_update_mal[:]:
-                cursor.execute("SELECT 1 FROM series WHERE id_mal = ? LIMIT 1", (i[0],))
-                if cursor.fetchone():
-                    app.logger.info(f"Skipping existing entry with MAL ID (merge could be required): {i[0]}")
-                    to_update_mal.remove(i)
-                    continue
-            if to_update_mal:
-                cursor.executemany("UPDATE series SET id_mal = ? WHERE id = ?", to_update_mal)
-                conn.commit()
-        conn.close()
-        return True
+        with get_cursor() as cursor:
+            cursor.execute("""SELECT s.id, s.title, s.id_mu, s.id_mal
+                              FROM series s
+                                       LEFT JOIN dex_fetch_misses m ON m.series_id = s.id
+                              WHERE s.id_mu IS NOT NULL
+                                AND s.id_dex IS NULL
+                                AND (m.series_id IS NULL OR m.next_try <= ? OR m.title IS NOT s.title)""",
+                           (int(time()),))
+            series = cursor.fetchall()
+            if not series:
+                return True
+
+            flask_app = app._get_current_object()
+            legacy = {}  # old numeric MU id: new id, shared by the threads of this run
+
+            def find(title, id_mu):
+                with flask_app.app_context():
+                    return _find_dex_id(title, id_mu, legacy)
+
+            ok = True
+            found = []
+
+            def flush():
+                nonlocal ok
+                try:
+                    _save_dex_ids(found, cursor)
+                except Exception as e:
+                    cursor.connection.rollback()
+                    app.logger.error(e)
+                    ok = False
+                found.clear()
+
+            # The Dex rate limiter keeps the searches of all threads under the API limit
+            with ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="dex_fetch_ids") as executor:
+                futures = {executor.submit(find, title, id_mu): (id_, title, id_mu, id_mal)
+                           for id_, title, id_mu, id_mal in series}
+                for future in as_completed(futures):
+                    id_, title, id_mu, id_mal = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        app.logger.error(f"For {title} (MU_ID:{id_mu}): {e}")
+                        continue
+                    # Not a miss: a failed search is tried again on the next run
+                    if result is None:
+                        continue
+                    dex_id, mal_id = result
+                    if dex_id:
+                        app.logger.info(f"For {title} (MU_ID:{id_mu}): Found DEX_ID {dex_id}")
+                        if mal_id and not id_mal:
+                            app.logger.info(f"For {title} (MU_ID:{id_mu}): Found MAL_ID {mal_id}")
+                    found.append((id_, title, dex_id, "" if id_mal else mal_id))
+                    if len(found) >= write_batch:
+                        flush()
+            if found:
+                flush()
+            return ok
     except Exception as e:
         app.logger.error(e)
     return False
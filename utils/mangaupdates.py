@@ -1,10 +1,10 @@
 from flask import current_app as app
-from utils.detect_language import detect_language
+from utils.detect_language import detect_languages
 from utils.common_code import author_type_merger, base36
 from utils.mangaupdates_worker import worker
 from utils.line import get_id as get_id_line
 from typing import Dict, Any, Tuple, Union
-import requests
+from utils import http_client
 import re
 
 
@@ -20,7 +20,7 @@ def _extract_line_id(t: str) -> str:
 
 def _id_from_old_url(old_url: str) -> str:
     try:
-        response = requests.get(old_url, allow_redirects=True)
+        response = http_client.get(old_url, allow_redirects=True)
         new_url = response.url
         return new_url.split("/series/")[1].split("/")[0]
     except Exception as e:
@@ -51,7 +51,7 @@ def series(id_mu36: str) -> Tuple[Dict[str, Any], int]:
     id_mu = int(id_mu36, 36)
 
     try:
-        response = requests.get(f"https://api.mangaupdates.com/v1/series/{id_mu}")
+        response = http_client.get(f"https://api.mangaupdates.com/v1/series/{id_mu}")
     except Exception as e:
         app.logger.error(f"Fetching data for ID{id_mu36}: {e}")
         return {"status": "KO", "error": "Failed to fetch details from MangaUpdates"}, 502
@@ -84,8 +84,9 @@ def series(id_mu36: str) -> Tuple[Dict[str, Any], int]:
     alt_titles = []
     if "associated" in data:
         alt_titles_all = [item["title"] for item in data["associated"]]
+    languages = detect_languages(alt_titles_all)
     for name in alt_titles_all:
-        lang, confidence = detect_language(name)
+        lang, confidence = languages[name]
         if confidence and lang in accepted_languages:
             alt_titles.append(name)
 
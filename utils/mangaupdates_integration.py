@@ -1,14 +1,22 @@
 from flask import current_app as app
 from utils.common_code import base36
-from utils.common_db import get_author_id, update_thumbnail, update_ratings, update_user_ratings, \
-    add_series_data
+from utils.common_db import get_author_ids, update_ratings, update_user_ratings, add_series_data
 from utils.mangaupdates import series
-from time import sleep
-import requests
-import sqlite3
-from typing import List, Tuple, Dict
+from utils.db import get_cursor
+from utils import http_client, rate_limit, thumbnails
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Optional
+from time import time
+import json
 
 base_url = "https://api.mangaupdates.com/v1/"
+host = "api.mangaupdates.com"
+list_names = ("completed", "one-shots", "reading", "on-hold", "dropped", "plan-to", "ongoing")
+page_size = 250
+resume_window = 6 * 3600  # an interrupted list download younger than this continues from its last saved page
+full_sync_interval = 7 * 24 * 3600  # between full reconciles, only entries past the watermark are synced
+fetch_workers = 4
+write_batch = 50
 
 
 def mu_get_headers() -> dict:
@@ -16,18 +24,18 @@ def mu_get_headers() -> dict:
         url = base_url
         token = app.config.get("MU_TOKEN", "")
         if token:
-            token = "" if requests.get(url + "lists", headers={
+            token = "" if http_client.get(url + "lists", headers={
                 "Authorization": f"Bearer {token}", "Content-Type": "application/json"}).status_code != 200 else token
         if not token:
             username = app.config["MU_USERNAME"]
             password = app.config["MU_PASSWORD"]
             for attempt in range(3):
-                response = requests.put(url + "account/login", json={"username": username, "password": password})
+                response = http_client.put(url + "account/login", json={"username": username, "password": password})
                 if response.status_code == 200:
                     break
                 if attempt == 2:
                     raise Exception("Failed to login to MangaUpdates")
-                sleep(2)
+                rate_limit.backoff(host, attempt)
             token = response.json()['context']['session_token']
             app.config["MU_TOKEN"] = token
         return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
@@ -42,19 +50,103 @@ def mu_get_list(list_id: int, headers) -> List[dict]:
         url = base_url + f"lists/{list_id}/search"
         data = []
         for attempt in range(3):
-            response = requests.post(url, headers=headers, json={"page": 1, "perpage": -1})
+            response = http_client.post(url, headers=headers, json={"page": 1, "perpage": -1})
             if response.status_code == 200:
                 data = response.json()["results"]
                 break
             if attempt == 2:
                 return []
-            sleep(2)
+            rate_limit.backoff(host, attempt)
         return data
     except Exception as e:
         app.logger.error(e)
         return []
 
 
+# Downloads a list page by page, saving every page in mu_sync_pages so an interrupted run can resume.
+# Returns None if MU keeps failing.
+def _fetch_list(name: str, list_id: int, headers, cursor, resume: bool) -> Optional[List[dict]]:
+    url = base_url + f"lists/{list_id}/search"
+    data = []
+    page = 1
+    cursor.execute("SELECT run_started, pages FROM mu_sync WHERE list = ?", (name,))
+    row = cursor.fetchone()
+    if resume and row and row[0] and time() - row[0] < resume_window:
+        cursor.execute("SELECT data FROM mu_sync_pages WHERE list = ? AND page <= ? ORDER BY page", (name, row[1]))
+        pages = [json.loads(r[0]) for r in cursor.fetchall()]
+        if len(pages) == row[1]:
+            for results in pages:
+                data.extend(results)
+            if pages and len(pages[-1]) < page_size:
+                return data
+            page = row[1] + 1
+    if page == 1:
+        cursor.execute("DELETE FROM mu_sync_pages WHERE list = ?", (name,))
+        cursor.execute("""INSERT INTO mu_sync (list, run_started, pages) VALUES (?, ?, 0)
+        ON CONFLICT (list) DO UPDATE SET run_started = excluded.run_started, pages = 0""", (name, int(time())))
+        cursor.connection.commit()
+
+    while True:
+        for attempt in range(3):
+            response = http_client.post(url, headers=headers, json={"page": page, "perpage": page_size})
+            if response.status_code == 200:
+                break
+            if attempt == 2:
+                return None
+            rate_limit.backoff(host, attempt)
+        results = response.json()["results"]
+        cursor.execute("INSERT OR REPLACE INTO mu_sync_pages (list, page, data) VALUES (?, ?, ?)",
+                       (name, page, json.dumps(results)))
+        cursor.execute("UPDATE mu_sync SET pages = ? WHERE list = ?", (page, name))
+        cursor.connection.commit()
+        data.extend(results)
+        if len(results) < page_size:
+            return data
+        page += 1
+
+
+def _changed_at(m: dict) -> int:
+    return max(m["record"]["time_added"]["timestamp"], m["metadata"]["series"]["last_updated"]["timestamp"])
+
+
+# Entries added, moved or updated on MU since the last completed sync of their list, plus the ones whose status
+# was changed here since the last completed sync
+def mu_changed(data: Dict[str, List[dict]]) -> Dict[str, List[dict]]:
+    with get_cursor() as cursor:
+        cursor.execute("SELECT list, watermark FROM mu_sync")
+        watermarks = dict(cursor.fetchall())
+        cursor.execute("SELECT min(synced) FROM mu_sync")
+        synced = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT id_mu FROM series WHERE id_mu IS NOT NULL AND timestamp_status >= ?", (synced,))
+        local = {r[0] for r in cursor.fetchall()}
+    changed = {}
+    for i, entries in data.items():
+        if entries := [m for m in entries if _changed_at(m) >= watermarks.get(i, 0)
+                                             or base36(m["record"]["series"]["id"]) in local]:
+            changed[i] = entries
+    return changed
+
+
+def mu_full_sync_due() -> bool:
+    with get_cursor() as cursor:
+        cursor.execute("SELECT count(*), min(full_sync) FROM mu_sync")
+        count, full_sync = cursor.fetchone()
+    return count < len(list_names) or time() - full_sync > full_sync_interval
+
+
+# Called once data has been synced: moves the watermarks forward and drops the saved pages
+def mu_sync_done(data: Dict[str, List[dict]], full: bool) -> None:
+    with get_cursor() as cursor:
+        for i, entries in data.items():
+            watermark = max((_changed_at(m) for m in entries), default=0)
+            cursor.execute(f"""UPDATE mu_sync SET watermark = max(watermark, ?), synced = coalesce(run_started, synced),
+            run_started = NULL, pages = 0
+            {", full_sync = ?" if full else ""} WHERE list = ?""",
+                           (watermark, int(time()), i) if full else (watermark, i))
+            cursor.execute("DELETE FROM mu_sync_pages WHERE list = ?", (i,))
+        cursor.connection.commit()
+
+
 def _get_ids_scanlated(list_id: int, headers) -> List[int]:
     try:
         url = base_url + f"series/search"
@@ -64,12 +156,12 @@ def _get_ids_scanlated(list_id: int, headers) -> List[int]:
         while True:
             payload = {"filter": "scanlated", "list": list_id, "page": page}
             for attempt in range(3):
-                response = requests.post(url, headers=headers, json=payload)
+                response = http_client.post(url, headers=headers, json=payload)
                 if response.status_code == 200:
                     break
                 if attempt == 2:
                     return []
-                sleep(2)
+                rate_limit.backoff(host, attempt)
             if page == 1:
                 total_hits = int(response.json()["total_hits"])
                 if total_hits in (0, 10000):
@@ -79,7 +171,6 @@ def _get_ids_scanlated(list_id: int, headers) -> List[int]:
             if len(ids) >= total_hits:
                 break
             page += 1
-            sleep(1)
         return ids
     except Exception as e:
         app.logger.error(e)
@@ -102,12 +193,12 @@ def _move_series_batch(payload, headers) -> bool:
     try:
         url = base_url + "lists/series/update"
         for attempt in range(3):
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post(url, headers=headers, json=payload)
             if response.status_code == 200:
                 break
             if attempt == 2:
                 return False
-            sleep(2)
+            rate_limit.backoff(host, attempt)
         return True
     except Exception as e:
         app.logger.error(e)
@@ -119,12 +210,12 @@ def _add_series_batch(payload, headers) -> bool:
     try:
         url = base_url + "lists/series"
         for attempt in range(3):
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post(url, headers=headers, json=payload)
             if response.status_code == 200:
                 break
             if attempt == 2:
                 return False
-            sleep(2)
+            rate_limit.backoff(host, attempt)
         return True
     except Exception as e:
         app.logger.error(e)
@@ -151,7 +242,7 @@ def mu_update_ratings(data: Dict[str, List[dict]]) -> bool:
             if s != 200:
                 errors += 1
         if user_ratings:
-            s = update_user_ratings("mu", user_ratings)
+            _, s = update_user_ratings("mu", user_ratings)
             if s != 200:
                 errors += 1
 
@@ -164,20 +255,21 @@ def mu_update_ratings(data: Dict[str, List[dict]]) -> bool:
         return False
 
 
-def mu_get_data_for_all() -> Tuple[Dict[str, List[dict]], dict]:
+def mu_get_data_for_all(resume: bool = True) -> Tuple[Dict[str, List[dict]], dict]:
     try:
         headers = mu_get_headers()
         if not headers:
             return {}, {}
 
         data = {}
-        for i in ("completed", "one-shots", "reading", "on-hold", "dropped", "plan-to", "ongoing"):
-            list_id = app.config[f"MU_LIST_{i.upper()}"]
-            data_ = mu_get_list(list_id, headers)
-            if data_:
-                data[i] = data_
+        with get_cursor() as cursor:
+            for i in list_names:
+                list_id = app.config[f"MU_LIST_{i.upper()}"]
+                data_ = _fetch_list(i, list_id, headers, cursor, resume)
+                if data_ is not None:
+                    data[i] = data_
 
-        if not data:
+        if not any(data.values()):
             return {}, headers
         return data, headers
     except Exception as e:
@@ -198,14 +290,11 @@ def mu_update_ongoing() -> int:
         if to_move:
             payload.extend([{"series": {"id": i}, "list_id": plan_to_read} for i in to_move])
 
-        sleep(1)
-
         to_move = _get_ids_not_scanlated(plan_to_read, headers)
         if to_move:
             payload.extend([{"series": {"id": i}, "list_id": ongoing} for i in to_move])
 
         if payload:
-            sleep(1)
             _move_series_batch(payload, headers)
             return 2
         return 1
@@ -214,7 +303,9 @@ def mu_update_ongoing() -> int:
         return 0
 
 
-def mu_sync_lists(data: Dict[str, List[dict]], headers) -> bool:
+# With full=False, data holds only the entries changed since the last sync (mu_changed): series missing from MU
+# are only detected, and added there, by a full sync
+def mu_sync_lists(data: Dict[str, List[dict]], headers, full: bool = True) -> bool:
     try:
         ids = {}
         for i in data:
@@ -224,185 +315,266 @@ def mu_sync_lists(data: Dict[str, List[dict]], headers) -> bool:
                 ids[id_] = (i, timestamp)
 
         if not ids:
-            return False
+            return not full
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT id_mu, status, timestamp_status FROM series WHERE id_mu IS NOT NULL")
-        db = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
-
-        add_to_db = {}
-        add_to_mu = {k: db[k][0] for k in db.keys() if k not in ids.keys()}
-        to_update_db = {}
-        to_update_mu = {}
-        for k, v in ids.items():
-            if k not in db:
-                add_to_db[k] = v
-            elif db[k][0] == v[0]:
-                continue
-            elif db[k][1] > v[1]:
-                to_update_mu[k] = v
-            elif db[k][1] < v[1]:
-                to_update_db[k] = v
+        with get_cursor() as cursor:
+            if full:
+                cursor.execute(f"SELECT id_mu, status, timestamp_status FROM series WHERE id_mu IS NOT NULL")
+                db = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
             else:
-                app.logger.warning(f"Skipping {k}, because status different but timestamps same")
-
-        if to_update_db:
-            query = "UPDATE series SET status = ?, timestamp_status = ? WHERE id_mu = ?"
-            cursor.executemany(query, [(v[0], v[1], k) for k, v in to_update_mu.items()])
-            conn.commit()
-        if add_to_mu:
-            for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
-                list_id = app.config[f"MU_LIST_{i.upper()}"]
-                payload = [{"series": {"id": int(j, 36)}, "list_id": list_id} for j in add_to_mu if add_to_mu[j] == i]
-                _add_series_batch(payload, headers)
-        if to_update_mu:
-            for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
-                list_id = app.config[f"MU_LIST_{i.upper()}"]
-                payload = [{"series": {"id": j}, "list_id": list_id} for j in add_to_mu if add_to_mu[j] == i]
-                _move_series_batch(payload, headers)
-        w = 1
-        for i in add_to_db.keys():
-            if w >= 4:
-                sleep(1)
-                w = 0
-            try:
-                r, s = series(i)
-                if s != 200:
-                    app.logger.info(f"Skipping {i}, ↑")
+                db = {}
+                keys = list(ids)
+                for j in range(0, len(keys), 500):
+                    chunk = keys[j:j + 500]
+                    cursor.execute(f"SELECT id_mu, status, timestamp_status FROM series WHERE id_mu IN ({", ".join("?" for _ in chunk)})",
+                                   chunk)
+                    db.update({r[0]: (r[1], r[2]) for r in cursor.fetchall()})
+
+            add_to_db = {}
+            add_to_mu = {k: db[k][0] for k in db.keys() if k not in ids.keys()}
+            to_update_db = {}
+            to_update_mu = {}
+            for k, v in ids.items():
+                if k not in db:
+                    add_to_db[k] = v
+                elif db[k][0] == v[0]:
                     continue
-                cursor.execute(f"""INSERT INTO series
-                (id_mu, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status, timestamp_mu)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id""",
-                               (i, r["ids"].get("line"), r.get("title"), r.get("type"),
-                                r.get("description"), r.get("vol_ch"), True, add_to_db[i][0], r.get("year"),
-                                add_to_db[i][1], r["timestamp"]["mu"]))
-                id_ = cursor.fetchone()[0]
-                add_series_data(id_, r, cursor)
-                conn.commit()
-            except Exception as e:
-                app.logger.error(e)
-                continue
-            w += 1
-        conn.close()
-        return True
+                elif db[k][1] > v[1]:
+                    to_update_mu[k] = db[k]
+                elif db[k][1] < v[1]:
+                    to_update_db[k] = v
+                else:
+                    app.logger.warning(f"Skipping {k}, because status different but timestamps same")
+
+            if to_update_db:
+                query = "UPDATE series SET status = ?, timestamp_status = ? WHERE id_mu = ?"
+                cursor.executemany(query, [(v[0], v[1], k) for k, v in to_update_db.items()])
+                cursor.connection.commit()
+            if add_to_mu:
+                for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
+                    list_id = app.config[f"MU_LIST_{i.upper()}"]
+                    payload = [{"series": {"id": int(j, 36)}, "list_id": list_id} for j in add_to_mu if add_to_mu[j] == i]
+                    if payload:
+                        _add_series_batch(payload, headers)
+            if to_update_mu:
+                for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
+                    list_id = app.config[f"MU_LIST_{i.upper()}"]
+                    payload = [{"series": {"id": int(j, 36)}, "list_id": list_id} for j in to_update_mu
+                               if to_update_mu[j][0] == i]
+                    if payload:
+                        _move_series_batch(payload, headers)
+            for i in add_to_db.keys():
+                try:
+                    r, s = series(i)
+                    if s != 200:
+                        app.logger.info(f"Skipping {i}, ↑")
+                        continue
+                    cursor.execute(f"""INSERT INTO series
+                    (id_mu, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status, timestamp_mu)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id""",
+                                   (i, r["ids"].get("line"), r.get("title"), r.get("type"),
+                                    r.get("description"), r.get("vol_ch"), True, add_to_db[i][0], r.get("year"),
+                                    add_to_db[i][1], r["timestamp"]["mu"]))
+                    id_ = cursor.fetchone()[0]
+                    add_series_data(id_, r, cursor)
+                    cursor.connection.commit()
+                    thumbnails.relink([id_], cursor)
+                except Exception as e:
+                    app.logger.error(e)
+                    continue
+            return True
     except Exception as e:
         app.logger.error(e)
         return False
 
 
-def mu_update_series(data: Dict[str, List[dict]]) -> bool:
-    try:
-        db = {}
-        for i in data:
-            for m in data[i]:
-                db[base36(m["record"]["id"])] = m["metadata"]["series"]["last_updated"]["timestamp"]
-
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
+def _in(ids: List, query: str, cursor) -> List[tuple]:
+    rows = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(query.format(", ".join("?" for _ in chunk)), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+# Current state of the series to refresh, read with one query per table
+def _load_series_state(ids_mu: List[str], cursor) -> Dict[str, dict]:
+    state = {}
+    for r in _in(ids_mu, """SELECT id_mu, id, title, type, description, vol_ch, year, id_line, integration_genres
+                            FROM series WHERE id_mu IN ({})""", cursor):
+        state[r[0]] = {"id": r[1], "title": r[2], "type": r[3], "description": r[4], "vol_ch": r[5], "year": r[6],
+                       "id_line": r[7], "integration_genres": r[8], "thumbnail": (None, 0), "authors": {},
+                       "titles": set(), "genres": set()}
+    by_id = {v["id"]: v for v in state.values()}
+    ids = list(by_id)
+    for r in _in(ids, "SELECT series_id, url, integration FROM series_thumbnails WHERE series_id IN ({})", cursor):
+        by_id[r[0]]["thumbnail"] = (r[1], r[2])
+    for r in _in(ids, """SELECT sa.series_id, a.id_mu, sa.author_type
+                         FROM series_authors sa
+                                  JOIN authors a ON a.id = sa.author_id
+                         WHERE sa.series_id IN ({})""", cursor):
+        by_id[r[0]]["authors"][r[1]] = r[2]
+    for r in _in(ids, "SELECT series_id, alt_title FROM series_titles WHERE series_id IN ({})", cursor):
+        by_id[r[0]]["titles"].add(r[1])
+    for r in _in(ids, "SELECT series_id, genre_id FROM series_genres WHERE series_id IN ({})", cursor):
+        by_id[r[0]]["genres"].add(r[1])
+    return state
+
+
+# Fetch stage, runs in the worker threads: series data plus the new thumbnail when it has changed
+def _fetch_series(id_mu: str, state: dict) -> Tuple[Optional[dict], Tuple[str, str]]:
+    r, s = series(id_mu)
+    if s != 200:
+        return None, ("", "")
+    url, integration = state["thumbnail"]
+    if integration and r["thumbnail"] != url:
+        try:
+            return r, thumbnails.download(r["thumbnail"])
+        except Exception as e:
+            app.logger.error(f"Failed to update the image for series {state['id']}: {e}")
+    return r, ("", "")
+
+
+# Transform stage, no I/O: what has to change for one series
+def _series_diff(state: dict, r: dict, thumbnail: Tuple[str, str], genre_ids: Dict[str, int]) -> dict:
+    id_ = state["id"]
+    columns = {"timestamp_mu": r["timestamp"]["mu"]}
+    for i in ["title", "type", "description", "vol_ch", "year"]:
+        if r[i] != state[i]:
+            columns[i] = r[i]
+    if len(r["ids"]) == 2 and r["ids"].get("line") != state["id_line"]:
+        columns["id_line"] = r["ids"].get("line")
+
+    authors = []
+    for a in r["authors"]:
+        a_id = a.get("ids", {}).get("mu")
+        if not a_id:
+            app.logger.warning(f"""For series: {id_} skipping author: {a}.
+            ID_MU not found, please add the author to the MangaUpdates database.""")
+            continue
+        if a_id not in state["authors"] or a["type"] != state["authors"][a_id]:
+            authors.append((a, a_id in state["authors"]))
+
+    titles_mu = set(r["alt_titles"])
+    genres_mu = {genre_ids[g] for g in r["genres"] if g in genre_ids}
+    genres = state["integration_genres"]
+    return {"id": id_, "columns": columns, "authors": authors, "thumbnail": (*thumbnail, r["thumbnail"]),
+            "titles_add": [(id_, t) for t in titles_mu - state["titles"]],
+            "titles_delete": [(id_, t) for t in state["titles"] - titles_mu],
+            "genres_add": [(id_, g) for g in genres_mu - state["genres"]] if genres else [],
+            "genres_delete": [(id_, g) for g in state["genres"] - genres_mu] if genres else []}
+
+
+# Write stage: one short transaction per batch of diffs, nothing slow happens while the write lock is held
+def _apply_series_diffs(diffs: List[dict], cursor) -> None:
+    updates = {}
+    for d in diffs:
+        updates.setdefault(tuple(d["columns"]), []).append((*d["columns"].values(), d["id"]))
+    for cols, values in updates.items():
+        cursor.executemany(f"UPDATE series SET {", ".join(f"{k} = ?" for k in cols)} WHERE id = ?", values)
+
+    authors = [(d["id"], a, exists) for d in diffs for a, exists in d["authors"]]
+    authors_to_add = []
+    authors_to_update = []
+    for (id_, a, exists), (r, s) in zip(authors, get_author_ids([a for _, a, _ in authors], cursor)):
+        if s not in (200, 201):
+            app.logger.warning(f"For series: {id_} skipping author: {a}.")
+        elif exists:
+            authors_to_update.append((a["type"], id_, r[0]))
+        else:
+            authors_to_add.append((a["type"], id_, r[0]))
+    cursor.executemany("INSERT OR IGNORE INTO series_authors (author_type, series_id, author_id) VALUES (?, ?, ?)",
+                       authors_to_add)
+    cursor.executemany("UPDATE series_authors SET author_type = ? WHERE series_id = ? AND author_id = ?",
+                       authors_to_update)
+
+    thumbnails_ = [(d["id"], *d["thumbnail"]) for d in diffs if d["thumbnail"][0]]
+    cursor.executemany("UPDATE series_thumbnails SET extension = ?, url = ?, hash = ? WHERE series_id = ?",
+                       [(ext, url, hash_, id_) for id_, hash_, ext, url in thumbnails_])
+
+    cursor.executemany("INSERT OR IGNORE INTO series_titles (series_id, alt_title) VALUES (?, ?)",
+                       [t for d in diffs for t in d["titles_add"]])
+    cursor.executemany("DELETE FROM series_titles WHERE series_id = ? AND alt_title = ?",
+                       [t for d in diffs for t in d["titles_delete"]])
+    cursor.executemany("INSERT OR IGNORE INTO series_genres (series_id, genre_id) VALUES (?, ?)",
+                       [g for d in diffs for g in d["genres_add"]])
+    cursor.executemany("DELETE FROM series_genres WHERE series_id = ? AND genre_id = ?",
+                       [g for d in diffs for g in d["genres_delete"]])
+    cursor.connection.commit()
+    for id_, hash_, ext, _ in thumbnails_:
+        thumbnails.link(id_, hash_, ext)
+
+
+# Integrated series whose MU data changed since they were last refreshed, sorted so they can be updated in chunks
+def mu_stale_series(data: Dict[str, List[dict]]) -> List[str]:
+    last_updated = {}
+    for i in data:
+        for m in data[i]:
+            last_updated[base36(m["record"]["series"]["id"])] = m["metadata"]["series"]["last_updated"]["timestamp"]
+
+    with get_cursor() as cursor:
         cursor.execute("SELECT id_mu, timestamp_mu FROM series WHERE timestamp_mu IS NOT NULL and integration = 1")
+        return sorted(m[0] for m in cursor.fetchall() if m[0] in last_updated and m[1] != last_updated[m[0]])
 
-        to_update = []
-        for m in cursor.fetchall():
-            if m[1] not in db or m[2] == db[m[1]]:
-                continue
-            to_update.append(m[1])
-
-        if not to_update:
-            conn.close()
-            return True
 
-        authors_to_add = []
-        authors_to_update = []
-
-        titles_to_add = []
-        titles_to_delete = []
+# Series are fetched by fetch_workers threads (the MU rate limiter keeps them under the API limit) while this
+# thread turns the results into diffs and writes them every write_batch series. Updated series get the new
+# timestamp_mu, so running it again only does what is left. Returns the number of series that failed
+def mu_update_series_ids(ids_mu: List[str]) -> int:
+    if not ids_mu:
+        return 0
+    try:
+        with get_cursor() as cursor:
+            state = _load_series_state(ids_mu, cursor)
+            cursor.execute("SELECT genre, id FROM genres")
+            genre_ids = dict(cursor.fetchall())
+            flask_app = app._get_current_object()
+
+            def fetch(id_mu):
+                with flask_app.app_context():
+                    return _fetch_series(id_mu, state[id_mu])
+
+            errors = 0
+            diffs = []
+
+            def flush():
+                nonlocal errors
+                try:
+                    _apply_series_diffs(diffs, cursor)
+                except Exception as e:
+                    cursor.connection.rollback()
+                    app.logger.error(e)
+                    errors += len(diffs)
+                diffs.clear()
+
+            with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="mu_update") as executor:
+                futures = {executor.submit(fetch, i): i for i in ids_mu if i in state}
+                for future in as_completed(futures):
+                    id_mu = futures[future]
+                    try:
+                        r, thumbnail = future.result()
+                        # Counted so the watermark stays before it and the series is retried on the next run
+                        if r is None:
+                            errors += 1
+                            continue
+                        diffs.append(_series_diff(state[id_mu], r, thumbnail, genre_ids))
+                    except Exception as e:
+                        app.logger.error(f"for {id_mu}: {e}")
+                        errors += 1
+                        continue
+                    if len(diffs) >= write_batch:
+                        flush()
+            if diffs:
+                flush()
+            return errors
+    except Exception as e:
+        app.logger.error(e)
+        return len(ids_mu)
 
-        genres_to_add = []
-        genres_to_delete = []
 
-        for m in to_update:
-            r, s = series(m)
-            if s != 200:
-                continue
-            cursor.execute(
-                "SELECT title, type, description, vol_ch, year, id, id_line, integration_genres from series WHERE id_mu = ?",
-                (m,))
-            row = cursor.fetchone()
-            id_ = row[5]
-
-            x = 0
-            to_update = {"timestamp": r["timestamp"]["mu"], }
-            for i in ["title", "type", "description", "vol_ch", "year"]:
-                if r[i] != row[x]:
-                    to_update[i] = r[i]
-                x += 1
-
-            if len(r["ids"]) == 2 and r["ids"].get("line") != row[6]:
-                to_update["id_line"] = r["ids"].get("line")
-
-            if to_update:
-                cols = ", ".join(f"{k} = ?" for k in to_update.keys())
-                vals = list(to_update.values()) + [id_]
-                cursor.execute(f"UPDATE series SET {cols} WHERE id = ?", vals)
-
-            cursor.execute("SELECT url, integration FROM series_thumbnails WHERE series_id = ?", (id_,))
-            integration, url = cursor.fetchone()
-            if integration and r["thumbnail"] != url:
-                update_thumbnail(id_, r["thumbnail"], cursor)
-
-            cursor.execute("""SELECT a.id_mu, sa.author_type
-                              FROM series_authors sa
-                                       JOIN authors a ON a.id = sa.author_id
-                              WHERE sa.series_id = ?""", (id_,))
-            authors = {i[0]: i[1] for i in cursor.fetchall()}
-            for a in r["authors"]:
-                a_id = a.get("ids", {}).get("mu")
-                if not a_id:
-                    app.logger.warning(f"""For series: {id_} skipping author: {a}.
-                    ID_MU not found, please add the author to the MangaUpdates database.""")
-                    continue
-                if a_id not in authors or a["type"] != authors[a_id]:
-                    r, s = get_author_id(a, cursor)
-                    if s != 200:
-                        app.logger.warning(f"For series: {id_} skipping author: {a}.")
-                        continue
-                if a_id not in authors:
-                    authors_to_add.append((a["type"], id_, r[0]))
-                elif a["type"] != authors[a_id]:
-                    authors_to_update.append((a["type"], id_, r[0]))
-
-            cursor.execute("SELECT alt_title FROM series_titles WHERE series_id = ?", (id_,))
-            titles_db = {i[0] for i in cursor.fetchall()}
-            titles_mu = set(r["alt_titles"])
-            titles_to_add.extend([id_, t] for t in titles_mu - titles_db)
-            titles_to_delete.extend([id_, t] for t in titles_db - titles_mu)
-
-            if row[7]:
-                cursor.execute("SELECT genre_id FROM series_genres WHERE series_id = ?", (id_,))
-                genres_db = {g[0] for g in cursor.fetchall()}
-                cursor.executemany("SELECT id FROM genres WHERE genre = ?", r["genres"])
-                genres_mu = {g[0] for g in cursor.fetchall()}
-                genres_to_add.extend([id_, g] for g in genres_mu - genres_db)
-                genres_to_delete.extend([id_, g] for g in genres_db - genres_mu)
-
-        if authors_to_add:
-            cursor.executemany("INSERT INTO series_authors (author_type, series_id, author_id) VALUES (?, ?, ?)",
-                               authors_to_add)
-        if authors_to_update:
-            cursor.executemany("UPDATE series_authors SET author_type = (?) WHERE series_id = ? AND author_id  = ?",
-                               authors_to_update)
-        if titles_to_add:
-            cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)", titles_to_add)
-        if titles_to_delete:
-            cursor.execute("DELETE FROM series_titles WHERE series_id = ? AND alt_title = ?", titles_to_delete)
-        if genres_to_add:
-            cursor.executemany("INSERT INTO series_genres (series_id, genre_id) VALUES (?, ?)", genres_to_add)
-        if genres_to_delete:
-            cursor.executemany("DELETE FROM series_genres WHERE series_id = ? AND genre_id = ?", genres_to_delete)
-        conn.commit()
-        conn.close()
-        return True
+def mu_update_series(data: Dict[str, List[dict]]) -> bool:
+    try:
+        return mu_update_series_ids(mu_stale_series(data)) == 0
     except Exception as e:
         app.logger.error(e)
         return False
@@ -1,5 +1,5 @@
 from flask import current_app as app
-import requests
+from utils import http_client
 from typing import Dict, Any, Tuple
 
 
@@ -13,7 +13,7 @@ def series(id_mal: int) -> Tuple[Dict[str, Any], int]:
     if not app.config.get('MAL_CLIENT_ID'):
         return {}, 403
     try:
-        response = requests.get(f"https://api.myanimelist.net/v2/manga/{id_mal}", params={
+        response = http_client.get(f"https://api.myanimelist.net/v2/manga/{id_mal}", params={
             "fields": "alternative_titles,start_date,synopsis,updated_at,media_type,genres,num_volumes,num_chapters,authors{first_name,last_name}"},
                                 headers={"X-MAL-CLIENT-ID": app.config['MAL_CLIENT_ID']})
     except Exception as e:
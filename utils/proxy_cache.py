@@ -0,0 +1,158 @@
+from flask import current_app as app
+from werkzeug.http import http_date
+from utils import http_client
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import threading
+import tempfile
+import hashlib
+import json
+import os
+
+CACHE_DIR = "data/cache/thumbnail-proxy"
+max_size = 256 * 1024 * 1024  # 256 MiB, least recently served entries are evicted first
+max_age = 7 * 24 * 3600
+chunk_size = 64 * 1024
+wait_timeout = 30
+
+# Requests for a URL that is already being fetched wait for that fetch and are served from the cache
+_inflight: Dict[str, threading.Event] = {}
+_lock = threading.Lock()
+
+
+def key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _paths(k: str) -> Tuple[str, str]:
+    return os.path.join(CACHE_DIR, k), os.path.join(CACHE_DIR, f"{k}.json")
+
+
+# Returns (path, metadata) of a cached image, None on a miss
+def get(url: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    path, meta_path = _paths(key(url))
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        os.utime(path)
+        return path, meta
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(k: str, meta: Dict[str, str]) -> None:
+    _, meta_path = _paths(k)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+    with os.fdopen(fd, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def _evict() -> None:
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith((".json", ".part")):
+            continue
+        try:
+            st = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+        total += st.st_size
+    if total <= max_size:
+        return
+    for _, size, name in sorted(entries):
+        for path in _paths(name):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        if total <= max_size * 0.9:
+            break
+
+
+def _release(k: str, event: Optional[threading.Event]) -> None:
+    if event is None:
+        return
+    with _lock:
+        if _inflight.get(k) is event:
+            del _inflight[k]
+    event.set()
+
+
+class _Tee:
+    # Streams the upstream body to the client while writing it to the cache; werkzeug calls close() at the end
+    def __init__(self, k: str, response, event: Optional[threading.Event], meta: Dict[str, str]):
+        self.k = k
+        self.response = response
+        self.event = event
+        self.meta = meta
+
+    def __iter__(self) -> Iterator[bytes]:
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.response.iter_content(chunk_size):
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp, _paths(self.k)[0])
+            _write_meta(self.k, self.meta)
+            _evict()
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            _release(self.k, self.event)
+
+    def close(self) -> None:
+        self.response.close()
+        _release(self.k, self.event)
+
+
+def _fetch(url: str, k: str,
+           event: Optional[threading.Event]) -> Tuple[Optional[Dict[str, str]], Optional[Iterable[bytes]]]:
+    try:
+        if url.startswith("line://"):
+            from utils.line import get_thumbnail
+            img = get_thumbnail(url[7:])
+            if not img:
+                return None, None
+            path, _ = _paths(k)
+            fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(img)
+            os.replace(tmp, path)
+            meta = {"mimetype": "image/jpeg", "last_modified": http_date()}
+            _write_meta(k, meta)
+            _evict()
+            return meta, None
+
+        response = http_client.get(url, stream=True)
+        if response.status_code != 200:
+            app.logger.error(f"for {url}, upstream returned {response.status_code}")
+            response.close()
+            return None, None
+        meta = {"mimetype": response.headers.get("content-type", "image/jpeg"),
+                "last_modified": response.headers.get("Last-Modified") or http_date()}
+        tee, event = _Tee(k, response, event, meta), None
+        return meta, tee
+    finally:
+        _release(k, event)
+
+
+# Returns (metadata, body) for an image missing from the cache, body None if it is already in the cache (use get),
+# (None, None) if upstream failed. Only one request per URL goes upstream at a time, the others wait for it.
+def fetch(url: str) -> Tuple[Optional[Dict[str, str]], Optional[Iterable[bytes]]]:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    k = key(url)
+    with _lock:
+        event = _inflight.get(k)
+        leader = event is None
+        if leader:
+            event = _inflight[k] = threading.Event()
+    if not leader:
+        event.wait(wait_timeout)
+        if entry := get(url):
+            return entry[1], None
+        return _fetch(url, k, None)
+    return _fetch(url, k, event)
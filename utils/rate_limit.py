@@ -0,0 +1,185 @@
+from flask import current_app as app, has_app_context
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from time import sleep, time
+import threading
+import logging
+import requests
+import os
+
+# host: (requests per second, burst)
+limits: Dict[str, Tuple[float, float]] = {
+    "api.mangaupdates.com": (4, 4),
+    "api.mangadex.org": (5, 5),
+    "auth.mangadex.org": (1, 2),
+    "api.myanimelist.net": (2, 2),
+}
+max_backoff = 300
+
+_lua_take = """
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'blocked')
+local tokens = tonumber(b[1]) or capacity
+local updated = tonumber(b[2]) or now
+local blocked = tonumber(b[3]) or 0
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if blocked > now then
+    wait = blocked - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now), 'blocked', tostring(blocked))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+_lua_block = """
+local t = redis.call('TIME')
+local until_ = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked')) or 0
+if until_ > blocked then
+    redis.call('HSET', KEYS[1], 'blocked', tostring(until_))
+    redis.call('EXPIRE', KEYS[1], 3600)
+end
+return 1
+"""
+
+
+def _warn(message: str) -> None:
+    (app.logger if has_app_context() else logging.getLogger(__name__)).warning(message)
+
+
+class _LocalBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time()
+        self.blocked = 0.0
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        with self.lock:
+            now = time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.blocked > now:
+                return self.blocked - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        with self.lock:
+            self.blocked = max(self.blocked, time() + seconds)
+
+
+class _RedisBucket:
+    def __init__(self, client, host: str, rate: float, capacity: float):
+        self.key = f"mml:rate_limit:{host}"
+        self.rate = rate
+        self.capacity = capacity
+        self.take_script = client.register_script(_lua_take)
+        self.block_script = client.register_script(_lua_block)
+
+    def take(self) -> float:
+        return float(self.take_script(keys=[self.key], args=[self.rate, self.capacity]))
+
+    def block(self, seconds: float) -> None:
+        self.block_script(keys=[self.key], args=[seconds])
+
+
+# Buckets are shared by all threads of a process, and by all processes through Redis when REDIS_URL is set
+_buckets: Dict[Tuple[int, str], object] = {}
+_lock = threading.Lock()
+
+
+def _bucket(host: str):
+    if host not in limits:
+        return None
+    key = (os.getpid(), host)
+    if (b := _buckets.get(key)) is not None:
+        return b
+    with _lock:
+        if (b := _buckets.get(key)) is None:
+            rate, capacity = limits[host]
+            b = _LocalBucket(rate, capacity)
+            if redis_url := os.getenv("REDIS_URL"):
+                try:
+                    import redis
+                    b = _RedisBucket(redis.Redis.from_url(redis_url), host, rate, capacity)
+                except Exception as e:
+                    _warn(f"Redis rate limiter unavailable for {host}, using a local one: {e}")
+            _buckets[key] = b
+    return b
+
+
+def acquire(host: str) -> None:
+    if (b := _bucket(host)) is None:
+        return
+    while True:
+        try:
+            wait = b.take()
+        except Exception as e:
+            _warn(f"Rate limiter failed for {host}, falling back to a local one: {e}")
+            rate, capacity = limits[host]
+            b = _buckets[(os.getpid(), host)] = _LocalBucket(rate, capacity)
+            continue
+        if wait <= 0:
+            return
+        sleep(min(wait, max_backoff))
+
+
+def block(host: str, seconds: float) -> None:
+    if (b := _bucket(host)) is None or seconds <= 0:
+        return
+    try:
+        b.block(min(seconds, max_backoff))
+    except Exception as e:
+        _warn(f"Rate limiter failed for {host}: {e}")
+
+
+# Exponential backoff after a failed attempt (0, 1, 2...), shared with every other caller of the host
+def backoff(host: str, attempt: int) -> None:
+    block(host, 2 ** (attempt + 1))
+    if host not in limits:
+        sleep(min(2 ** (attempt + 1), max_backoff))
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    if value := response.headers.get("Retry-After"):
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return parsedate_to_datetime(value).timestamp() - time()
+            except (TypeError, ValueError):
+                pass
+    # MangaDex: unix timestamp at which the window resets
+    if value := response.headers.get("X-RateLimit-Retry-After"):
+        try:
+            return float(value) - time()
+        except ValueError:
+            pass
+    return None
+
+
+# Returns True if the request was rejected for rate limiting and should be sent again
+def observe(host: str, response: requests.Response, attempt: int) -> bool:
+    if response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers):
+        delay = _retry_after(response)
+        delay = delay if delay and delay > 0 else 2 ** (attempt + 1)
+        _warn(f"{host} answered {response.status_code}, backing off for {delay:.1f}s")
+        block(host, delay)
+        if host not in limits:
+            sleep(min(delay, max_backoff))
+        return True
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        block(host, _retry_after(response) or 1)
+    return False
@@ -1,5 +1,5 @@
 from utils.mangadex_integration import dex_fetch_ids
-from utils.tasks_2 import db_backup, mu_all, dex_all
+from utils.tasks_2 import db_backup, thumbnails_gc, mu_all, dex_all
 from flask_apscheduler import APScheduler
 
 scheduler = APScheduler()
@@ -19,6 +19,10 @@ def init_scheduler(app, r=False):
     def scheduled_db_backup():
         run_task(db_backup, "backup_database", c=False)
 
+    @scheduler.task("cron", id="thumbnails_gc", day="*", hour=1, minute=15)
+    def scheduled_thumbnails_gc():
+        run_task(thumbnails_gc, "thumbnails_gc")
+
     if app.config.get("MU_AUTOMATION"):
         @scheduler.task("cron", id="mu_automation", day="*", hour=1, minute=30)
         def scheduled_mu_all():
@@ -1,3 +1,4 @@
+from utils.db import get_cursor
 import sqlite3
 
 def _is_int(value):
@@ -11,9 +12,9 @@ def _is_int(value):
 def _is_mal_id_valid(mal_id: str) -> None | str:
     if not mal_id:
         return None
-    import requests
+    from utils import http_client
     try:
-        response = requests.get("https://api.myanimelist.net/v2/forum/boards", headers={"X-MAL-CLIENT-ID": mal_id})
+        response = http_client.get("https://api.myanimelist.net/v2/forum/boards", headers={"X-MAL-CLIENT-ID": mal_id})
         if response.status_code == 200:
             return mal_id
     except Exception:
@@ -28,13 +29,58 @@ def first_run():
     with open("first_run.sql") as f:
         set_up = f.read()
 
-    conn = sqlite3.connect("data/mml.sqlite3")
-    cursor = conn.cursor()
-    cursor.executescript(schema)
-    cursor.executescript(set_up)
-    cursor.execute("UPDATE settings SET value = ? WHERE key = ?", (secrets.token_hex(16), "secret_key"))
-    conn.commit()
-    conn.close()
+    with get_cursor() as cursor:
+        cursor.executescript(schema)
+        cursor.executescript(set_up)
+        cursor.execute("UPDATE settings SET value = ? WHERE key = ?", (secrets.token_hex(16), "secret_key"))
+        cursor.connection.commit()
+
+
+def update_schema():
+    with open("schema.sql") as f:
+        schema = f.read()
+
+    with get_cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'series_fts'")
+        fts = cursor.fetchone()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'counters'")
+        counters = cursor.fetchone()
+        cursor.execute("SELECT 1 FROM pragma_table_info('series_thumbnails') WHERE name = 'hash'")
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE series_thumbnails ADD COLUMN hash TEXT")
+        cursor.executescript(schema)
+        cursor.execute("SELECT 1 FROM pragma_table_info('mu_sync') WHERE name = 'synced'")
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE mu_sync ADD COLUMN synced INTEGER not null default 0")
+        if not counters:
+            rebuild_counters(cursor)
+        if not fts:
+            cursor.execute("""
+                           INSERT INTO series_fts (rowid, title, alt_titles, description)
+                           SELECT s.id, s.title, group_concat(st.alt_title, ' / '), s.description
+                           FROM series s
+                                    LEFT JOIN series_titles st ON st.series_id = s.id
+                           GROUP BY s.id
+                           """)
+        cursor.connection.commit()
+
+
+def rebuild_counters(cursor):
+    cursor.execute("DELETE FROM counters WHERE name NOT IN ('version', 'h_version')")
+    cursor.execute("""
+                   INSERT INTO counters (name, value)
+                   SELECT 'series', COUNT(*) FROM series
+                   UNION ALL
+                   SELECT 'status:' || coalesce(status, ''), COUNT(*) FROM series GROUP BY status
+                   UNION ALL
+                   SELECT 'type:' || coalesce(type, ''), COUNT(*) FROM series GROUP BY type
+                   UNION ALL
+                   SELECT 'authors', COUNT(*) FROM authors
+                   UNION ALL
+                   SELECT 'nhentai_ids', COUNT(*) FROM nhentai_ids
+                   UNION ALL
+                   SELECT 'schale_ids', COUNT(*) FROM schale_ids
+                   """)
 
 
 def first_run_detect_language():
@@ -47,13 +93,30 @@ def first_run_detect_language():
                            primary key,
                        lang       TEXT,
                        confidence REAL,
-                       timestamp  INTEGER
+                       timestamp  INTEGER,
+                       source     TEXT
                    )
                    """)
     conn.commit()
     conn.close()
 
 
+# source: "script" (local classifier) or "googletrans"; rows from before the column existed were all remote
+def update_schema_detect_language():
+    with get_cursor(path="data/detect_language.sqlite3") as cursor:
+        cursor.execute("SELECT 1 FROM pragma_table_info('titles') WHERE name = 'source'")
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE titles ADD COLUMN source TEXT")
+            cursor.execute("UPDATE titles SET source = 'googletrans'")
+            cursor.connection.commit()
+        # Version 1: plain ASCII titles without English words are no longer taken as English without asking googletrans
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] < 1:
+            cursor.execute("DELETE FROM titles WHERE source = 'script' AND lang = 'en'")
+            cursor.execute("PRAGMA user_version = 1")
+            cursor.connection.commit()
+
+
 def iso_langs() -> list:
     iso639_1 = [
         "aa", "ab", "ae", "af", "ak", "am", "an", "ar", "as", "av", "ay", "az",
@@ -87,155 +150,149 @@ def iso_langs() -> list:
 
 
 def get_settings(app):
-    conn = sqlite3.connect("data/mml.sqlite3")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM settings")
-    settings = {r[0]: r[1] for r in cursor.fetchall()}
-    params = []
-
-    app.secret_key = settings["secret_key"]
-    app.config["PASSWORD"] = settings["password"]
-    app.config["SESSION_COOKIE_SAMESITE"] = "Strict"
-
-    main_rating = settings["main_rating"]
-    if main_rating in ["mu", "dex", "mal"]:
-        app.config["MAIN_RATING"] = main_rating
-    else:
-        app.config["MAIN_RATING"] = "mu"
-        app.logger.warning(f"""{main_rating} is not a valid main_rating, "mu" will be used.""")
-        params.append(("mu", "main_rating"))
-
-    langs = settings["title_languages"]
-    iso639_1 = iso_langs()
-    langs = [l for l in langs.split(",") if l in iso639_1]
-    if "en" not in langs:
-        langs.append("en")
-        params.append((",".join(langs), "title_languages"))
-        app.logger.info("Don't remove English from title languages or you may break something.")
-    app.config["TITLE_LANGUAGES"] = langs
-
-    # INTEGRATION BASE
-    for i in ["mu", "dex", "mal"]:
-        j = f"{i}_integration"
-        if (k := settings[j]) not in ["0", "1"]:
-            app.config[j.upper()] = 0
-            params.append((0, j))
-        else:
-            k = int(k)
-            app.config[j.upper()] = k
-
-    # MU INTEGRATION
-    if app.config["MU_INTEGRATION"]:
-        l = ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing")
-        l = [f"mu_list_{i}" for i in l]
-        s = ("mu_username", "mu_password")
-        if all(settings.get(i) for i in s) and all(_is_int(settings.get(i)) for i in l):
-            app.config["MU_INTEGRATION"] = 1
-            for i in s:
-                app.config[i.upper()] = settings[i]
-            for i in l:
-                app.config[i.upper()] = int(settings[i])
-        else:
-            app.config["MU_INTEGRATION"] = 0
-            params.append((0, "mu_integration"))
-            app.logger.warning("You must provide both mu_username and mu_password to use mu_integration")
-
-    # DEX INTEGRATION
-    if app.config["DEX_INTEGRATION"]:
-        s = ["dex_username", "dex_password", "dex_client_id", "dex_secret"]
-        if all(settings.get(i) for i in s):
-            app.config["DEX_INTEGRATION"] = 1
-            for i in s:
-                app.config[i.upper()] = settings[i]
-            app.config["DEX_INTEGRATION_FORCED"] = 1 if settings.get("dex_integration_forced") == "1" else 0
+    with get_cursor() as cursor:
+        cursor.execute("SELECT * FROM settings")
+        settings = {r[0]: r[1] for r in cursor.fetchall()}
+        params = []
+
+        app.secret_key = settings["secret_key"]
+        app.config["PASSWORD"] = settings["password"]
+        app.config["SESSION_COOKIE_SAMESITE"] = "Strict"
+
+        main_rating = settings["main_rating"]
+        if main_rating in ["mu", "dex", "mal"]:
+            app.config["MAIN_RATING"] = main_rating
         else:
-            app.config["DEX_INTEGRATION"] = 0
-            params.append((0, "dex_integration"))
-            app.logger.warning(
-                "You must provide dex_username, dex_password, dex_client_id, dex_secret and dex_integration_forced to use dex_integration")
-
-    # MAL INTEGRATION
-    # Why "publicly available information" require authentication? F MAL
-    # https://web.archive.org/web/20250514000339/https://myanimelist.net/forum/?topicid=1973141#:~:text=publicly%20available%20information
-    app.config["MAL_CLIENT_ID"] = _is_mal_id_valid(settings.get("mal_client_id"))
-    if not app.config["MAL_CLIENT_ID"]:
-        if not app.config.get("WORKER"):
-            app.logger.warning("You must provide a MAL Client ID to get any data from MyAnimeList.")
+            app.config["MAIN_RATING"] = "mu"
+            app.logger.warning(f"""{main_rating} is not a valid main_rating, "mu" will be used.""")
+            params.append(("mu", "main_rating"))
+
+        langs = settings["title_languages"]
+        iso639_1 = iso_langs()
+        langs = [l for l in langs.split(",") if l in iso639_1]
+        if "en" not in langs:
+            langs.append("en")
+            params.append((",".join(langs), "title_languages"))
+            app.logger.info("Don't remove English from title languages or you may break something.")
+        app.config["TITLE_LANGUAGES"] = langs
+
+        # INTEGRATION BASE
+        for i in ["mu", "dex", "mal"]:
+            j = f"{i}_integration"
+            if (k := settings[j]) not in ["0", "1"]:
+                app.config[j.upper()] = 0
+                params.append((0, j))
+            else:
+                k = int(k)
+                app.config[j.upper()] = k
+
+        # MU INTEGRATION
+        if app.config["MU_INTEGRATION"]:
+            l = ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing")
+            l = [f"mu_list_{i}" for i in l]
+            s = ("mu_username", "mu_password")
+            if all(settings.get(i) for i in s) and all(_is_int(settings.get(i)) for i in l):
+                app.config["MU_INTEGRATION"] = 1
+                for i in s:
+                    app.config[i.upper()] = settings[i]
+                for i in l:
+                    app.config[i.upper()] = int(settings[i])
+            else:
+                app.config["MU_INTEGRATION"] = 0
+                params.append((0, "mu_integration"))
+                app.logger.warning("You must provide both mu_username and mu_password to use mu_integration")
+
+        # DEX INTEGRATION
+        if app.config["DEX_INTEGRATION"]:
+            s = ["dex_username", "dex_password", "dex_client_id", "dex_secret"]
+            if all(settings.get(i) for i in s):
+                app.config["DEX_INTEGRATION"] = 1
+                for i in s:
+                    app.config[i.upper()] = settings[i]
+                app.config["DEX_INTEGRATION_FORCED"] = 1 if settings.get("dex_integration_forced") == "1" else 0
+            else:
+                app.config["DEX_INTEGRATION"] = 0
+                params.append((0, "dex_integration"))
+                app.logger.warning(
+                    "You must provide dex_username, dex_password, dex_client_id, dex_secret and dex_integration_forced to use dex_integration")
+
+        # MAL INTEGRATION
+        # Why "publicly available information" require authentication? F MAL
+        # https://web.archive.org/web/20250514000339/https://myanimelist.net/forum/?topicid=1973141#:~:text=publicly%20available%20information
+        app.config["MAL_CLIENT_ID"] = _is_mal_id_valid(settings.get("mal_client_id"))
+        if not app.config["MAL_CLIENT_ID"]:
+            if not app.config.get("WORKER"):
+                app.logger.warning("You must provide a MAL Client ID to get any data from MyAnimeList.")
+            if app.config["MAL_INTEGRATION"]:
+                app.config["MAL_INTEGRATION"] = 0
+                params.append((0, "mal_integration"))
         if app.config["MAL_INTEGRATION"]:
-            app.config["MAL_INTEGRATION"] = 0
-            params.append((0, "mal_integration"))
-    if app.config["MAL_INTEGRATION"]:
-        app.config["MAL_INTEGRATION"] = 0  # TODO: Add mal integration
-
-    # AUTOMATION
-    for i in ["mu", "dex", "mal"]:
-        j = f"{i}_automation"
-        if (k := settings[j]) not in ["0", "1"]:
-            app.config[j.upper()] = 0
-            params.append((0, j))
-        elif not app.config[f"{i.upper()}_INTEGRATION"]:
-            app.config[j.upper()] = 0
-        else:
-            k = int(k)
-            app.config[j.upper()] = k
+            app.config["MAL_INTEGRATION"] = 0  # TODO: Add mal integration
 
-    app.config["DEX_FETCH_IDS"] = 1 if settings.get("dex_fetch_ids") else 0
+        # AUTOMATION
+        for i in ["mu", "dex", "mal"]:
+            j = f"{i}_automation"
+            if (k := settings[j]) not in ["0", "1"]:
+                app.config[j.upper()] = 0
+                params.append((0, j))
+            elif not app.config[f"{i.upper()}_INTEGRATION"]:
+                app.config[j.upper()] = 0
+            else:
+                k = int(k)
+                app.config[j.upper()] = k
 
-    if params:
-        cursor.executemany("UPDATE settings SET value = ? WHERE key = ? ", params)
-        conn.commit()
-    conn.close()
+        app.config["DEX_FETCH_IDS"] = 1 if settings.get("dex_fetch_ids") else 0
+
+        if params:
+            cursor.executemany("UPDATE settings SET value = ? WHERE key = ? ", params)
+            cursor.connection.commit()
 
 
 def update_settings(data):
     from flask import current_app as app
-    conn = sqlite3.connect("data/mml.sqlite3")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM settings")
-    in_db = {r[0]: r[1] for r in cursor.fetchall()}
-    params = []
-    bools = ("mu_integration", "mu_automation", "dex_fetch_ids", "dex_integration", "dex_integration_forced",
-             "dex_automation", "mal_integration", "mal_automation")
-    accepted = bools + ("main_rating", "title_languages", "password", "mu_username", "mu_password",
-                        "dex_username", "dex_password", "dex_client_id", "dex_secret", "mal_client_id")
-    for k, v in data.items():
-        if not k in accepted:
-            continue
-        if k in bools:
-            v = 1 if v == True else 0
-        elif k == "mu_lists":
-            continue
-        if v == in_db[k]:
-            continue
-        if k == "main_rating":
-            if v not in ["mu", "dex", "mal"]:
+    with get_cursor() as cursor:
+        cursor.execute("SELECT * FROM settings")
+        in_db = {r[0]: r[1] for r in cursor.fetchall()}
+        params = []
+        bools = ("mu_integration", "mu_automation", "dex_fetch_ids", "dex_integration", "dex_integration_forced",
+                 "dex_automation", "mal_integration", "mal_automation")
+        accepted = bools + ("main_rating", "title_languages", "password", "mu_username", "mu_password",
+                            "dex_username", "dex_password", "dex_client_id", "dex_secret", "mal_client_id")
+        for k, v in data.items():
+            if not k in accepted:
                 continue
-        if k == "title_languages":
-            if not isinstance(v, str):
+            if k in bools:
+                v = 1 if v == True else 0
+            elif k == "mu_lists":
                 continue
-            langs = [l for l in v.split(",")]
-            iso639_1 = iso_langs()
-            v_ = [i for i in langs if i in iso639_1]
-            v = ",".join(v_)
-            if "en" not in v:
-                v = "en" + v
-                app.logger.info("Don't remove English from title languages or you may break something.")
-        params.append((v, k))
-        app.config[k] = v
-
-    if "mu_lists" in data and isinstance(data["mu_lists"], dict):
-        for k, v in data["mu_lists"].items():
-            if k not in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
+            if v == in_db[k]:
                 continue
-            if not _is_int(v):
-                continue
-            params.append((v, f"mu_list_{k}"))
-
-    if params:
-        cursor.executemany("UPDATE settings SET value = ? WHERE key = ? ", params)
-        conn.commit()
-        conn.close()
-        get_settings(app)
-        app.extensions["celery"].send_task("reload_settings", priority=0)
-    else:
-        conn.close()
+            if k == "main_rating":
+                if v not in ["mu", "dex", "mal"]:
+                    continue
+            if k == "title_languages":
+                if not isinstance(v, str):
+                    continue
+                langs = [l for l in v.split(",")]
+                iso639_1 = iso_langs()
+                v_ = [i for i in langs if i in iso639_1]
+                v = ",".join(v_)
+                if "en" not in v:
+                    v = "en" + v
+                    app.logger.info("Don't remove English from title languages or you may break something.")
+            params.append((v, k))
+            app.config[k] = v
+
+        if "mu_lists" in data and isinstance(data["mu_lists"], dict):
+            for k, v in data["mu_lists"].items():
+                if k not in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
+                    continue
+                if not _is_int(v):
+                    continue
+                params.append((v, f"mu_list_{k}"))
+
+        if params:
+            cursor.executemany("UPDATE settings SET value = ? WHERE key = ? ", params)
+            cursor.connection.commit()
+            get_settings(app)
+            app.extensions["celery"].send_task("reload_settings", priority=0)
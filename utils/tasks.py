@@ -1,11 +1,13 @@
-from celery import shared_task
+from celery import shared_task, chain
 from flask import current_app
-from time import sleep
+from time import sleep, time
+from typing import Optional, Tuple
 from utils.mangaupdates_integration import mu_get_data_for_all, mu_update_ratings, mu_update_ongoing, mu_sync_lists, \
-    mu_update_series
+    mu_update_series, mu_changed, mu_full_sync_due, mu_sync_done, mu_stale_series, mu_update_series_ids, \
+    list_names as mu_list_names
 from utils.mangadex_integration import dex_start, dex_update_ratings, dex_sync_lists, dex_sync_lists_forced, \
-    dex_fetch_ids
-from utils.tasks_2 import db_backup, mu_all, dex_all
+    dex_fetch_ids, dex_refresh_token, dex_list_changes, dex_add_series, dex_authenticate, dex_get_headers
+from utils.tasks_2 import db_backup, thumbnails_gc, download_thumbnails
 
 
 @shared_task(name="reload_settings", ignore_result=True)
@@ -20,9 +22,49 @@ def db_backup_task():
     db_backup()
 
 
+@shared_task(name="thumbnails_gc", ignore_result=True)
+def thumbnails_gc_task():
+    thumbnails_gc()
+
+
+@shared_task(name="download_thumbnails", ignore_result=True)
+def download_thumbnails_task(items):
+    download_thumbnails(items)
+
+
+# mu_all and dex_all run as a chain of sub-tasks: every stage, and every chunk_size series of the series stage, is a
+# task of its own, acked only once it has finished (a worker restart runs it again). MU stages read the lists again
+# from the pages saved by mu_get_data_for_all, Dex ones get them from dex_all_task; both skip what is already done,
+# so nothing finished is redone.
+chunk_size = 200
+
+
+# Progress of a job is kept as the PROGRESS state of the task that started it, until the last sub-task, which
+# inherits its id, stores the final document as the result
+def _progress(task, job: str, stage: Optional[str] = None, total: int = 0, processed: int = 0,
+              errors: int = 0) -> dict:
+    result = task.AsyncResult(job)
+    now = int(time())
+    meta = dict(result.info) if result.state == "PROGRESS" else \
+        {"stage": None, "processed": 0, "total": 0, "errors": 0, "eta": None, "started": now, "stage_started": now}
+    if stage and meta["stage"] != stage:
+        meta.update(stage=stage, processed=0, total=total, stage_started=now)
+    meta["processed"] = min(meta["processed"] + processed, meta["total"])
+    meta["errors"] += errors
+    done = meta["processed"]
+    meta["eta"] = round((now - meta["stage_started"]) / done * (meta["total"] - done)) if done else None
+    task.update_state(task_id=job, state="PROGRESS", meta=meta)
+    return meta
+
+
+def _failed(task, job: str, e: Exception) -> None:
+    current_app.logger.error(e)
+    task.backend.mark_as_failure(job, e)
+
+
 @shared_task(name="mu_update_ratings")
 def mu_update_ratings_task():
-    data, _ = mu_get_data_for_all()
+    data, _ = mu_get_data_for_all(resume=False)
     if not data:
         raise Exception("No data returned")
     s = mu_update_ratings(data)
@@ -30,9 +72,73 @@ def mu_update_ratings_task():
         raise Exception("Failed to update ratings")
 
 
-@shared_task(name="mu_all")
-def mu_all_task():
-    mu_all()
+@shared_task(name="mu_all", bind=True, acks_late=True, reject_on_worker_lost=True)
+def mu_all_task(self):
+    job = self.request.id
+    try:
+        _progress(self, job, "lists", 1)
+        # Lists saved by an interrupted run are stale once series have been moved
+        moved = mu_update_ongoing() == 2
+        data, headers = mu_get_data_for_all(resume=not moved)
+        if not data or not headers:
+            raise Exception("No data returned")
+        # A full sync adds to MU every series missing from the downloaded lists, so it needs all of them
+        full = mu_full_sync_due() and len(data) == len(mu_list_names)
+        _progress(self, job, processed=1)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
+    return self.replace(chain(mu_all_sync_task.si(job, full), mu_all_series_task.si(job, full),
+                              mu_all_ratings_task.si(job, full)))
+
+
+@shared_task(name="mu_all_sync", bind=True, acks_late=True, reject_on_worker_lost=True)
+def mu_all_sync_task(self, job: str, full: bool):
+    try:
+        _progress(self, job, "sync_lists", 1)
+        data, headers = mu_get_data_for_all()
+        if not data or not headers:
+            raise Exception("No data returned")
+        ok = mu_sync_lists(data if full else mu_changed(data), headers, full)
+        _progress(self, job, processed=1, errors=0 if ok else 1)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
+
+
+@shared_task(name="mu_all_series", bind=True, acks_late=True, reject_on_worker_lost=True)
+def mu_all_series_task(self, job: str, full: bool, after: str = ""):
+    try:
+        data, _ = mu_get_data_for_all()
+        if not data:
+            raise Exception("No data returned")
+        ids = mu_stale_series(data if full else mu_changed(data))
+        _progress(self, job, "series", len(ids))
+        ids = [i for i in ids if i > after]
+        errors = mu_update_series_ids(ids[:chunk_size])
+        _progress(self, job, processed=len(ids[:chunk_size]), errors=errors)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
+    if len(ids) > chunk_size:
+        return self.replace(mu_all_series_task.si(job, full, ids[chunk_size - 1]))
+
+
+@shared_task(name="mu_all_ratings", bind=True, acks_late=True, reject_on_worker_lost=True)
+def mu_all_ratings_task(self, job: str, full: bool):
+    try:
+        meta = _progress(self, job, "ratings", 1)
+        data, _ = mu_get_data_for_all()
+        if not data:
+            raise Exception("No data returned")
+        ok = mu_update_ratings(data)
+        # Watermarks only move forward when the lists and the series were synced without errors
+        if not meta["errors"]:
+            mu_sync_done(data, full)
+        return _progress(self, job, processed=1, errors=0 if ok else 1)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
 
 
 @shared_task(name="mu_update_ongoing")
@@ -47,7 +153,7 @@ def mu_update_ongoing_task():
 
 @shared_task(name="mu_sync_lists")
 def mu_sync_lists_task():
-    data, headers = mu_get_data_for_all()
+    data, headers = mu_get_data_for_all(resume=False)
     if not data:
         raise Exception("No data returned")
     s = mu_sync_lists(data, headers)
@@ -57,7 +163,7 @@ def mu_sync_lists_task():
 
 @shared_task(name="mu_update_series")
 def mu_update_series_task():
-    data, _ = mu_get_data_for_all()
+    data, _ = mu_get_data_for_all(resume=False)
     if not data:
         raise Exception("No data returned")
     s = mu_update_series(data)
@@ -65,9 +171,71 @@ def mu_update_series_task():
         raise Exception("Failed to update series")
 
 
-@shared_task(name="dex_all")
-def dex_all_task():
-    dex_all()
+@shared_task(name="dex_all", bind=True, acks_late=True, reject_on_worker_lost=True)
+def dex_all_task(self):
+    job = self.request.id
+    try:
+        _progress(self, job, "lists", 1)
+        tokens, headers, lists = dex_start()
+        if not headers:
+            raise Exception("Failed to authenticate with Mangadex")
+        to_update, ids = dex_list_changes(lists)
+        _progress(self, job, processed=1)
+        _progress(self, job, "series", len(ids))
+    except Exception as e:
+        _failed(self, job, e)
+        raise
+    # The login and the lists are only fetched here: each chunk gets its titles as {status: [ids]}, and the last
+    # task the tokens, which it refreshes only when MangaDex rejects them
+    statuses = {k: v for v, ids_ in lists.items() for k in ids_}
+    chunks = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = {}
+        for k in ids[i:i + chunk_size]:
+            chunk.setdefault(statuses[k], []).append(k)
+        chunks.append(dex_all_series_task.si(job, chunk))
+    return self.replace(chain(*chunks, dex_all_ratings_task.si(job, tokens, lists, to_update)))
+
+
+@shared_task(name="dex_all_series", bind=True, acks_late=True, reject_on_worker_lost=True)
+def dex_all_series_task(self, job: str, chunk: dict):
+    try:
+        # Titles added before a worker restart are in the db already
+        _, ids = dex_list_changes(chunk)
+        errors = dex_add_series(chunk, ids)
+        _progress(self, job, processed=sum(len(i) for i in chunk.values()), errors=errors)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
+
+
+def _dex_headers(tokens: dict) -> Tuple[dict, dict]:
+    headers = {}
+    if time() < tokens["expiration"]:
+        headers, _ = dex_get_headers(tokens)
+    if not headers:
+        tokens, headers = dex_refresh_token(tokens)
+    if not headers and (tokens := dex_authenticate()):
+        headers, _ = dex_get_headers(tokens)
+    return tokens, headers
+
+
+@shared_task(name="dex_all_ratings", bind=True, acks_late=True, reject_on_worker_lost=True)
+def dex_all_ratings_task(self, job: str, tokens: dict, lists: dict, to_update: dict):
+    try:
+        _progress(self, job, "ratings", 1)
+        tokens, headers = _dex_headers(tokens)
+        if not headers:
+            raise Exception("Failed to authenticate with Mangadex")
+        if to_update and current_app.config["DEX_INTEGRATION_FORCED"]:
+            tokens, headers = dex_sync_lists_forced(tokens, headers, to_update)
+        if not headers:
+            raise Exception("Failed to authenticate with Mangadex")
+        ok = dex_update_ratings(lists, headers)
+        return _progress(self, job, processed=1, errors=0 if ok else 1)
+    except Exception as e:
+        _failed(self, job, e)
+        raise
 
 
 @shared_task(name="dex_update_ratings")
@@ -1,28 +1,43 @@
 def db_backup():
     from datetime import datetime
+    from utils.db import get_connection
     import sqlite3
     import os
 
     os.makedirs("data/backups", exist_ok=True)
     dst_name = f"data/backups/mml_{datetime.today().strftime('%Y-%m-%d')}.sqlite3"
-    with sqlite3.connect(f"data/mml.sqlite3") as src, sqlite3.connect(dst_name) as dst:
-        src.backup(dst)
+    dst = sqlite3.connect(dst_name)
+    get_connection().backup(dst)
+    dst.close()
 
     backups = sorted(os.listdir("data/backups"))
     for backup in backups[:-10]:
         os.remove(os.path.join("data/backups", backup))
 
 
+def thumbnails_gc():
+    from utils.thumbnails import gc
+    from utils.db import get_cursor
+    with get_cursor() as cursor:
+        gc(cursor)
+
+
 def mu_all():
     from utils.mangaupdates_integration import mu_update_ongoing, mu_get_data_for_all, mu_sync_lists, mu_update_series, \
-        mu_update_ratings
-    mu_update_ongoing()
-    data, headers = mu_get_data_for_all()
+        mu_update_ratings, mu_changed, mu_full_sync_due, mu_sync_done, list_names as mu_list_names
+    # Lists saved by an interrupted run are stale once series have been moved
+    moved = mu_update_ongoing() == 2
+    data, headers = mu_get_data_for_all(resume=not moved)
     if not data or not headers:
         return
-    mu_sync_lists(data, headers)
-    mu_update_series(data)
+    # A full sync adds to MU every series missing from the downloaded lists, so it needs all of them
+    full = mu_full_sync_due() and len(data) == len(mu_list_names)
+    changed = data if full else mu_changed(data)
+    ok = mu_sync_lists(changed, headers, full)
+    ok = mu_update_series(changed) and ok
     mu_update_ratings(data)
+    if ok:
+        mu_sync_done(data, full)
 
 def dex_all():
     from utils.mangadex_integration import dex_start, dex_sync_lists, dex_sync_lists_forced, dex_refresh_token, \
@@ -32,9 +47,20 @@ def dex_all():
     if not tokens or not headers or not lists:
         return
     to_update = dex_sync_lists(lists)
-    if current_app.config["DEX_INTEGRATION_FORCED"] == "1":
+    if current_app.config["DEX_INTEGRATION_FORCED"]:
         tokens, headers = dex_sync_lists_forced(tokens, headers, to_update)
     _, headers = dex_refresh_token(tokens)
     if not headers:
         return
-    dex_update_ratings(lists, headers)
\ No newline at end of file
+    dex_update_ratings(lists, headers)
+
+def download_thumbnails(items):
+    from utils.common_db import download_thumbnail
+    from utils.thumbnails import relink
+    from utils.db import get_cursor
+    with get_cursor() as cursor:
+        for series_id, url in items:
+            _, s = download_thumbnail(series_id, url, cursor)
+            if s == 201:
+                cursor.connection.commit()
+                relink([series_id], cursor)
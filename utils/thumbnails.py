@@ -0,0 +1,197 @@
+from flask import current_app as app
+from utils import http_client
+from typing import Iterable, Tuple, Optional
+from time import time
+import tempfile
+import hashlib
+import sqlite3
+import os
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+THUMBNAILS_DIR = "data/thumbnails"
+OBJECTS_DIR = os.path.join(THUMBNAILS_DIR, "objects")
+VARIANTS_DIR = os.path.join(THUMBNAILS_DIR, "variants")
+chunk_size = 64 * 1024
+gc_grace = 3600  # objects younger than this may belong to a transaction that is not committed yet
+# Extensions unlink() looks for; a link with any other extension is left to gc(), which scans the whole directory
+link_extensions = ("jpg", "jpeg", "png", "webp", "gif", "avif")
+
+widths = (128, 256, 512)
+# format: (mimetype, save options), in order of preference
+variant_formats = {
+    "avif": ("image/avif", {"quality": 55}),
+    "webp": ("image/webp", {"quality": 80, "method": 4}),
+}
+
+
+# Images are stored once under objects/<sha256[:2]>/<sha256>.<ext>; data/thumbnails/<series_id>.<ext> is a link
+# to the object, so /static/thumbnails/<id>.<ext> keeps working and identical covers share one file.
+def object_path(hash_: str, ext: str) -> str:
+    return os.path.join(OBJECTS_DIR, hash_[:2], f"{hash_}.{ext}")
+
+
+def series_path(series_id: int, ext: str) -> str:
+    return os.path.join(THUMBNAILS_DIR, f"{series_id}.{ext}")
+
+
+def store(chunks: Iterable[bytes], ext: str) -> str:
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=OBJECTS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        if not size:
+            raise ValueError("Empty image")
+        hash_ = sha.hexdigest()
+        path = object_path(hash_, ext)
+        if os.path.exists(path):
+            os.remove(tmp)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        return hash_
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# Returns (hash, extension), ("", "") if the image could not be downloaded
+def download(url: str) -> Tuple[str, str]:
+    if url.startswith("line://"):
+        from utils.line import get_thumbnail
+        img = get_thumbnail(url[7:])
+        if not img:
+            app.logger.error(f"Failed to download image from {url}")
+            return "", ""
+        ext = url[-3:]
+        return store([img], ext), ext
+
+    with http_client.get(url, stream=True) as response:
+        if response.status_code != 200:
+            app.logger.error(f"Failed to download image from {url}, status code: {response.status_code}")
+            return "", ""
+        ext = response.headers.get("Content-Type").split("/")[-1]
+        return store(response.iter_content(chunk_size), ext), ext
+
+
+def unlink(series_id: int, *exts: str) -> None:
+    for ext in {*link_extensions, *exts}:
+        path = series_path(series_id, ext)
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def link(series_id: int, hash_: str, ext: str) -> None:
+    unlink(series_id, ext)
+    path = series_path(series_id, ext)
+    try:
+        os.symlink(os.path.relpath(object_path(hash_, ext), THUMBNAILS_DIR), path)
+    except OSError:
+        os.link(object_path(hash_, ext), path)
+
+
+# Points <series_id>.<ext> at the object series_thumbnails refers to. Called once the row is committed, so a rolled
+# back change never leaves a link to an object gc() will delete
+def relink(series_ids: Iterable[int], cursor: sqlite3.Cursor) -> None:
+    ids = list(series_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(f"SELECT series_id, extension, hash FROM series_thumbnails WHERE series_id IN ({", ".join("?" for _ in chunk)})",
+                       chunk)
+        for series_id, ext, hash_ in cursor.fetchall():
+            if hash_:
+                link(series_id, hash_, ext)
+
+
+def variant_width(w: int) -> int:
+    return next((i for i in widths if i >= w), widths[-1])
+
+
+# Best format the client accepts and Pillow can write, None if variants can't be served (originals are used)
+def variant_format(accept: str) -> Optional[str]:
+    if Image is None:
+        return None
+    for fmt, (mimetype, _) in variant_formats.items():
+        if mimetype in accept and features.check(fmt):
+            return fmt
+    return None
+
+
+# Resized copies of an object live in variants/<sha256[:2]>/<sha256>_<width>.<format> and are created on first use
+def variant(hash_: str, ext: str, width: int, fmt: str) -> str:
+    path = os.path.join(VARIANTS_DIR, hash_[:2], f"{hash_}_{width}.{fmt}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with Image.open(object_path(hash_, ext)) as img:
+        img.seek(0)
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format=fmt.upper(), **variant_formats[fmt][1])
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+    return path
+
+
+# Moves old <series_id>.<ext> files into the store, then removes objects, variants and links no series refers to
+def gc(cursor: sqlite3.Cursor) -> Tuple[int, int]:
+    if not os.path.isdir(THUMBNAILS_DIR):
+        return 0, 0
+    adopted = 0
+    cursor.execute("SELECT series_id, extension, hash FROM series_thumbnails")
+    rows = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+    for series_id, (ext, hash_) in rows.items():
+        path = series_path(series_id, ext)
+        if hash_ or os.path.islink(path) or not os.path.isfile(path) or not os.path.getsize(path):
+            continue
+        with open(path, "rb") as f:
+            hash_ = store(iter(lambda: f.read(chunk_size), b""), ext)
+        cursor.execute("UPDATE series_thumbnails SET hash = ? WHERE series_id = ?", (hash_, series_id))
+        cursor.connection.commit()
+        link(series_id, hash_, ext)
+        rows[series_id] = (ext, hash_)
+        adopted += 1
+
+    removed = 0
+    now = time()
+    for name in os.listdir(THUMBNAILS_DIR):
+        path = os.path.join(THUMBNAILS_DIR, name)
+        if os.path.isdir(path) or now - os.lstat(path).st_mtime < gc_grace:
+            continue
+        series_id, _, ext = name.partition(".")
+        if not series_id.isdigit() or rows.get(int(series_id), ("",))[0] != ext \
+                or not os.path.exists(path) or not os.path.getsize(path):
+            os.remove(path)
+            removed += 1
+
+    referenced = {h for _, h in rows.values() if h}
+    for directory in (OBJECTS_DIR, VARIANTS_DIR):
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.split(".", 1)[0].split("_", 1)[0] in referenced or now - os.path.getmtime(path) < gc_grace:
+                    continue
+                os.remove(path)
+                removed += 1
+    app.logger.info(f"Thumbnails GC: {adopted} moved to the store, {removed} files removed")
+    return adopted, removed
+
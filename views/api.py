@@ -1,11 +1,17 @@
-from flask import Blueprint, jsonify, request, session, current_app as app
+from flask import Blueprint, jsonify, request, session, Response, stream_with_context, current_app as app
 from views.api_external import api_external_bp
 from views.api_series import api_series_bp
 from views.api_authors import api_authors_bp
 from views.api_h import api_h_bp
 from views.api_integration import integration_bp
 from utils.settings import update_settings
-import sqlite3
+from utils.db import get_cursor
+from utils.db_series import iter_series
+from utils.http_cache import conditional
+from datetime import date
+import json
+import csv
+import io
 
 # Blueprints
 api_bp = Blueprint("api", __name__, url_prefix="/api/v1")
@@ -44,91 +50,132 @@ def auth_check():
     return "", 500
 
 @api_bp.route("/status", methods=["GET"])
+@conditional
 def status():
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        data = {
-            "series_total": 0,
-            "series_by_status": {},
-            "series_by_type": {},
-            "authors": 0,
-            "h": 0,
-            "mu_integration": False,
-            "dex_integration": False,
-            "mal_integration": False,
-        }
-
-        cursor.execute("SELECT COUNT(*) FROM series")
-        data["series_total"] = cursor.fetchone()[0]
-
-        for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
-            cursor.execute("SELECT COUNT(*) FROM series WHERE status = ?", (i,))
-            data["series_by_status"][i.lower()] = cursor.fetchone()[0]
-
-        for i in ("Manga", "Manhwa", "Manhua", "OEL", "Vietnamese", "Malaysian", "Indonesian",
-                  "Novel", "Artbook", "Other"):
-            cursor.execute("SELECT COUNT(*) FROM series WHERE type = ?", (i,))
-            data["series_by_type"][i.lower()] = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM authors")
-        data["authors"] = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM nhentai_ids")
-        c = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM schale_ids")
-        data["h"] = c + cursor.fetchone()[0]
-
-        data["mu_integration"] = bool(app.config.get("MU_INTEGRATION"))
-        data["dex_integration"] = bool(app.config.get("DEX_INTEGRATION"))
-        data["mal_integration"] = bool(app.config.get("MAL_INTEGRATION"))
-
-        conn.close()
-        return jsonify({"result": "OK", "data": data}), 200
+        with get_cursor(row=True) as cursor:
+            data = {
+                "series_total": 0,
+                "series_by_status": {},
+                "series_by_type": {},
+                "authors": 0,
+                "h": 0,
+                "mu_integration": False,
+                "dex_integration": False,
+                "mal_integration": False,
+            }
+
+            cursor.execute("SELECT name, value FROM counters")
+            counters = {r[0]: r[1] for r in cursor.fetchall()}
+
+            data["series_total"] = counters.get("series", 0)
+            for i in ("plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"):
+                data["series_by_status"][i.lower()] = counters.get(f"status:{i}", 0)
+            for i in ("Manga", "Manhwa", "Manhua", "OEL", "Vietnamese", "Malaysian", "Indonesian",
+                      "Novel", "Artbook", "Other"):
+                data["series_by_type"][i.lower()] = counters.get(f"type:{i}", 0)
+            data["authors"] = counters.get("authors", 0)
+            data["h"] = counters.get("nhentai_ids", 0) + counters.get("schale_ids", 0)
+
+            data["mu_integration"] = bool(app.config.get("MU_INTEGRATION"))
+            data["dex_integration"] = bool(app.config.get("DEX_INTEGRATION"))
+            data["mal_integration"] = bool(app.config.get("MAL_INTEGRATION"))
+
+            return jsonify({"result": "OK", "data": data}), 200
 
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
 
 
+export_columns = ["id", "title", "type", "status", "year", "user_rating", "id_mu", "id_dex", "id_mal", "id_bato",
+                  "id_line", "rating_mu", "rating_dex", "rating_mal", "authors", "genres", "alt_titles", "vol_ch",
+                  "is_md", "description"]
+
+
+def _export_row(series: dict) -> list:
+    row = {k: series[k] for k in ("id", "title", "type", "status", "year", "user_rating", "vol_ch", "is_md",
+                                  "description")}
+    for k, v in series["ids"].items():
+        row[f"id_{k}"] = v
+    for k in ("mu", "dex", "mal"):
+        row[f"rating_{k}"] = series["ratings"].get(k)
+    row["authors"] = " / ".join(f"{a['name']} ({a['type']})" for a in series["authors"])
+    row["genres"] = " / ".join(series["genres"])
+    row["alt_titles"] = " / ".join(series["alt_titles"])
+    return [row[c] for c in export_columns]
+
+
+@api_bp.route("/export", methods=["GET"])
+# Streams the whole library, one series per line (ndjson) or row (csv)
+def export():
+    format_ = request.args.get("format", "ndjson")
+    if format_ not in ("ndjson", "csv"):
+        return jsonify({"result": "KO", "error": "Invalid format, must be ndjson or csv"}), 400
+
+    def generate():
+        try:
+            with get_cursor(row=True) as cursor, get_cursor() as hydrate_cursor:
+                if format_ == "ndjson":
+                    for series in iter_series(cursor, hydrate_cursor):
+                        yield json.dumps(series, ensure_ascii=False) + "\n"
+                    return
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(export_columns)
+                for series in iter_series(cursor, hydrate_cursor):
+                    writer.writerow(_export_row(series))
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.getvalue():
+                    yield buffer.getvalue()
+        except Exception as e:
+            app.logger.error(e)
+            raise
+
+    mimetype = "application/x-ndjson" if format_ == "ndjson" else "text/csv"
+    filename = f"mml_{date.today().isoformat()}.{format_}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
 @api_bp.route("/settings", methods=["GET"])
+@conditional
 def get_settings():
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM settings")
-        db = {r[0]: r[1] for r in cursor.fetchall()}
-        data = {
-            "main_rating": db["main_rating"],
-            "title_languages": db["title_languages"],
-            "mu_integration": bool(int(db.get("mu_integration", 0))),
-            "mu_automation": bool(int(db.get("mu_automation", 0))),
-            "mu_username": db.get("mu_username"),
-            "mu_password": bool(db.get("mu_password")),
-            "mu_lists": {
-                "plan-to": int(db.get("mu_list_plan-to")),
-                "reading": int(db.get("mu_list_reading")),
-                "completed": int(db.get("mu_list_completed")),
-                "one-shots": int(db.get("mu_list_one-shots")),
-                "dropped": int(db.get("mu_list_dropped")),
-                "on-hold": int(db.get("mu_list_on-hold")),
-                "ongoing": int(db.get("mu_list_ongoing")),
-            },
-            "dex_fetch_ids": bool(int(db.get("dex_fetch_ids", 0))),
-            "dex_integration": bool(int(db.get("dex_integration", 0))),
-            "dex_integration_forced": bool(int(db.get("dex_integration_forced", 0))),
-            "dex_automation": bool(int(db.get("dex_automation", 0))),
-            "dex_username": db.get("dex_username"),
-            "dex_password": bool(db.get("dex_password")),
-            "dex_client_id": db.get("dex_token"),
-            "dex_secret": bool(db.get("dex_secret")),
-            "mal_integration": bool(int(db.get("mal_integration", 0))),
-            "mal_automation": bool(int(db.get("mal_automation", 0))),
-            "mal_client_id": db.get("mal_client_id"),
-        }
-        conn.close()
-        return jsonify({"result": "OK", "data": data}), 200
+        with get_cursor() as cursor:
+            cursor.execute("SELECT * FROM settings")
+            db = {r[0]: r[1] for r in cursor.fetchall()}
+            data = {
+                "main_rating": db["main_rating"],
+                "title_languages": db["title_languages"],
+                "mu_integration": bool(int(db.get("mu_integration", 0))),
+                "mu_automation": bool(int(db.get("mu_automation", 0))),
+                "mu_username": db.get("mu_username"),
+                "mu_password": bool(db.get("mu_password")),
+                "mu_lists": {
+                    "plan-to": int(db.get("mu_list_plan-to")),
+                    "reading": int(db.get("mu_list_reading")),
+                    "completed": int(db.get("mu_list_completed")),
+                    "one-shots": int(db.get("mu_list_one-shots")),
+                    "dropped": int(db.get("mu_list_dropped")),
+                    "on-hold": int(db.get("mu_list_on-hold")),
+                    "ongoing": int(db.get("mu_list_ongoing")),
+                },
+                "dex_fetch_ids": bool(int(db.get("dex_fetch_ids", 0))),
+                "dex_integration": bool(int(db.get("dex_integration", 0))),
+                "dex_integration_forced": bool(int(db.get("dex_integration_forced", 0))),
+                "dex_automation": bool(int(db.get("dex_automation", 0))),
+                "dex_username": db.get("dex_username"),
+                "dex_password": bool(db.get("dex_password")),
+                "dex_client_id": db.get("dex_token"),
+                "dex_secret": bool(db.get("dex_secret")),
+                "mal_integration": bool(int(db.get("mal_integration", 0))),
+                "mal_automation": bool(int(db.get("mal_automation", 0))),
+                "mal_client_id": db.get("mal_client_id"),
+            }
+            return jsonify({"result": "OK", "data": data}), 200
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
@@ -1,21 +1,34 @@
 from flask import Blueprint, jsonify, request, current_app as app
-from utils.common_code import valid_ids
-from utils.db_authors import get_author, get_authors
-import sqlite3
+from utils.common_code import valid_ids, encode_cursor, decode_cursor
+from utils.db_authors import get_author, get_authors, author_sort_key
+from utils.db import get_cursor
+from utils.http_cache import conditional
 
 api_authors_bp = Blueprint("api_authors", __name__, url_prefix="/authors")
 
 
 @api_authors_bp.route("", methods=["GET"])
-def get_authors():
+@conditional
+def get_authors_list():
     try:
         page = request.args.get("page", 1, type=int)
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        authors = get_authors(page, cursor)
-        conn.close()
-        if authors:
-            return jsonify({"result": "OK", "page": page, "data": authors}), 200
+        sort_by = request.args.get("sort_by", "id")
+        if sort_by not in ("id", "name", "series"):
+            return jsonify({"result": "KO", "error": "Invalid sort_by"}), 400
+        name = request.args.get("name", "").strip()
+        after = None
+        if request.args.get("cursor"):
+            after = decode_cursor(request.args["cursor"])
+            if not after or after[0] != sort_by or len(after) != (2 if sort_by == "id" else 3) \
+                    or not isinstance(after[-1], int):
+                return jsonify({"result": "KO", "error": "Invalid cursor for this sort_by"}), 400
+            after = after[1:]
+        with get_cursor() as cursor:
+            authors = get_authors(page, cursor, after, sort_by, name)
+            next_cursor = None
+            if len(authors) == 100:
+                next_cursor = encode_cursor([sort_by] + author_sort_key(authors[-1], sort_by))
+            return jsonify({"result": "OK", "page": page, "data": authors, "next_cursor": next_cursor}), 200
     except Exception as e:
         app.logger.error(e)
     return jsonify({"result": "KO", "error": "Internal error"}), 500
@@ -27,62 +40,56 @@ def create_author():
         name = request.get_json().get("name")
         if not name:
             return jsonify({"result": "KO", "error": "No name provided"}), 400
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute(f"INSERT INTO authors (name) VALUES (?) RETURNING id", (name,))
-        id_ = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
-        r, s = get_author(id_, cursor)
-        if s == 200:
-            return jsonify({"result": "OK", "data": r}), 201
+        with get_cursor() as cursor:
+            cursor.execute(f"INSERT INTO authors (name) VALUES (?) RETURNING id", (name,))
+            id_ = cursor.fetchone()[0]
+            cursor.connection.commit()
+            r, s = get_author(id_, cursor)
+            if s == 200:
+                return jsonify({"result": "OK", "data": r}), 201
     except Exception as e:
         app.logger.error(e)
     return jsonify({"result": "KO", "error": "Internal error"}), 500
 
 
 @api_authors_bp.route("/search", methods=["GET"])
+@conditional
 def search_authors():
     try:
         name = request.args.get("name")
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM authors WHERE name = ?", (name,))
-        rows = cursor.fetchall()
-        conn.close()
-        authors = []
-        for a in rows:
-            author_data = {
-                "id": a["id"],
-                "ids": {
-                    "mu": a["id_mu"],
-                    "dex": a["id_dex"],
-                    "mal": a["id_mal"],
-                },
-                "name": a["name"],
-            }
-            authors.append(author_data)
-        if not authors:
-            return jsonify({"result": "KO", "error": "No author found"}), 404
-        return jsonify({"result": "OK", "data": authors}), 200
+        with get_cursor(row=True) as cursor:
+            cursor.execute("SELECT * FROM authors WHERE name = ?", (name,))
+            rows = cursor.fetchall()
+            authors = []
+            for a in rows:
+                author_data = {
+                    "id": a["id"],
+                    "ids": {
+                        "mu": a["id_mu"],
+                        "dex": a["id_dex"],
+                        "mal": a["id_mal"],
+                    },
+                    "name": a["name"],
+                }
+                authors.append(author_data)
+            if not authors:
+                return jsonify({"result": "KO", "error": "No author found"}), 404
+            return jsonify({"result": "OK", "data": authors}), 200
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
 
 
 @api_authors_bp.route("/<int:id_>", methods=["GET"])
+@conditional
 def get_authors_by_id(id_):
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        r, s = get_author(id_, cursor)
-        conn.close()
-        if s != 200:
-            return jsonify(r), s
-        author = r
-        return jsonify({"result": "OK", "data": author}), 200
+        with get_cursor() as cursor:
+            r, s = get_author(id_, cursor)
+            if s != 200:
+                return jsonify(r), s
+            author = r
+            return jsonify({"result": "OK", "data": author}), 200
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
@@ -95,51 +102,46 @@ def update_author(id_):
         if not data:
             return jsonify({"result": "KO", "error": "No data provided"}), 400
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        r, s = get_author(id_, cursor)
-        if s != 200:
-            return jsonify(r), s
-
-        ids = None
-        if "ids" in data:
-            if not (ids := valid_ids(data.get("ids"), reduced=True)):
-                conn.close()
-                return jsonify({"result": "KO", "error": "IDs not valid"}), 400
-            for key, value in ids.items():
-                cursor.execute(f"SELECT id FROM authors WHERE id_{key} = ? AND id != ?", (value, id_))
-                if cursor.fetchone():
-                    conn.close()
-                    return jsonify({"result": "KO", "error": f"Author with {key} ID {value} already exists"}), 409
-
-        update_fields = []
-        update_params = []
-
-        if ids:
-            id_fields = ["mu", "dex", "mal"]
-            for field in id_fields:
-                if field in ids:
-                    update_fields.append(f"id_{field} = ?")
-                    update_params.append(ids[field])
-
-        if name := data.get("name"):
-            update_fields.append("name = ?")
-            update_params.append(name)
-
-        if update_fields:
-            query = f"UPDATE authors SET {', '.join(update_fields)} WHERE id = ?"
-            update_params.append(id_)
-            cursor.execute(query, update_params)
-
-        r, s = get_author(id_, cursor)
-        if s != 200:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Internal error"}), 500
-
-        conn.commit()
-        conn.close()
-
-        return jsonify({"result": "OK", "data": r}), 200
+        with get_cursor() as cursor:
+            r, s = get_author(id_, cursor)
+            if s != 200:
+                return jsonify(r), s
+
+            ids = None
+            if "ids" in data:
+                if not (ids := valid_ids(data.get("ids"), reduced=True)):
+                    return jsonify({"result": "KO", "error": "IDs not valid"}), 400
+                for key, value in ids.items():
+                    cursor.execute(f"SELECT id FROM authors WHERE id_{key} = ? AND id != ?", (value, id_))
+                    if cursor.fetchone():
+                        return jsonify({"result": "KO", "error": f"Author with {key} ID {value} already exists"}), 409
+
+            update_fields = []
+            update_params = []
+
+            if ids:
+                id_fields = ["mu", "dex", "mal"]
+                for field in id_fields:
+                    if field in ids:
+                        update_fields.append(f"id_{field} = ?")
+                        update_params.append(ids[field])
+
+            if name := data.get("name"):
+                update_fields.append("name = ?")
+                update_params.append(name)
+
+            if update_fields:
+                query = f"UPDATE authors SET {', '.join(update_fields)} WHERE id = ?"
+                update_params.append(id_)
+                cursor.execute(query, update_params)
+
+            r, s = get_author(id_, cursor)
+            if s != 200:
+                return jsonify({"result": "KO", "error": "Internal error"}), 500
+
+            cursor.connection.commit()
+
+            return jsonify({"result": "OK", "data": r}), 200
 
     except Exception as e:
         app.logger.error(e)
@@ -155,42 +157,36 @@ def merge_authors():
         ids = [int(i) for i in ids]
         ids.sort()
         id_ = ids[0]
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        external_ids = {}
-        for i in ids:
-            r, s = get_author(i, cursor)
-            if s == 404:
-                conn.close()
-                return jsonify({"result": "KO", "error": f"No author found for id {i}"}), 404
-            for k, v in r["ids"].items():
-                if v is None:
-                    continue
-                if k in external_ids and external_ids[k] != v:
-                    conn.close()
-                    return jsonify({"result": "KO", "error": "Conflict in external IDs"}), 409
-                external_ids[k] = v
-
-        series_to_merge = []
-        for i in ids[1:]:
-            cursor.execute("SELECT series_id, author_type FROM series_authors WHERE author_id = ?", (i,))
-            for r in cursor.fetchall():
-                series_to_merge.append((r[0], id_, r[1]))
-            cursor.execute("DELETE FROM authors WHERE id = ?", (i,))
-
-        for k, v in external_ids.items():
-            cursor.execute(f"UPDATE authors SET id_{k} = ? WHERE id = ?", (v, id_))
-        cursor.executemany("INSERT INTO series_authors VALUES (?, ?, ?)", series_to_merge)
-
-        r, s = get_author(id_, cursor)
-        if s != 200:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Internal error"}), 500
-
-        conn.commit()
-        conn.close()
-        return jsonify({"result": "OK", "data": r}), 200
+        with get_cursor() as cursor:
+            external_ids = {}
+            for i in ids:
+                r, s = get_author(i, cursor)
+                if s == 404:
+                    return jsonify({"result": "KO", "error": f"No author found for id {i}"}), 404
+                for k, v in r["ids"].items():
+                    if v is None:
+                        continue
+                    if k in external_ids and external_ids[k] != v:
+                        return jsonify({"result": "KO", "error": "Conflict in external IDs"}), 409
+                    external_ids[k] = v
+
+            series_to_merge = []
+            for i in ids[1:]:
+                cursor.execute("SELECT series_id, author_type FROM series_authors WHERE author_id = ?", (i,))
+                for r in cursor.fetchall():
+                    series_to_merge.append((r[0], id_, r[1]))
+                cursor.execute("DELETE FROM authors WHERE id = ?", (i,))
+
+            for k, v in external_ids.items():
+                cursor.execute(f"UPDATE authors SET id_{k} = ? WHERE id = ?", (v, id_))
+            cursor.executemany("INSERT INTO series_authors VALUES (?, ?, ?)", series_to_merge)
+
+            r, s = get_author(id_, cursor)
+            if s != 200:
+                return jsonify({"result": "KO", "error": "Internal error"}), 500
+
+            cursor.connection.commit()
+            return jsonify({"result": "OK", "data": r}), 200
 
     except Exception as e:
         app.logger.error(e)
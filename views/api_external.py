@@ -1,11 +1,12 @@
 from flask import Blueprint, jsonify, request, current_app as app
-import sqlite3
+from utils.db import get_cursor
 from utils.external import series_data_external
 from utils.common_code import valid_ids
-from utils.common_db import update_ratings
+from utils.common_db import update_ratings, find_series_ids
 from typing import Tuple
 
 api_external_bp = Blueprint("api_external", __name__, url_prefix="/external")
+max_lookup_ids = 1000
 
 
 @api_external_bp.route("/series/id", methods=["GET"])
@@ -13,22 +14,54 @@ def get_series_id() -> Tuple[jsonify, int]:
     try:
         if not (ids := valid_ids(request.args.to_dict())):
             return jsonify({"result": "KO", "error": "Invalid or missing IDs"}), 400
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        where = " OR ".join([f"id_{key} = ?" for key in ids.keys()])
-        cursor.execute(f"SELECT id FROM series WHERE {where}", tuple(ids.values()))
-        rows = cursor.fetchall()
-        conn.close()
-        if not rows:
-            return jsonify({"result": "KO", "error": "Not found"}), 404
-        if len(rows) > 1:
-            # multiple matches, manual merge may be needed
-            return jsonify({
-                "result": "MERGE_REQUIRED",
-                "error": "Manual merge required for series with multiple IDs",
-                "url": "/series/merge?ids=" + ",".join(str(r[0]) for r in rows)
-            }), 409
-        return jsonify({"result": "OK", "data": rows[0][0]}), 200
+        with get_cursor() as cursor:
+            where = " OR ".join([f"id_{key} = ?" for key in ids.keys()])
+            cursor.execute(f"SELECT id FROM series WHERE {where}", tuple(ids.values()))
+            rows = cursor.fetchall()
+            if not rows:
+                return jsonify({"result": "KO", "error": "Not found"}), 404
+            if len(rows) > 1:
+                # multiple matches, manual merge may be needed
+                return jsonify({
+                    "result": "MERGE_REQUIRED",
+                    "error": "Manual merge required for series with multiple IDs",
+                    "url": "/series/merge?ids=" + ",".join(str(r[0]) for r in rows)
+                }), 409
+            return jsonify({"result": "OK", "data": rows[0][0]}), 200
+    except Exception as e:
+        app.logger.error(e)
+        return jsonify({"result": "KO", "error": "Internal error"}), 500
+
+
+# Batch version of /series/id: {"ids": {key: {mu|dex|mal|bato|line: id}}}, answered with one query per id type
+@api_external_bp.route("/series/ids", methods=["POST"])
+def get_series_ids() -> Tuple[jsonify, int]:
+    try:
+        body = request.get_json(silent=True) or {}
+        if not isinstance(entries := body.get("ids"), dict) or not entries:
+            return jsonify({"result": "KO", "error": "Invalid or missing IDs"}), 400
+        if len(entries) > max_lookup_ids:
+            return jsonify({"result": "KO", "error": f"Too many IDs, at most {max_lookup_ids} per request"}), 400
+
+        lookup = {}
+        invalid = []
+        for key, ids in entries.items():
+            if isinstance(ids, dict) and (ids := valid_ids(ids)):
+                lookup[key] = ids
+            else:
+                invalid.append(key)
+
+        found, missing, merge = {}, [], {}
+        with get_cursor() as cursor:
+            for key, rows in zip(lookup, find_series_ids(list(lookup.values()), cursor)):
+                if not rows:
+                    missing.append(key)
+                elif len(rows) > 1:
+                    merge[key] = {"ids": rows, "url": "/series/merge?ids=" + ",".join(str(r) for r in rows)}
+                else:
+                    found[key] = rows[0]
+        return jsonify({"result": "OK", "found": found, "missing": missing, "merge_required": merge,
+                        "invalid": invalid}), 200
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
@@ -62,9 +95,9 @@ def update_series_ratings() -> Tuple[jsonify, int]:
         if not isinstance(data, list):
             return jsonify({"result": "KO", "error": "Invalid or missing data"}), 400
 
-        not_exist, s = update_ratings(type_, data)
+        counts, s = update_ratings(type_, data)
         if s == 200:
-            return jsonify({"result": "OK", "not_exist": not_exist}), 200
+            return jsonify({"result": "OK", **counts}), 200
         else:
             return jsonify({"result": "KO", "error": "Internal error"}), 500
     except Exception as e:
@@ -1,8 +1,10 @@
-from flask import Blueprint, request, current_app as app
-import sqlite3
+from flask import Blueprint, jsonify, request, current_app as app
+from utils.db import get_cursor
+from utils import h_ids
 from typing import Tuple
 
 api_h_bp = Blueprint('api_h', __name__, url_prefix="/h")
+max_lookup_ids = 1000
 
 
 @api_h_bp.route("", methods=["POST"])
@@ -12,24 +14,24 @@ def add_h() -> Tuple[str, int]:
         if not id_:
             return "", 400
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        if "/" in id_:
-            i = id_.split("/")[0]
-            k = id_.split("/")[1]
-            if not i.isdigit():
-                conn.close()
-                return "", 400
-            cursor.execute("INSERT OR IGNORE INTO schale_ids VALUES(?, ?)", (int(i), k))
-        else:
-            if not id_.isdigit():
-                conn.close()
-                return "", 400
-            cursor.execute("INSERT OR IGNORE INTO nhentai_ids VALUES(?)", (int(id_),))
-        conn.commit()
-        conn.close()
-        return "", 204
+        with get_cursor() as cursor:
+            if "/" in id_:
+                i = id_.split("/")[0]
+                k = id_.split("/")[1]
+                if not i.isdigit():
+                    return "", 400
+                cursor.execute("INSERT OR IGNORE INTO schale_ids VALUES(?, ?)", (int(i), k))
+                kind, i = "schale", int(i)
+            else:
+                if not id_.isdigit():
+                    return "", 400
+                cursor.execute("INSERT OR IGNORE INTO nhentai_ids VALUES(?)", (int(id_),))
+                kind, i = "nhentai", int(id_)
+            changed = cursor.rowcount > 0
+            cursor.connection.commit()
+            if changed:
+                h_ids.changed(kind, i, True, cursor)
+            return "", 204
     except Exception as e:
         app.logger.error(e)
         return "", 500
@@ -41,23 +43,23 @@ def delete_h() -> Tuple[str, int]:
         if not id_:
             return "", 400
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-
-        if "/" in id_:
-            id_ = id_.split("/")[0]
-            if not id_.isdigit():
-                conn.close()
-                return "", 400
-            cursor.execute("DELETE FROM schale_ids WHERE schale_id=?", (int(id_),))
-        else:
-            if not id_.isdigit():
-                conn.close()
-                return "", 400
-            cursor.execute("DELETE FROM nhentai_ids WHERE nhentai_id = ?", (int(id_),))
-        conn.commit()
-        cursor.close()
-        return "", 204
+        with get_cursor() as cursor:
+            if "/" in id_:
+                id_ = id_.split("/")[0]
+                if not id_.isdigit():
+                    return "", 400
+                cursor.execute("DELETE FROM schale_ids WHERE schale_id=?", (int(id_),))
+                kind = "schale"
+            else:
+                if not id_.isdigit():
+                    return "", 400
+                cursor.execute("DELETE FROM nhentai_ids WHERE nhentai_id = ?", (int(id_),))
+                kind = "nhentai"
+            changed = cursor.rowcount > 0
+            cursor.connection.commit()
+            if changed:
+                h_ids.changed(kind, int(id_), False, cursor)
+            return "", 204
     except Exception as e:
         app.logger.error(e)
         return "", 500
@@ -66,12 +68,7 @@ def delete_h() -> Tuple[str, int]:
 @api_h_bp.route("/<int:id_>", methods=["GET"])
 def get_nhentai(id_: int) -> Tuple[str, int]:
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(1) FROM nhentai_ids WHERE nhentai_id = ?", (id_,))
-        r = cursor.fetchone()[0]
-        conn.close()
-        if r == 0:
+        if not h_ids.contains("nhentai", id_):
             return "", 404
         return "", 204
     except Exception as e:
@@ -81,14 +78,34 @@ def get_nhentai(id_: int) -> Tuple[str, int]:
 @api_h_bp.route("/<int:id_>/<key>", methods=["GET"])
 def get_h(id_: int, key: str) -> Tuple[str, int]:
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(1) FROM schale_ids WHERE schale_id = ?", (id_,))
-        r = cursor.fetchone()[0]
-        conn.close()
-        if r == 0:
+        if not h_ids.contains("schale", id_):
             return "", 404
         return "", 204
     except Exception as e:
         app.logger.error(e)
-        return "", 500
\ No newline at end of file
+        return "", 500
+
+
+# Batch version of the GET endpoints: {"nhentai": [ids], "schale": [ids]}
+@api_h_bp.route("/ids", methods=["POST"])
+def get_h_ids() -> Tuple[jsonify, int]:
+    try:
+        body = request.get_json(silent=True) or {}
+        ids = {}
+        for k in ("nhentai", "schale"):
+            values = body.get(k, [])
+            if not isinstance(values, list) or not all(isinstance(i, int) or str(i).isdigit() for i in values):
+                return jsonify({"result": "KO", "error": f"Invalid {k} IDs"}), 400
+            ids[k] = list(dict.fromkeys(int(i) for i in values))
+        if not (ids["nhentai"] or ids["schale"]):
+            return jsonify({"result": "KO", "error": "Missing IDs"}), 400
+        if len(ids["nhentai"]) + len(ids["schale"]) > max_lookup_ids:
+            return jsonify({"result": "KO", "error": f"Too many IDs, at most {max_lookup_ids} per request"}), 400
+
+        found = {k: set(h_ids.existing(k, ids[k])) for k in ids}
+        return jsonify({"result": "OK",
+                        "found": {k: [i for i in ids[k] if i in found[k]] for k in ids},
+                        "missing": {k: [i for i in ids[k] if i not in found[k]] for k in ids}}), 200
+    except Exception as e:
+        app.logger.error(e)
+        return jsonify({"result": "KO", "error": "Internal error"}), 500
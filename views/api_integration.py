@@ -40,7 +40,12 @@ def task_status(task_id):
         task = celery.AsyncResult(task_id)
         if task.state == "PENDING":
             return jsonify({"result": "OK", "state": task.state}), 200
+        elif task.state == "PROGRESS":
+            return jsonify({"result": "OK", "state": task.state, "progress": task.info}), 200
         elif task.state == "SUCCESS":
+            # mu_all and dex_all end with their final progress document
+            if isinstance(task.result, dict):
+                return jsonify({"result": "OK", "state": task.state, "progress": task.result}), 200
             return jsonify({"result": "OK", "state": task.state, "task_result": str(task.result)}), 200
         elif task.state == "FAILURE":
             return jsonify({"result": "OK", "state": task.state, "error": str(task.result)}), 200
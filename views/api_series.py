@@ -1,11 +1,18 @@
 from flask import Blueprint, jsonify, request, current_app as app
-from utils.common_db import download_thumbnail, update_thumbnail, add_genres, get_author_id, get_series_info
-from utils.common_code import valid_ids
-import sqlite3
+from utils.common_db import download_thumbnail, update_thumbnail, add_genres, get_author_id, get_author_ids, \
+    get_series_info, find_series_ids
+from utils.common_code import valid_ids, encode_cursor, decode_cursor
+from utils.db_series import hydrate_series, search_series, fts_query
+from utils.db import get_cursor
+from utils import thumbnails
+from utils.http_cache import conditional
+import threading
+import json
 import time
-from typing import List, Tuple
+from typing import Any, Dict, List, Tuple
 
 api_series_bp = Blueprint("api_series", __name__, url_prefix="/series")
+bulk_batch_size = 500
 
 allowed_statuses = ["plan-to", "reading", "completed", "one-shots", "dropped", "on-hold", "ongoing"]
 allowed_types = ["all", "Manga", "Manhwa", "Manhua", "OEL", "Vietnamese", "Malaysian", "Indonesian",
@@ -33,6 +40,7 @@ def _valid_genres(genres: List[str]) -> List[str]:
 
 
 @api_series_bp.route("", methods=["GET"])
+@conditional
 def get_series_list() -> Tuple[jsonify, int]:
     try:
         sr = app.config["MAIN_RATING"]
@@ -65,133 +73,152 @@ def get_series_list() -> Tuple[jsonify, int]:
         genres_excluded = _valid_genres(genres_excluded)
         if any(genre in genres_included for genre in genres_excluded):
             return jsonify({"result": "KO", "error": "Genres cannot be both included and excluded"}), 400
+        after = []
+        if args.get("cursor"):
+            after = decode_cursor(args["cursor"])
+            # Types of the seek key that follows sort_by in the cursor, see seek_key below
+            key_types = {"name": (str, int), "time": (int, int)}.get(sort_by, ((int, float), str, int))
+            if len(after) != len(key_types) + 1 or after[0] != sort_by or \
+                    not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(after[1:], key_types)):
+                return jsonify({"result": "KO", "error": "Invalid cursor for this sort_by"}), 400
+            after = after[1:]
+
+        with get_cursor(row=True) as cursor:
+            select_clause = "SELECT DISTINCT s.*, si.extension"
+            from_clause = " FROM series s LEFT JOIN series_thumbnails si ON s.id = si.series_id "
+
+            params = []
+            where_conditions = []
+
+            # Every order ends with s.id, so (sort key, id) of the last row is a unique seek position for the next page
+            if sort_by.startswith("rating-") and (by := sort_by.split('-')[1]) in ("mu", "dex", "mal"):
+                from_clause += f"LEFT JOIN series_ratings_{by} sr ON sr.id_{by} = s.id_{by} "
+                select_clause += ", COALESCE(sr.rating, 0) AS rating"
+                order_clause = "ORDER BY COALESCE(sr.rating, 0) DESC, s.title ASC, s.id ASC "
+                seek_clause = "(-COALESCE(sr.rating, 0), s.title, s.id) > (?, ?, ?)"
+                seek_key = lambda r: [-r["rating"], r["title"], r["id"]]
+            else:
+                from_clause += f"LEFT JOIN series_ratings_{sr} sr ON sr.id_{sr} = s.id_{sr} "
+                select_clause += ", COALESCE(sr.rating, 0) AS rating"
+                if sort_by == "time":
+                    order_clause = "ORDER BY s.timestamp_status ASC, s.id ASC "
+                    seek_clause = "(s.timestamp_status, s.id) > (?, ?)"
+                    seek_key = lambda r: [r["timestamp_status"], r["id"]]
+                else:
+                    order_clause = "ORDER BY s.title ASC, s.id ASC "
+                    seek_clause = "(s.title, s.id) > (?, ?)"
+                    seek_key = lambda r: [r["title"], r["id"]]
+
+            if after:
+                where_conditions.append(seek_clause)
+                params.extend(after)
+
+            if status:
+                where_conditions.append("s.status = ?")
+                params.append(status)
+
+            if type_ != "all":
+                if type_ == "minor":
+                    where_conditions.append("s.type IN (?, ?, ?, ?, ?, ?, ?)")
+                    params.extend(["OEL", "Vietnamese", "Malaysian", "Indonesian", "Novel", "Artbook", "Other"])
+                else:
+                    where_conditions.append("s.type = ?")
+                    params.append(type_)
+
+            if genres_included:
+                subquery = """
+                s.id IN (
+                    SELECT sg.series_id FROM series_genres sg
+                    JOIN genres g ON sg.genre_id = g.id
+                    WHERE g.genre IN ({})
+                    GROUP BY sg.series_id
+                    HAVING COUNT(DISTINCT g.genre) = ?
+                )
+                """.format(','.join('?' * len(genres_included)))
+                where_conditions.append(subquery)
+                params.extend(genres_included)
+                params.append(len(genres_included))
+
+            if genres_excluded:
+                subquery = """
+                s.id NOT IN (
+                    SELECT sg.series_id FROM series_genres sg
+                    JOIN genres g ON sg.genre_id = g.id
+                    WHERE g.genre IN ({})
+                )
+                """.format(','.join('?' * len(genres_excluded)))
+                where_conditions.append(subquery)
+                params.extend(genres_excluded)
+
+            query = select_clause + from_clause
+            if where_conditions:
+                query += "WHERE " + " AND ".join(where_conditions) + " "
+
+            query += order_clause
+            if after:
+                query += "LIMIT ?"
+                params.append(per_page)
+            else:
+                query += "LIMIT ? OFFSET ?"
+                params.extend([per_page, (page - 1) * per_page])
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
 
-        select_clause = "SELECT DISTINCT s.*, si.extension"
-        from_clause = " FROM series s LEFT JOIN series_thumbnails si ON s.id = si.series_id "
+            series = hydrate_series(rows, cursor)
+            for row, series_data in zip(rows, series):
+                series_data["rating"] = row["rating"]
 
-        if sort_by.startswith("rating-") and (by := sort_by.split('-')[1]) in ("mu", "dex", "mal"):
-            from_clause += f"LEFT JOIN series_ratings_{by} sr ON sr.id_{by} = s.id_{by} "
-            select_clause += ", COALESCE(sr.rating, 0) AS rating"
-            order_clause = "ORDER BY sr.rating DESC, s.title ASC "
-        else:
-            from_clause += f"LEFT JOIN series_ratings_{sr} sr ON sr.id_{sr} = s.id_{sr} "
-            select_clause += ", COALESCE(sr.rating, 0) AS rating"
-            if sort_by == "title":
-                order_clause = "ORDER BY s.title ASC "
-            elif sort_by == "time":
-                order_clause = "ORDER BY s.timestamp_status ASC "
-            else:
-                order_clause = "ORDER BY s.title ASC "
+            next_cursor = encode_cursor([sort_by] + seek_key(rows[-1])) if len(rows) == per_page else None
+            return jsonify({"result": "OK", "data": series, "page": page, "next_cursor": next_cursor}), 200
 
-        params = []
-        where_conditions = []
+    except Exception as e:
+        app.logger.error(e)
+        return jsonify({"result": "KO", "error": "Internal error"}), 500
 
-        if status:
-            where_conditions.append("s.status = ?")
-            params.append(status)
 
-        if type_ != "all":
-            if type_ == "minor":
-                where_conditions.append(
-                    "s.type = ? OR s.type = ? OR s.type = ? OR s.type = ? OR s.type = ? OR s.type = ? OR s.type = ?")
-                params.extend(["OEL", "Vietnamese", "Malaysian", "Indonesian", "Novel", "Artbook", "Other"])
-            else:
-                where_conditions.append("s.type = ?")
-                params.append(type_)
-
-        if genres_included:
-            subquery = """
-            s.id IN (
-                SELECT sg.series_id FROM series_genres sg
-                JOIN genres g ON sg.genre_id = g.id
-                WHERE g.genre IN ({})
-                GROUP BY sg.series_id
-                HAVING COUNT(DISTINCT g.genre) = ?
-            )
-            """.format(','.join('?' * len(genres_included)))
-            where_conditions.append(subquery)
-            params.extend(genres_included)
-            params.append(len(genres_included))
-
-        if genres_excluded:
-            subquery = """
-            s.id NOT IN (
-                SELECT sg.series_id FROM series_genres sg
-                JOIN genres g ON sg.genre_id = g.id
-                WHERE g.genre IN ({})
-            )
-            """.format(','.join('?' * len(genres_excluded)))
-            where_conditions.append(subquery)
-            params.extend(genres_excluded)
-
-        query = select_clause + from_clause
-        if where_conditions:
-            query += "WHERE " + " AND ".join(where_conditions) + " "
-
-        offset = (page - 1) * per_page
-        query += order_clause
-        query += "LIMIT ? OFFSET ?"
-        params.extend([per_page, offset])
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-
-        series = []
-        for row in rows:
-            cursor.execute("""
-                           SELECT a.id, a.name, sa.author_type
-                           FROM series_authors sa
-                                    JOIN authors a ON sa.author_id = a.id
-                           WHERE sa.series_id = ?
-                           """, (row[0],))
-            authors = [{"id": a[0], "name": a[1], "type": a[2]} for a in cursor.fetchall()]
-            cursor.execute("""
-                           SELECT g.genre
-                           FROM series_genres sg
-                                    JOIN genres g ON sg.genre_id = g.id
-                           WHERE sg.series_id = ?
-                           """, (row[0],))
-            genres = [g[0] for g in cursor.fetchall()]
-            cursor.execute("SELECT alt_title FROM series_titles WHERE series_id = ?", (row[0],))
-            alt_titles = [t[0] for t in cursor.fetchall()]
-
-            series_data = {
-                "id": row["id"],
-                "thumbnail_ext": row["extension"],
-                "ids": {
-                    "mu": row["id_mu"],
-                    "dex": row["id_dex"],
-                    "mal": row["id_mal"],
-                    "bato": row["id_bato"],
-                    "line": row["id_line"],
-                },
-                "title": row["title"],
-                "alt_titles": alt_titles,
-                "type": row["type"],
-                "description": row["description"],
-                "vol_ch": row["vol_ch"],
-                "is_md": bool(row["is_md"]),
-                "genres": genres,
-                "status": row["status"],
-                "year": row["year"],
-                "authors": authors,
-                "rating": row["rating"],
-                "user_rating": row["user_rating"],
-            }
-            series.append(series_data)
-
-        conn.close()
-        return jsonify({"result": "OK", "data": series, "page": page}), 200
+@api_series_bp.route("/search", methods=["GET"])
+@conditional
+def search_series_list() -> Tuple[jsonify, int]:
+    try:
+        q = request.args.get("q", "").strip()
+        limit = max(min(request.args.get("limit", 30, type=int), 100), 1)
+        if not fts_query(q):
+            return jsonify({"result": "KO", "error": "Missing or invalid q parameter"}), 400
+
+        with get_cursor(row=True) as cursor:
+            rows = search_series(q, limit, cursor)
+            series = hydrate_series(rows, cursor)
+            return jsonify({"result": "OK", "data": series}), 200
 
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
 
 
+# Returns (ids, error); error is empty when the series can be created
+def _validate_new_series(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    if not all(field in data and data.get(field) for field in
+               ["ids", "title", "type", "status", "authors", "thumbnail"]):
+        return {}, {"result": "KO", "error": "Missing required fields"}
+    if not _valid_status(data["status"]):
+        return {}, {"result": "KO", "error": "Invalid status", "valid": allowed_statuses}
+    if not _valid_type(data["type"]):
+        return {}, {"result": "KO", "error": "Invalid type", "valid": allowed_types}
+    if not isinstance(data["ids"], dict) or not (ids := valid_ids(data["ids"])):
+        return {}, {"result": "KO", "error": "At least one valid ID is required"}
+    if not isinstance(data["authors"], list):
+        return {}, {"result": "KO", "error": "Missing or invalid author info"}
+    for author in data["authors"]:
+        if not isinstance(author, dict) or author.get("type") not in ["Author", "Artist", "Both"]:
+            return {}, {"result": "KO", "error": "Missing or invalid author info"}
+        if not (author.get("id") or author.get("ids")):
+            return {}, {"result": "KO", "error": "Author must have at least one ID (external or internal)."}
+    if (t := data.get("timestamp")) and (not isinstance(t, dict) or len(t) > 1):
+        return {}, {"result": "KO", "error": "Multiple timestamps provided, only one is allowed"}
+    return ids, {}
+
+
 @api_series_bp.route("", methods=["POST"])
 def create_series() -> Tuple[jsonify, int]:
     try:
@@ -199,115 +226,249 @@ def create_series() -> Tuple[jsonify, int]:
         # Validate parameters
         if not data:
             return jsonify({"result": "KO", "error": "No data provided"}), 400
-        if not all(field in data and data.get(field) for field in
-                   ["ids", "title", "type", "status", "authors", "thumbnail"]):
-            return jsonify({"result": "KO", "error": "Missing required fields"}), 400
-        if not _valid_status(data["status"]):
-            return jsonify({"result": "KO", "error": "Invalid status", "valid": allowed_statuses}), 400
-        if not _valid_type(data["type"]):
-            return jsonify({"result": "KO", "error": "Invalid type", "valid": allowed_types}), 400
-        if not (ids := valid_ids(data.get("ids"))):
-            return {"result": "KO", "error": "At least one valid ID is required"}, 400
-
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id FROM series WHERE id_mu = ? OR id_dex = ? OR id_bato = ? OR id_line = ? OR id_mal = ?",
-            (ids.get("mu"), ids.get("dex"), ids.get("bato"), ids.get("line"), ids.get("mal")))
-        row = cursor.fetchall()
-        if len(row) > 1:
-            return {"result": "MERGE_REQUIRED",
-                    "error": "Manual merge required for series with multiple IDs: " + ", ".join(str(i[0]) for i in row),
-                    "url": f"/series/merge?ids={','.join(str(r[0]) for r in row)}"}, 409
-        elif len(row) == 1:
-            sid = row[0][0]
-            return {"result": "MERGE_REQUIRED", "error": "Series with these IDs already exists, please use update.",
-                    "url": f"/series/{sid}"}, 409
-
-        authors = []
-        for author in data["authors"]:
-            if author.get("type") in ["Author", "Artist", "Both"]:
+        ids, error = _validate_new_series(data)
+        if error:
+            return jsonify(error), 400
+
+        with get_cursor(row=True) as cursor:
+            cursor.execute(
+                "SELECT id FROM series WHERE id_mu = ? OR id_dex = ? OR id_bato = ? OR id_line = ? OR id_mal = ?",
+                (ids.get("mu"), ids.get("dex"), ids.get("bato"), ids.get("line"), ids.get("mal")))
+            row = cursor.fetchall()
+            if len(row) > 1:
+                return {"result": "MERGE_REQUIRED",
+                        "error": "Manual merge required for series with multiple IDs: " + ", ".join(str(i[0]) for i in row),
+                        "url": f"/series/merge?ids={','.join(str(r[0]) for r in row)}"}, 409
+            elif len(row) == 1:
+                sid = row[0][0]
+                return {"result": "MERGE_REQUIRED", "error": "Series with these IDs already exists, please use update.",
+                        "url": f"/series/{sid}"}, 409
+
+            authors = []
+            for author in data["authors"]:
                 a_t = author["type"]
-            else:
-                return jsonify({"result": "KO", "error": "Missing or invalid author info"}), 400
-
-            if author.get("id"):
-                a_id = author["id"]
-            elif author.get("ids"):
-                r, s = get_author_id(author, cursor)
-                if s == 200:
-                    a_id = r[0]
-                elif s == 409:
-                    return jsonify(
-                        {"result": "MERGE_REQUIRED",
-                         "error": "Manual merge required for authors with multiple IDs: " + ", ".join(
-                             str(i) for i in r),
-                         "merge_url": f"/author/merge?ids={','.join(str(i) for i in r)}"}), 409
-                else:
-                    app.logger.info(f"Error getting author ID for {author}")
-                    return jsonify({"result": "KO", "error": "Internal error"}), 500
-            else:
-                return jsonify(
-                    {"result": "KO", "error": "Author must have at least one ID (external or internal)."}), 400
-            authors.append({"id": a_id, "type": a_t})
-
-        cursor.execute(f"""INSERT INTO series
-        (id_mu, id_dex, id_bato, id_mal, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id""",
-                       (ids.get("mu"), ids.get("dex"), ids.get("bato"), ids.get("mal"), ids.get("line"),
-                        data.get("title"), data.get("type"), data.get("description"), data.get("vol_ch"),
-                        data.get("is_md", False), data.get("status"), data.get("year"), int(time.time())))
-        id_ = cursor.fetchone()[0]
-
-        if data.get("timestamp"):
-            if len(data.get("timestamp")) == 1:
-                t = data["timestamp"]
+                if author.get("id"):
+                    a_id = author["id"]
+                elif author.get("ids"):
+                    r, s = get_author_id(author, cursor)
+                    if s == 200:
+                        a_id = r[0]
+                    elif s == 409:
+                        return jsonify(
+                            {"result": "MERGE_REQUIRED",
+                             "error": "Manual merge required for authors with multiple IDs: " + ", ".join(
+                                 str(i) for i in r),
+                             "merge_url": f"/author/merge?ids={','.join(str(i) for i in r)}"}), 409
+                    else:
+                        app.logger.info(f"Error getting author ID for {author}")
+                        return jsonify({"result": "KO", "error": "Internal error"}), 500
+                authors.append({"id": a_id, "type": a_t})
+
+            cursor.execute(f"""INSERT INTO series
+            (id_mu, id_dex, id_bato, id_mal, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id""",
+                           (ids.get("mu"), ids.get("dex"), ids.get("bato"), ids.get("mal"), ids.get("line"),
+                            data.get("title"), data.get("type"), data.get("description"), data.get("vol_ch"),
+                            data.get("is_md", False), data.get("status"), data.get("year"), int(time.time())))
+            id_ = cursor.fetchone()[0]
+
+            if t := data.get("timestamp"):
                 if (k := next(iter(t.keys()))) in ["mu", "dex", "mal"]:
                     cursor.execute(f"UPDATE series SET timestamp_{k} = ? WHERE id = ?", (t[k], id_))
-            elif len(data.get("timestamp")) > 1:
-                return jsonify({"result": "KO", "error": "Multiple timestamps provided, only one is allowed"}), 400
 
-        r, s = download_thumbnail(id_, data["thumbnail"], cursor)
-        if s != 201:
-            return jsonify(r), s
+            r, s = download_thumbnail(id_, data["thumbnail"], cursor)
+            if s != 201:
+                return jsonify(r), s
 
-        if authors:
-            cursor.executemany("INSERT INTO series_authors (series_id, author_id, author_type) VALUES (?, ?, ?)",
-                               [(id_, a["id"], a["type"]) for a in authors])
+            if authors:
+                cursor.executemany("INSERT INTO series_authors (series_id, author_id, author_type) VALUES (?, ?, ?)",
+                                   [(id_, a["id"], a["type"]) for a in authors])
 
-        if genres := _valid_genres(data.get("genres", [])):
-            add_genres(id_, genres, cursor)
+            if genres := _valid_genres(data.get("genres", [])):
+                add_genres(id_, genres, cursor)
 
-        if alt_titles := data.get("alt_titles"):
-            cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)",
-                               [(id_, title) for title in alt_titles])
+            if alt_titles := data.get("alt_titles"):
+                cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)",
+                                   [(id_, title) for title in alt_titles])
 
-        r, s = get_series_info(id_, cursor)
-        if s == 200:
-            conn.commit()
-            conn.close()
-            return jsonify({"result": "OK", "data": r}), 201
+            r, s = get_series_info(id_, cursor)
+            if s == 200:
+                cursor.connection.commit()
+                thumbnails.relink([id_], cursor)
+                return jsonify({"result": "OK", "data": r}), 201
+            else:
+                return jsonify({"result": "KO", "error": "Error retrieving created series"}), 500
+    except Exception as e:
+        app.logger.error(e)
+        return jsonify({"result": "KO", "error": "Internal error"}), 500
+
+
+# Thumbnails of bulk-created series are downloaded by Celery, or by a thread when background tasks are disabled
+def _queue_thumbnails(items: List[Tuple[int, str]]) -> None:
+    if not items:
+        return
+    if not app.config.get("REDIS_DISABLED"):
+        app.extensions["celery"].send_task("download_thumbnails", args=[items], priority=1)
+        return
+    from utils.tasks_2 import download_thumbnails
+    flask_app = app._get_current_object()
+
+    def run():
+        with flask_app.app_context():
+            download_thumbnails(items)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+# Inserts one batch of validated rows [(line, data, ids)] in a single transaction, returns {line: result}
+def _bulk_insert(batch: List[Tuple[int, Dict[str, Any], Dict[str, Any]]], genre_ids: Dict[str, int],
+                 cursor) -> Dict[int, Dict[str, Any]]:
+    results = {}
+    seen = {k: {} for k in ("mu", "dex", "bato", "line", "mal")}  # type: {external id: line}, duplicates in the upload
+    rows = []
+    for (n, data, ids), matches in zip(batch, find_series_ids([ids for _, _, ids in batch], cursor)):
+        if len(matches) > 1:
+            results[n] = {"result": "MERGE_REQUIRED",
+                          "error": "Manual merge required for series with multiple IDs: " + ", ".join(str(i) for i in matches),
+                          "url": f"/series/merge?ids={','.join(str(i) for i in matches)}"}
+        elif matches:
+            results[n] = {"result": "MERGE_REQUIRED", "error": "Series with these IDs already exists, please use update.",
+                          "url": f"/series/{matches[0]}"}
+        elif (dup := next((seen[k][str(v)] for k, v in ids.items() if str(v) in seen[k]), None)) is not None:
+            results[n] = {"result": "KO", "error": f"Duplicate of line {dup}"}
         else:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Error retrieving created series"}), 500
+            for k, v in ids.items():
+                seen[k][str(v)] = n
+            rows.append((n, data, ids))
+
+    external = [a for _, data, _ in rows for a in data["authors"] if not a.get("id")]
+    resolved = iter(get_author_ids(external, cursor))
+    created_authors = set()
+    ok = []
+    for n, data, ids in rows:
+        authors = []
+        for author in data["authors"]:
+            if author.get("id"):
+                authors.append((author["id"], author["type"]))
+                continue
+            r, s = next(resolved)
+            if s == 201:
+                created_authors.add(r[0])
+            if s in (200, 201):
+                authors.append((r[0], author["type"]))
+            elif s == 409 and n not in results:
+                results[n] = {"result": "MERGE_REQUIRED",
+                              "error": "Manual merge required for authors with multiple IDs: " + ", ".join(str(i) for i in r),
+                              "merge_url": f"/author/merge?ids={','.join(str(i) for i in r)}"}
+            elif n not in results:
+                results[n] = {"result": "KO", "error": "Missing or invalid author info"}
+        if n not in results:
+            ok.append((n, data, ids, authors))
+    # Authors created only for rows that failed
+    if unused := created_authors - {a_id for _, _, _, authors in ok for a_id, _ in authors}:
+        cursor.executemany("DELETE FROM authors WHERE id = ?", [(i,) for i in unused])
+
+    if ok:
+        now = int(time.time())
+        cursor.executemany("""INSERT INTO series
+        (id_mu, id_dex, id_bato, id_mal, id_line, title, type, description, vol_ch, is_md, status, year, timestamp_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                           [(ids.get("mu"), ids.get("dex"), ids.get("bato"), ids.get("mal"), ids.get("line"),
+                             data.get("title"), data.get("type"), data.get("description"), data.get("vol_ch"),
+                             data.get("is_md", False), data.get("status"), data.get("year"), now)
+                            for _, data, ids, _ in ok])
+        # The write lock is held since the insert and ids are autoincrement, so the newest ids are this batch's, in order
+        cursor.execute("SELECT id FROM series ORDER BY id DESC LIMIT ?", (len(ok),))
+        series_ids = [r[0] for r in reversed(cursor.fetchall())]
+
+        timestamps = {}
+        series_authors, series_genres, series_titles = [], [], []
+        for id_, (n, data, ids, authors) in zip(series_ids, ok):
+            if (t := data.get("timestamp")) and (k := next(iter(t.keys()))) in ["mu", "dex", "mal"]:
+                timestamps.setdefault(k, []).append((t[k], id_))
+            series_authors += [(id_, a_id, a_t) for a_id, a_t in authors]
+            series_genres += sorted((id_, genre_ids[g]) for g in set(_valid_genres(data.get("genres") or []))
+                                    if g in genre_ids)
+            series_titles += [(id_, title) for title in dict.fromkeys(data.get("alt_titles") or [])]
+            results[n] = {"result": "OK", "id": id_}
+        for k, values in timestamps.items():
+            cursor.executemany(f"UPDATE series SET timestamp_{k} = ? WHERE id = ?", values)
+        cursor.executemany("INSERT INTO series_authors (series_id, author_id, author_type) VALUES (?, ?, ?)",
+                           series_authors)
+        cursor.executemany("INSERT INTO series_genres (series_id, genre_id) VALUES (?, ?)", series_genres)
+        cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)", series_titles)
+    cursor.connection.commit()
+    if ok:
+        _queue_thumbnails([(id_, data["thumbnail"]) for id_, (_, data, _, _) in zip(series_ids, ok)])
+    return results
+
+
+# NDJSON upload, one POST /series body per line. Lines are validated as they are read and written in batches
+# of bulk_batch_size rows; thumbnails are downloaded afterwards in the background.
+@api_series_bp.route("/bulk", methods=["POST"])
+def bulk_create_series() -> Tuple[jsonify, int]:
+    try:
+        results = {}
+        with get_cursor() as cursor:
+            cursor.execute("SELECT genre, id FROM genres")
+            genre_ids = dict(cursor.fetchall())
+
+            def flush(batch):
+                try:
+                    results.update(_bulk_insert(batch, genre_ids, cursor))
+                except Exception as e:
+                    cursor.connection.rollback()
+                    app.logger.error(e)
+                    results.update({n: {"result": "KO", "error": "Internal error"} for n, _, _ in batch})
+
+            batch = []
+            for n, line in enumerate(request.stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    results[n] = {"result": "KO", "error": "Invalid JSON"}
+                    continue
+                if not isinstance(data, dict) or not data:
+                    results[n] = {"result": "KO", "error": "No data provided"}
+                    continue
+                # A line that can't be validated is reported on its own, the rest of the upload goes on
+                try:
+                    ids, error = _validate_new_series(data)
+                except Exception as e:
+                    app.logger.error(f"line {n}: {e}")
+                    ids, error = {}, {"result": "KO", "error": "Invalid data"}
+                if error:
+                    results[n] = error
+                    continue
+                batch.append((n, data, ids))
+                if len(batch) >= bulk_batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+
+        if not results:
+            return jsonify({"result": "KO", "error": "No data provided"}), 400
+        created = sum(1 for r in results.values() if r["result"] == "OK")
+        return jsonify({"result": "OK", "created": created, "failed": len(results) - created,
+                        "data": [{"line": n, **results[n]} for n in sorted(results)]}), 200
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
 
 
 @api_series_bp.route("/<int:id_>", methods=["GET"])
+@conditional
 def get_series_by_id(id_) -> Tuple[jsonify, int]:
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        r, s = get_series_info(id_, cursor)
-        conn.close()
-        if s == 200:
-            return jsonify({"result": "OK", "data": r}), 200
-        else:
-            return jsonify(r), s
+        with get_cursor(row=True) as cursor:
+            r, s = get_series_info(id_, cursor)
+            if s == 200:
+                return jsonify({"result": "OK", "data": r}), 200
+            else:
+                return jsonify(r), s
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
@@ -316,37 +477,31 @@ def get_series_by_id(id_) -> Tuple[jsonify, int]:
 @api_series_bp.route("/<int:id_>", methods=["DELETE"])
 def delete_series(id_) -> Tuple[jsonify, int]:
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        r, s = get_series_info(id_, cursor)
-        if s == 404:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Series not found"}), 404
-        elif s != 200:
-            conn.close()
-            return jsonify(r), s
-
-        authors_to_delete = []
-        for author in r.get("authors"):
-            cursor.execute("SELECT COUNT(*) FROM series_authors WHERE author_id = ?", (author["id"],))
-            if cursor.fetchone()[0] == 1:
-                authors_to_delete.append(author["id"])
-
-        cursor.execute("DELETE FROM series WHERE id = ?", (id_,))
-
-        if authors_to_delete:
-            cursor.executemany("DELETE FROM authors WHERE id = ?", [(a_id,) for a_id in authors_to_delete])
-
-        conn.commit()
-        conn.close()
-        try:
-            with open(f"data/thumbnails/{id_}.{r.get("thumbnail_ext")}", "wb") as f:
-                f.write(b"")
-        except Exception as e:
-            app.logger.error(f"Thumbnail could not be deleted for {r.get('title')}: {e}")
-
-        return jsonify({"result": "OK", "data": r}), 200
+        with get_cursor(row=True) as cursor:
+            r, s = get_series_info(id_, cursor)
+            if s == 404:
+                return jsonify({"result": "KO", "error": "Series not found"}), 404
+            elif s != 200:
+                return jsonify(r), s
+
+            authors_to_delete = []
+            for author in r.get("authors"):
+                cursor.execute("SELECT COUNT(*) FROM series_authors WHERE author_id = ?", (author["id"],))
+                if cursor.fetchone()[0] == 1:
+                    authors_to_delete.append(author["id"])
+
+            cursor.execute("DELETE FROM series WHERE id = ?", (id_,))
+
+            if authors_to_delete:
+                cursor.executemany("DELETE FROM authors WHERE id = ?", [(a_id,) for a_id in authors_to_delete])
+
+            cursor.connection.commit()
+            try:
+                thumbnails.unlink(id_)
+            except Exception as e:
+                app.logger.error(f"Thumbnail could not be deleted for {r.get('title')}: {e}")
+
+            return jsonify({"result": "OK", "data": r}), 200
 
     except Exception as e:
         app.logger.error(e)
@@ -360,111 +515,99 @@ def update_series(id_) -> Tuple[jsonify, int]:
         if not data:
             return jsonify({"result": "KO", "error": "No data provided"}), 400
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        r, s = get_series_info(id_, cursor)
-        if s == 404:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Series not found"}), 404
-        elif s != 200:
-            conn.close()
-            return jsonify(r), s
-
-        ids = None
-        if "ids" in data:
-            if not (ids := valid_ids(data.get("ids"))):
-                conn.close()
-                return jsonify({"result": "KO", "error": "IDs not valid"}), 400
-            for key, value in ids.items():
-                cursor.execute(f"SELECT id FROM series WHERE id_{key} = ? AND id != ?", (value, id_))
-                if cursor.fetchone():
-                    conn.close()
-                    return jsonify({"result": "KO", "error": f"Series with {key} ID {value} already exists"}), 409
-
-        if "status" in data and not _valid_status(data["status"]):
-            conn.close()
-            return jsonify({"result": "KO", "error": "Invalid status", "valid": allowed_statuses}), 400
-
-        if "type" in data and not _valid_type(data["type"]):
-            conn.close()
-            return jsonify({"result": "KO", "error": "Invalid type", "valid": allowed_types}), 400
-
-        if "timestamp" in data and len(data["timestamp"]) != 1:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Multiple timestamps provided, only one is allowed"}), 400
-
-        if "integration" in data and not isinstance(data["integration"], bool):
-            conn.close()
-            return jsonify({"result": "KO", "error": "Invalid integration value, must be boolean"}), 400
-
-        update_fields = []
-        update_params = []
+        with get_cursor(row=True) as cursor:
+            r, s = get_series_info(id_, cursor)
+            if s == 404:
+                return jsonify({"result": "KO", "error": "Series not found"}), 404
+            elif s != 200:
+                return jsonify(r), s
 
-        series_fields = ["title", "type", "description", "vol_ch", "is_md", "status", "year"]
-        for field in series_fields:
-            if field in data:
-                update_fields.append(f"{field} = ?")
-                update_params.append(data[field])
+            ids = None
+            if "ids" in data:
+                if not (ids := valid_ids(data.get("ids"))):
+                    return jsonify({"result": "KO", "error": "IDs not valid"}), 400
+                for key, value in ids.items():
+                    cursor.execute(f"SELECT id FROM series WHERE id_{key} = ? AND id != ?", (value, id_))
+                    if cursor.fetchone():
+                        return jsonify({"result": "KO", "error": f"Series with {key} ID {value} already exists"}), 409
 
-        if "status" in data:
-            update_fields.append("timestamp_status = ?")
-            update_params.append(int(time.time()))
+            if "status" in data and not _valid_status(data["status"]):
+                return jsonify({"result": "KO", "error": "Invalid status", "valid": allowed_statuses}), 400
 
-        if ids:
-            id_fields = ["mu", "dex", "mal", "bato", "line"]
-            for field in id_fields:
-                if field in ids:
-                    update_fields.append(f"id_{field} = ?")
-                    update_params.append(ids[field])
+            if "type" in data and not _valid_type(data["type"]):
+                return jsonify({"result": "KO", "error": "Invalid type", "valid": allowed_types}), 400
 
-        if "timestamp" in data:
-            t = data["timestamp"]
-            for i in ["mu", "dex", "mal"]:
-                if i in t:
-                    update_fields.append(f"timestamp_{i} = ?")
-                    update_params.append(t[i])
-                else:
-                    update_fields.append(f"timestamp_{i} = NULL")
+            if "timestamp" in data and len(data["timestamp"]) != 1:
+                return jsonify({"result": "KO", "error": "Multiple timestamps provided, only one is allowed"}), 400
 
-        if "integration" in data:
-            if isinstance(data["integration"], bool):
-                update_fields.append("integration = ?")
-                update_params.append(1 if data["integration"] else 0)
+            if "integration" in data and not isinstance(data["integration"], bool):
+                return jsonify({"result": "KO", "error": "Invalid integration value, must be boolean"}), 400
 
-        if update_fields:
-            query = f"UPDATE series SET {', '.join(update_fields)} WHERE id = ?"
-            update_params.append(id_)
-            cursor.execute(query, update_params)
+            update_fields = []
+            update_params = []
 
-        if "genres" in data:
-            cursor.execute("DELETE FROM series_genres WHERE series_id = ?", (id_,))
-            if genres := _valid_genres(data["genres"]):
-                add_genres(id_, genres, cursor)
-            cursor.execute("UPDATE series SET integration_genres = 0 WHERE id = ?", (id_,))
+            series_fields = ["title", "type", "description", "vol_ch", "is_md", "status", "year"]
+            for field in series_fields:
+                if field in data:
+                    update_fields.append(f"{field} = ?")
+                    update_params.append(data[field])
 
-        if "alt_titles" in data:
-            cursor.execute("DELETE FROM series_titles WHERE series_id = ?", (id_,))
-            if alt_titles := data["alt_titles"]:
-                cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)",
-                                   [(id_, title) for title in alt_titles])
+            if "status" in data:
+                update_fields.append("timestamp_status = ?")
+                update_params.append(int(time.time()))
 
-        if "thumbnail" in data:
-            r, s = update_thumbnail(id_, data["thumbnail"], cursor)
-            if s != 201:
-                conn.close()
-                return jsonify(r), s
-            cursor.execute("UPDATE series_thumbnails SET integration = 0 WHERE series_id = ?", (id_,))
+            if ids:
+                id_fields = ["mu", "dex", "mal", "bato", "line"]
+                for field in id_fields:
+                    if field in ids:
+                        update_fields.append(f"id_{field} = ?")
+                        update_params.append(ids[field])
 
-        r, s = get_series_info(id_, cursor)
-        if s == 200:
-            conn.commit()
-            conn.close()
-            return jsonify({"result": "OK", "data": r}), 200
-        else:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Error retrieving updated series"}), 500
+            if "timestamp" in data:
+                t = data["timestamp"]
+                for i in ["mu", "dex", "mal"]:
+                    if i in t:
+                        update_fields.append(f"timestamp_{i} = ?")
+                        update_params.append(t[i])
+                    else:
+                        update_fields.append(f"timestamp_{i} = NULL")
+
+            if "integration" in data:
+                if isinstance(data["integration"], bool):
+                    update_fields.append("integration = ?")
+                    update_params.append(1 if data["integration"] else 0)
+
+            if update_fields:
+                query = f"UPDATE series SET {', '.join(update_fields)} WHERE id = ?"
+                update_params.append(id_)
+                cursor.execute(query, update_params)
+
+            if "genres" in data:
+                cursor.execute("DELETE FROM series_genres WHERE series_id = ?", (id_,))
+                if genres := _valid_genres(data["genres"]):
+                    add_genres(id_, genres, cursor)
+                cursor.execute("UPDATE series SET integration_genres = 0 WHERE id = ?", (id_,))
+
+            if "alt_titles" in data:
+                cursor.execute("DELETE FROM series_titles WHERE series_id = ?", (id_,))
+                if alt_titles := data["alt_titles"]:
+                    cursor.executemany("INSERT INTO series_titles (series_id, alt_title) VALUES (?, ?)",
+                                       [(id_, title) for title in alt_titles])
+
+            if "thumbnail" in data:
+                r, s = update_thumbnail(id_, data["thumbnail"], cursor)
+                if s != 201:
+                    return jsonify(r), s
+                cursor.execute("UPDATE series_thumbnails SET integration = 0 WHERE series_id = ?", (id_,))
+
+            r, s = get_series_info(id_, cursor)
+            if s == 200:
+                cursor.connection.commit()
+                if "thumbnail" in data:
+                    thumbnails.relink([id_], cursor)
+                return jsonify({"result": "OK", "data": r}), 200
+            else:
+                return jsonify({"result": "KO", "error": "Error retrieving updated series"}), 500
 
     except Exception as e:
         app.logger.error(e)
@@ -478,70 +621,60 @@ def update_series_ratings(id_):
         if not data:
             return jsonify({"result": "KO", "error": "No data provided"}), 400
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        r, s = get_series_info(id_, cursor)
-        if s == 404:
-            conn.close()
-            return jsonify({"result": "KO", "error": "Series not found"}), 404
-        elif s != 200:
-            conn.close()
-            return jsonify(r), s
-
-        if (user_rating := data.get("user_rating")) is not None:
-            if not isinstance(user_rating, (int, float)) or not (1 <= float(user_rating) <= 10):
-                conn.close()
-                return jsonify(
-                    {"result": "KO", "error": "Invalid user rating, must be a number between 1 and 10"}), 400
-            cursor.execute("SELECT user_rating FROM series WHERE id = ?", (id_,))
-            old_rating = cursor.fetchone()[0]
-            if old_rating != user_rating:
-                cursor.execute("UPDATE series SET user_rating = ? WHERE id = ?", (user_rating, id_))
-
-        ids_map = r.get("ids", {})
-        for i in ["mu", "dex", "mal"]:
-            rating_key = f"{i}_rating"
-            votes_key = f"{i}_votes"
-            if votes_key in data and data[votes_key] is not None:
-                try:
-                    if int(data[votes_key]) < 1:
-                        conn.close()
-                        return jsonify({"result": "KO", "error": f"Invalid {votes_key}, must be >= 1"}), 400
-                except ValueError:
-                    conn.close()
-                    return jsonify({"result": "KO", "error": f"Invalid {votes_key}, must be an integer"}), 400
-            if rating_key in data:
-                rating = data[rating_key]
-                votes = data.get(votes_key)
-                if rating is None or not (1 <= float(rating) <= 10):
-                    conn.close()
-                    return jsonify({"result": "KO", "error": f"Invalid {rating_key}, must be between 1 and 10"}), 400
-                ext_id = ids_map.get(i)
-                if not ext_id:
-                    # cannot update without external id for that source
-                    continue
-                # check existing
-                cursor.execute(f"SELECT rating, votes FROM series_ratings_{i} WHERE id_{i} = ?", (ext_id,))
-                row = cursor.fetchone()
-                if row is None:
-                    # insert
-                    cursor.execute(
-                        f"INSERT INTO series_ratings_{i} (id_{i}, rating, votes) VALUES (?, ?, ?)",
-                        (ext_id, float(rating), int(votes) if votes is not None else 0),
-                    )
-                else:
-                    old_rating, old_votes = row[0], row[1]
-                    if old_rating != float(rating):
-                        cursor.execute(f"UPDATE series_ratings_{i} SET rating = ? WHERE id_{i} = ?",
-                                       (float(rating), ext_id))
-                    if votes is not None and old_votes != int(votes):
-                        cursor.execute(f"UPDATE series_ratings_{i} SET votes = ? WHERE id_{i} = ?",
-                                       (int(votes), ext_id))
-        conn.commit()
-        conn.close()
-        return "", 204
+        with get_cursor(row=True) as cursor:
+            r, s = get_series_info(id_, cursor)
+            if s == 404:
+                return jsonify({"result": "KO", "error": "Series not found"}), 404
+            elif s != 200:
+                return jsonify(r), s
+
+            if (user_rating := data.get("user_rating")) is not None:
+                if not isinstance(user_rating, (int, float)) or not (1 <= float(user_rating) <= 10):
+                    return jsonify(
+                        {"result": "KO", "error": "Invalid user rating, must be a number between 1 and 10"}), 400
+                cursor.execute("SELECT user_rating FROM series WHERE id = ?", (id_,))
+                old_rating = cursor.fetchone()[0]
+                if old_rating != user_rating:
+                    cursor.execute("UPDATE series SET user_rating = ? WHERE id = ?", (user_rating, id_))
+
+            ids_map = r.get("ids", {})
+            for i in ["mu", "dex", "mal"]:
+                rating_key = f"{i}_rating"
+                votes_key = f"{i}_votes"
+                if votes_key in data and data[votes_key] is not None:
+                    try:
+                        if int(data[votes_key]) < 1:
+                            return jsonify({"result": "KO", "error": f"Invalid {votes_key}, must be >= 1"}), 400
+                    except ValueError:
+                        return jsonify({"result": "KO", "error": f"Invalid {votes_key}, must be an integer"}), 400
+                if rating_key in data:
+                    rating = data[rating_key]
+                    votes = data.get(votes_key)
+                    if rating is None or not (1 <= float(rating) <= 10):
+                        return jsonify({"result": "KO", "error": f"Invalid {rating_key}, must be between 1 and 10"}), 400
+                    ext_id = ids_map.get(i)
+                    if not ext_id:
+                        # cannot update without external id for that source
+                        continue
+                    # check existing
+                    cursor.execute(f"SELECT rating, votes FROM series_ratings_{i} WHERE id_{i} = ?", (ext_id,))
+                    row = cursor.fetchone()
+                    if row is None:
+                        # insert
+                        cursor.execute(
+                            f"INSERT INTO series_ratings_{i} (id_{i}, rating, votes) VALUES (?, ?, ?)",
+                            (ext_id, float(rating), int(votes) if votes is not None else 0),
+                        )
+                    else:
+                        old_rating, old_votes = row[0], row[1]
+                        if old_rating != float(rating):
+                            cursor.execute(f"UPDATE series_ratings_{i} SET rating = ? WHERE id_{i} = ?",
+                                           (float(rating), ext_id))
+                        if votes is not None and old_votes != int(votes):
+                            cursor.execute(f"UPDATE series_ratings_{i} SET votes = ? WHERE id_{i} = ?",
+                                           (int(votes), ext_id))
+            cursor.connection.commit()
+            return "", 204
     except Exception as e:
         app.logger.error(e)
         return jsonify({"result": "KO", "error": "Internal error"}), 500
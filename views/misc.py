@@ -1,6 +1,7 @@
-from flask import Blueprint, request, Response, jsonify, current_app as app
-import requests
-from utils.line import get_thumbnail as line_thumbnail
+from flask import Blueprint, request, Response, jsonify, send_file, current_app as app
+from werkzeug.http import parse_date
+from utils import thumbnails, proxy_cache
+from utils.db import get_cursor
 
 misc_bp = Blueprint("misc", __name__)
 
@@ -8,24 +9,72 @@ misc_bp = Blueprint("misc", __name__)
 @misc_bp.route("/thumbnail-proxy", methods=["GET"])
 # url: "/thumbnail-proxy?url={mangadex_url}" or "/thumbnail-proxy?url=line://{/thumbnail_url}"
 def proxy_image():
-        url = request.args.get('url')
-        if not url:
-            return jsonify({"result": "KO", "error": "Missing url parameter"}), 400
-        if url.startswith("https://uploads.mangadex.org/"):
-            try:
-                resp = requests.get(url, timeout=10)
-                if resp.status_code != 200:
-                    app.logger.error(f"for {url}, upstream returned {resp.status_code}")
-                    return jsonify({"result": "KO", 'message': "Upstream error"}), 502
-                return Response(resp.content, mimetype=resp.headers.get("content-type", "image/jpeg")), 200
-            except Exception as e:
-                app.logger.error(f"for {url}, {e}")
-                return jsonify({"result": "KO", "error": "Unexpected error"}), 500
-        elif url.startswith("line://"):
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"result": "KO", "error": "Missing url parameter"}), 400
+    if not url.startswith(("https://uploads.mangadex.org/", "line://")):
+        return jsonify({"result": "KO", "error": "Invalid URL"}), 400
+    try:
+        # Upstream covers never change behind the same URL, so the URL hash is a valid ETag
+        etag = proxy_cache.key(url)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = proxy_cache.max_age
+            return response
+
+        entry = proxy_cache.get(url)
+        if entry is None:
+            meta, body = proxy_cache.fetch(url)
+            if meta is None:
+                return jsonify({"result": "KO", 'message': "Upstream error"}), 502
+            if body is not None:
+                response = Response(body, mimetype=meta["mimetype"])
+                response.set_etag(etag)
+                response.headers["Last-Modified"] = meta["last_modified"]
+                response.cache_control.public = True
+                response.cache_control.max_age = proxy_cache.max_age
+                return response
+            if (entry := proxy_cache.get(url)) is None:
+                return jsonify({"result": "KO", 'message': "Upstream error"}), 502
+
+        path, meta = entry
+        return send_file(path, mimetype=meta["mimetype"], etag=etag, max_age=proxy_cache.max_age,
+                         last_modified=parse_date(meta["last_modified"]))
+    except Exception as e:
+        app.logger.error(f"for {url}, {e}")
+        return jsonify({"result": "KO", "error": "Unexpected error"}), 500
+
+
+@misc_bp.route("/thumbnails/<int:id_>", methods=["GET"])
+# w: display width in px, served as the smallest variant (128/256/512) that covers it, in AVIF or WebP when accepted
+def thumbnail(id_):
+    try:
+        with get_cursor() as cursor:
+            cursor.execute("SELECT extension, hash FROM series_thumbnails WHERE series_id = ?", (id_,))
+            row = cursor.fetchone()
+        if not row:
+            return jsonify({"result": "KO", "error": "Thumbnail not found"}), 404
+        ext, hash_ = row
+        if not hash_:
+            # Not moved to the store yet (see thumbnails.gc)
+            return send_file(thumbnails.series_path(id_, ext), mimetype=f"image/{ext}", max_age=3600)
+
+        path, mimetype, etag = thumbnails.object_path(hash_, ext), f"image/{ext}", hash_
+        w = request.args.get("w", type=int)
+        if w and w > 0 and (fmt := thumbnails.variant_format(request.headers.get("Accept", ""))):
+            width = thumbnails.variant_width(w)
             try:
-                return Response(line_thumbnail(url[7:]), mimetype="image/jpeg"), 200
+                path = thumbnails.variant(hash_, ext, width, fmt)
+                mimetype, etag = thumbnails.variant_formats[fmt][0], f"{hash_}_{width}.{fmt}"
             except Exception as e:
-                app.logger.error(f"for {url}, {e}")
-                return jsonify({"result": "KO", "error": "Unexpected error"}), 500
-        else:
-            return jsonify({"result": "KO", "error": "Invalid URL"}), 400
+                app.logger.error(f"Failed to resize thumbnail of series {id_}, serving the original: {e}")
+        response = send_file(path, mimetype=mimetype, etag=etag, max_age=3600)
+        response.vary.add("Accept")
+        return response
+    except FileNotFoundError:
+        return jsonify({"result": "KO", "error": "Thumbnail not found"}), 404
+    except Exception as e:
+        app.logger.error(f"for {id_}, {e}")
+        return jsonify({"result": "KO", "error": "Unexpected error"}), 500
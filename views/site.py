@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, send_from_directory, request, redirect, session, current_app as app
 from utils.db_authors import get_author, get_authors
-import sqlite3
+from utils.db import get_cursor
 
 site_bp = Blueprint("site", __name__)
 
@@ -49,13 +49,12 @@ def series_list(status):
 @site_bp.route("/series/<int:id_>")
 def series_redirect(id_):
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM series WHERE id = ?", (id_,))
-        status = cursor.fetchone()
-        if status:
-            return redirect("/series/status/id_", 302)
-        return render_template("404.html"), 404
+        with get_cursor() as cursor:
+            cursor.execute("SELECT status FROM series WHERE id = ?", (id_,))
+            status = cursor.fetchone()
+            if status:
+                return redirect("/series/status/id_", 302)
+            return render_template("404.html"), 404
     except Exception as e:
         app.logger.error(f"Error in series_redirect: {e}")
         return "Internal Server Error", 500
@@ -68,17 +67,15 @@ def series(status, series_id):
         if status not in allowed_status:
             return render_template("404.html"), 404
 
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM series WHERE id = ?", (series_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with get_cursor() as cursor:
+            cursor.execute("SELECT status FROM series WHERE id = ?", (series_id,))
+            row = cursor.fetchone()
 
-        if not row:
-            return render_template("404.html"), 404
-        elif row != status:
-            return redirect(f"/series/{row}/{series_id}", 302)
-        return render_template("series.html")
+            if not row:
+                return render_template("404.html"), 404
+            elif row != status:
+                return redirect(f"/series/{row}/{series_id}", 302)
+            return render_template("series.html")
     except Exception as e:
         app.logger.error(f"Failed to return series with id {series_id} page: {e}")
         return "Internal Server Error", 500
@@ -106,12 +103,13 @@ def series_merge():
 def authors():
     try:
         page = int(request.args.get("page", 1))
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        data = get_authors(page, cursor)
-        conn.close()
-        if data:
-            return render_template("authors.html", data=data)
+        sort_by = request.args.get("sort_by", "id")
+        if sort_by not in ("id", "name", "series"):
+            sort_by = "id"
+        with get_cursor() as cursor:
+            data = get_authors(page, cursor, sort_by=sort_by, name=request.args.get("name", "").strip())
+            if data:
+                return render_template("authors.html", data=data)
     except Exception as e:
         app.logger.error(f"Failed to return authors page: {e}")
     return "Internal Server Error", 500
@@ -120,14 +118,12 @@ def authors():
 @site_bp.route("/authors/<int:author_id>")
 def author(author_id):
     try:
-        conn = sqlite3.connect("data/mml.sqlite3")
-        cursor = conn.cursor()
-        data, s = get_author(author_id, cursor)
-        conn.close()
-        if s == 404:
-            return render_template("404.html"), 404
-        if s == 200:
-            return render_template("author.html", data=data)
+        with get_cursor() as cursor:
+            data, s = get_author(author_id, cursor)
+            if s == 404:
+                return render_template("404.html"), 404
+            if s == 200:
+                return render_template("author.html", data=data)
     except Exception as e:
         app.logger.error(f"Failed to return author page: {e}")
     return "Internal Server Error", 500